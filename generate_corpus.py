@@ -0,0 +1,96 @@
+#!/usr/bin/env python3
+"""
+合成レシートコーパス生成スクリプト
+シードから再現可能なレシート本文（任意で画像）を JSON Lines で書き出す。
+--evaluate で金額抽出（CurrencyConverter.extract_amounts）の処理速度と合計金額の検出率を集計する
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+from pathlib import Path
+from typing import Dict, Any, Iterable
+
+# プロジェクトのルートディレクトリをパスに追加
+sys.path.append(str(Path(__file__).parent))
+
+from src.config_manager import ConfigManager
+from src.currency_converter import CurrencyConverter
+from src.receipt_corpus import ReceiptCorpusGenerator, LOCALES, parse_size_weights
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """コマンドライン引数の解析"""
+    parser = argparse.ArgumentParser(description="海外支出ガイド MVP - 合成レシートコーパス生成")
+    parser.add_argument("-n", "--receipts", type=int, default=1000, help="生成するレシート数")
+    parser.add_argument("--seed", type=int, default=0, help="乱数シード（同じシード・番号なら同じレシート）")
+    parser.add_argument("--start", type=int, default=0, help="生成を始めるレシート番号（分割生成用）")
+    parser.add_argument("-o", "--output", default="-", help="出力する JSON Lines ファイル（- で標準出力）")
+    parser.add_argument("--images", metavar="DIR", default=None,
+                        help="レシート画像（<receipt_id>.jpg）の出力先（省略時は画像を生成しない）")
+    parser.add_argument("--font", default=None,
+                        help="画像の描画に使う TrueType フォント（ラテン文字以外を描画する場合に指定）")
+    parser.add_argument("--locales", default=None,
+                        help=f"生成するロケール（カンマ区切り: {','.join(LOCALES)}）")
+    parser.add_argument("--sizes", default=None,
+                        help="明細行数区分の割合（例: tiny=1,typical=8,long=1,pathological=0）")
+    parser.add_argument("--evaluate", action="store_true",
+                        help="書き出す代わりに金額抽出を実行し、処理速度と合計金額の検出率を表示します")
+    parser.add_argument("--config", default="config.yaml", help="設定ファイル（--evaluate で使用）")
+    return parser.parse_args(argv)
+
+def evaluate(receipts: Iterable[Dict[str, Any]], currency_converter: CurrencyConverter) -> Dict[str, Any]:
+    """金額抽出を実行し、ロケールごとの合計金額（金額・通貨とも一致）の検出率を集計"""
+    by_locale: Dict[str, Dict[str, Any]] = {}
+    count = 0
+    started = time.perf_counter()
+    for receipt in receipts:
+        amounts = currency_converter.extract_amounts(receipt["text"])
+        found = any(abs(amount["amount"] - receipt["total"]) < 0.005 and amount["currency"] == receipt["currency"]
+                    for amount in amounts)
+        stats = by_locale.setdefault(receipt["locale"], {"receipts": 0, "total_found": 0, "amounts": 0})
+        stats["receipts"] += 1
+        stats["total_found"] += int(found)
+        stats["amounts"] += len(amounts)
+        count += 1
+    elapsed = time.perf_counter() - started
+    
+    for stats in by_locale.values():
+        stats["total_found_rate"] = round(stats["total_found"] / stats["receipts"], 3)
+    return {
+        "receipts": count,
+        "elapsed_seconds": round(elapsed, 3),
+        "receipts_per_second": round(count / elapsed, 1) if elapsed > 0 else 0,
+        "by_locale": dict(sorted(by_locale.items()))
+    }
+
+def main():
+    """メイン関数"""
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    generator = ReceiptCorpusGenerator(
+        seed=args.seed,
+        locales=args.locales.split(",") if args.locales else None,
+        size_weights=parse_size_weights(args.sizes) if args.sizes else None
+    )
+    
+    if args.evaluate:
+        config = ConfigManager(args.config).get_config()
+        report = evaluate(generator.iter_receipts(args.receipts, args.start), CurrencyConverter(config))
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+    
+    started = time.perf_counter()
+    image_dir = Path(args.images) if args.images else None
+    if args.output == "-":
+        summary = generator.write_jsonl(sys.stdout, args.receipts, args.start, image_dir, args.font)
+    else:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            summary = generator.write_jsonl(f, args.receipts, args.start, image_dir, args.font)
+    summary["seconds"] = round(time.perf_counter() - started, 3)
+    print(f"🧾 合成レシート: {json.dumps(summary, ensure_ascii=False)}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+#!/usr/bin/env python3
+"""
+負荷試験スクリプト
+代替サービス（Vision・Translate・Gemini・為替レートAPI）に対して process_receipt を並行実行し、
+スループットとレイテンシのパーセンタイルを表示する
+"""
+
+import sys
+import json
+import time
+import logging
+import argparse
+import tempfile
+from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from typing import Dict, Any, List
+
+import numpy as np
+
+# プロジェクトのルートディレクトリをパスに追加
+sys.path.append(str(Path(__file__).parent))
+
+from src.config_manager import ConfigManager, thaw_config
+from src.image_processor import ImageProcessor
+from src.translator import Translator
+from src.currency_converter import CurrencyConverter
+from src.result_manager import ResultManager
+from src.rate_limiter import get_rate_limiter
+from src.fake_services import FakeServiceBehavior, FakeRatesServer
+from src.gemini_extractor import create_gemini_extractor
+from main import process_receipt
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """コマンドライン引数の解析"""
+    parser = argparse.ArgumentParser(description="海外支出ガイド MVP - 負荷試験")
+    parser.add_argument("-n", "--receipts", type=int, default=100, help="処理するレシート数")
+    parser.add_argument("-c", "--concurrency", type=int, default=8, help="同時に処理するレシート数")
+    parser.add_argument("--config", default="config.yaml", help="設定ファイル")
+    parser.add_argument("--error-rate", type=float, default=None,
+                        help="すべての代替サービスのエラー率を上書き（0〜1）")
+    parser.add_argument("--latency-scale", type=float, default=1.0,
+                        help="代替サービスのレイテンシを何倍にするか")
+    parser.add_argument("--mode", choices=["pipeline", "gemini"], default=None,
+                        help="処理モード（省略時は設定ファイルの processing.mode）")
+    parser.add_argument("--no-rate-cache", action="store_true",
+                        help="為替レートをキャッシュせず、レシートごとに取得する")
+    parser.add_argument("--output-dir", default=None,
+                        help="結果ストア等の出力先（省略時は一時ディレクトリ）")
+    parser.add_argument("--json", dest="json_path", default=None, help="集計結果をJSONで保存するパス")
+    return parser.parse_args(argv)
+
+def build_config(base_config: Dict[str, Any], args: argparse.Namespace, output_dir: Path) -> Dict[str, Any]:
+    """負荷試験用の設定（代替サービスを有効化し、出力先を output_dir に向ける）
+    
+    base_config は検証済み・変更不可の設定のため、変更可能な複製を作ってから書き換える。
+    """
+    config = thaw_config(base_config)
+    fakes_config = config.setdefault("fakes", {})
+    fakes_config["enabled"] = True
+    
+    for service in ("vision", "translate", "gemini", "rates"):
+        settings = fakes_config.setdefault(service, {})
+        if args.error_rate is not None:
+            settings["error_rate"] = args.error_rate
+        latency = settings.setdefault("latency", {})
+        for key in ("median_ms", "p99_ms"):
+            if key in latency:
+                latency[key] *= args.latency_scale
+    
+    if args.mode:
+        config.setdefault("processing", {})["mode"] = args.mode
+    if args.no_rate_cache:
+        config["currency"]["rate_cache_seconds"] = 0
+    
+    output = config["output"]
+    output["output_dir"] = str(output_dir)
+    output["store_path"] = str(output_dir / "results.db")
+    output.setdefault("progress", {})["db_path"] = str(output_dir / "progress.db")
+    output["expense_index_file"] = str(output_dir / "expense_index.json")
+    output.setdefault("retention", {})["archive_dir"] = str(output_dir / "archive")
+    output.setdefault("export", {})["conversions_dir"] = str(output_dir / "analytics" / "conversions")
+    config.setdefault("resilience", {})["rate_limit_db"] = str(output_dir / "rate_limits.db")
+    config.setdefault("jobs", {})["db_path"] = str(output_dir / "jobs.db")
+    
+    return config
+
+def percentile_summary(latencies: List[float]) -> Dict[str, float]:
+    """レイテンシのパーセンタイル（秒）"""
+    if not latencies:
+        return {}
+    values = np.asarray(latencies)
+    return {
+        "p50": round(float(np.percentile(values, 50)), 3),
+        "p95": round(float(np.percentile(values, 95)), 3),
+        "p99": round(float(np.percentile(values, 99)), 3),
+        "max": round(float(values.max()), 3),
+        "mean": round(float(values.mean()), 3)
+    }
+
+def run_load_test(args: argparse.Namespace) -> Dict[str, Any]:
+    """負荷試験を実行して集計を返す"""
+    base_config = ConfigManager(args.config).get_config()
+    output_dir = Path(args.output_dir or tempfile.mkdtemp(prefix="receipt_load_test_"))
+    output_dir.mkdir(parents=True, exist_ok=True)
+    config = build_config(base_config, args, output_dir)
+    
+    # 為替レートAPIの代替サーバー
+    rates_server = FakeRatesServer(
+        FakeServiceBehavior("rates", config["fakes"]["rates"]),
+        config["currency"]["fallback_rates"]
+    ).start()
+    config["currency"]["api_url"] = rates_server.api_url
+    
+    # プロセッサーはワーカーと同様に全スレッドで共有する
+    image_processor = ImageProcessor(config)
+    translator = Translator(config)
+    currency_converter = CurrencyConverter(config)
+    result_manager = ResultManager(config)
+    gemini_extractor = create_gemini_extractor(config)
+    logger = logging.getLogger("load_test")
+    
+    receipt_ids = image_processor.list_receipt_ids() or ["load_test_receipt"]
+    workload = [receipt_ids[i % len(receipt_ids)] for i in range(args.receipts)]
+    
+    def run_one(receipt_id: str):
+        started = time.perf_counter()
+        results = process_receipt(config, image_processor, translator, currency_converter,
+                                  result_manager, logger, receipt_id=receipt_id,
+                                  gemini_extractor=gemini_extractor)
+        return time.perf_counter() - started, results
+    
+    mode = config.get("processing", {}).get("mode", "pipeline")
+    print(f"🚀 負荷試験: {args.receipts}件 / 同時実行 {args.concurrency} / モード {mode}")
+    latencies: List[float] = []
+    failed = 0
+    calls: Dict[str, Dict[str, int]] = {}
+    
+    started_at = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(run_one, receipt_id) for receipt_id in workload]
+        for future in as_completed(futures):
+            try:
+                latency, results = future.result()
+            except Exception as e:
+                print(f"   ❌ 処理エラー: {str(e)}")
+                failed += 1
+                continue
+            
+            latencies.append(latency)
+            if any(phase["status"] == "error" for phase in results["phases"].values()):
+                failed += 1
+            for service, outcomes in results.get("resilience", {}).get("calls", {}).items():
+                totals = calls.setdefault(service, {})
+                for outcome, count in outcomes.items():
+                    totals[outcome] = totals.get(outcome, 0) + count
+    elapsed = time.perf_counter() - started_at
+    
+    result_manager.close()
+    rates_server.stop()
+    
+    fake_services = {
+        "vision": image_processor.vision_client.behavior.snapshot(),
+        "translate": translator.translate_client.behavior.snapshot(),
+        "rates": rates_server.behavior.snapshot()
+    }
+    if gemini_extractor:
+        fake_services["gemini"] = gemini_extractor.model.behavior.snapshot()
+    
+    return {
+        "receipts": args.receipts,
+        "concurrency": args.concurrency,
+        "mode": mode,
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_per_second": round(len(latencies) / elapsed, 2) if elapsed > 0 else 0,
+        "failed": failed,
+        "latency_seconds": percentile_summary(latencies),
+        "calls": calls,
+        "fake_services": fake_services,
+        "rate_limits": get_rate_limiter(config["resilience"]["rate_limit_db"]).get_stats(),
+        "output_dir": str(output_dir)
+    }
+
+def display_report(report: Dict[str, Any]):
+    """集計結果の表示"""
+    print("=" * 50)
+    print(f"⏱️  所要時間: {report['elapsed_seconds']}秒")
+    print(f"📈 スループット: {report['throughput_per_second']}件/秒")
+    latency = report["latency_seconds"]
+    if latency:
+        print(f"📊 レイテンシ: p50={latency['p50']}s p95={latency['p95']}s p99={latency['p99']}s max={latency['max']}s")
+    print(f"❌ 失敗: {report['failed']}件")
+    for service, outcomes in report["calls"].items():
+        print(f"   🔌 {service}: {outcomes}")
+    for service, snapshot in report["fake_services"].items():
+        print(f"   🧪 代替{service}: {snapshot}")
+    for service, stats in report["rate_limits"].items():
+        print(f"   🪣 レート制限 {service}: 平均待ち{stats['average_wait_seconds']}s 最大{stats['max_wait_seconds']}s")
+    print(f"📁 出力先: {report['output_dir']}")
+
+def main():
+    """メイン関数"""
+    args = parse_args()
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    
+    report = run_load_test(args)
+    display_report(report)
+    
+    if args.json_path:
+        with open(args.json_path, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"💾 集計結果を保存しました: {args.json_path}")
+
+if __name__ == "__main__":
+    main()
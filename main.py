@@ -5,12 +5,15 @@
 
 import os
 import sys
+import time
+import argparse
 import yaml
 import json
 import logging
-import colorlog
+import threading
 from pathlib import Path
-from typing import Dict, Any, List
+from typing import Dict, Any, List, Optional
+from contextlib import nullcontext
 from dotenv import load_dotenv
 
 # カスタムモジュールのインポート
@@ -19,39 +22,76 @@ from src.image_processor import ImageProcessor
 from src.translator import Translator
 from src.currency_converter import CurrencyConverter
 from src.result_manager import ResultManager
+from src.job_queue import JobQueue, WorkerPool
+from src.progress_broker import ProgressBroker
+from src.resilience import deadline_budget, breaker_states
+from src.profiler import StepProfiler, ReceiptProfile
+from src.metrics import STEP_DURATION
+from src.structured_logging import configure_logging, LOG_FORMATS
+from src.archive_import import ArchiveImporter
+from src.gemini_extractor import GeminiExtractor, create_gemini_extractor
+from src.step_checkpoints import ReceiptCheckpoints
 
 # 環境変数の読み込み
 load_dotenv()
 
-def setup_logging():
-    """ログ設定の初期化"""
-    handler = colorlog.StreamHandler()
-    handler.setFormatter(colorlog.ColoredFormatter(
-        '%(log_color)s%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-        log_colors={
-            'DEBUG': 'cyan',
-            'INFO': 'green',
-            'WARNING': 'yellow',
-            'ERROR': 'red',
-            'CRITICAL': 'red,bg_white',
-        }
-    ))
-    
-    logger = colorlog.getLogger()
-    logger.addHandler(handler)
-    logger.setLevel(logging.DEBUG)
-    
-    return logger
+def setup_logging(args: argparse.Namespace):
+    """ログ設定の初期化（既定では整形・出力を別スレッドで行い、処理スレッドを待たせない）"""
+    return configure_logging(
+        level=args.log_level,
+        log_format=args.log_format,
+        log_file=args.log_file,
+        use_queue=not args.sync_logging
+    )
+
+def parse_args(argv=None) -> argparse.Namespace:
+    """コマンドライン引数の解析"""
+    parser = argparse.ArgumentParser(description="海外支出ガイド MVP - レシート処理")
+    parser.add_argument("--migrate-results", action="store_true",
+                        help="results/ の結果JSONファイルを結果ストアに取り込んで終了します")
+    parser.add_argument("--rebuild-stats", action="store_true",
+                        help="結果ストアから処理統計と支出集計を再構築して終了します")
+    parser.add_argument("--compact", action="store_true",
+                        help="保持件数を超えた過去の処理結果を圧縮アーカイブへ移動して終了します")
+    parser.add_argument("--export-conversions", action="store_true",
+                        help="未エクスポートの換算結果を Parquet データセットに追記して終了します")
+    parser.add_argument("--index-images", action="store_true",
+                        help="receipts/ の画像メタデータ索引（サイズ・撮影日時・向き・ハッシュ）を更新して終了します")
+    parser.add_argument("--batch", action="store_true",
+                        help="receipts/ のすべての画像を撮影日時順に低優先度でジョブキューに登録し、"
+                             "処理し終えたら終了します（画像メタデータ索引も更新）")
+    parser.add_argument("--worker", action="store_true",
+                        help="ジョブキューのワーカーとして常駐し、登録されたレシートを処理します")
+    parser.add_argument("--workers", type=int, default=None,
+                        help="ワーカースレッド数（省略時は config.yaml の jobs.workers）")
+    parser.add_argument("--import-archive", metavar="PATH", default=None,
+                        help="zip・tar アーカイブ内の画像を展開せずに順に処理します（- で標準入力の tar）")
+    parser.add_argument("--trip-id", default=None,
+                        help="--import-archive で取り込むレシートの旅行ID（省略時はアーカイブ名）")
+    parser.add_argument("--log-level", default="DEBUG", choices=["DEBUG", "INFO", "WARNING", "ERROR"],
+                        help="ログレベル")
+    parser.add_argument("--log-format", default="color", choices=LOG_FORMATS,
+                        help="ログの形式（json は1行1レコードの JSON Lines）")
+    parser.add_argument("--log-file", default=None,
+                        help="ログの出力先ファイル（省略時は標準エラー出力）")
+    parser.add_argument("--sync-logging", action="store_true",
+                        help="ログを呼び出し元のスレッドで直接出力します（キューを使わない）")
+    parser.add_argument("--profile", action="store_true",
+                        help="各ステップの CPU 時間・メモリ割り当てを計測し、レポートを profiling.output_dir に出力します")
+    parser.add_argument("--invalidate-from", metavar="STEP", default=None,
+                        help="指定したステップ以降のチェックポイントを全レシート分破棄してから処理します")
+    return parser.parse_args(argv)
 
 def main():
     """メイン実行関数"""
-    logger = setup_logging()
+    args = parse_args()
+    logger = setup_logging(args)
     logger.info("🚀 海外支出ガイド MVP システムを開始します")
     
     try:
         # 設定ファイルの読み込み
         config_manager = ConfigManager("config.yaml")
-        config = config_manager.load_config()
+        config = config_manager.get_config()
         
         logger.info(f"📋 プロジェクト: {config['project']['name']} v{config['project']['version']}")
         
@@ -60,9 +100,71 @@ def main():
         translator = Translator(config)
         currency_converter = CurrencyConverter(config)
         result_manager = ResultManager(config)
+        gemini_extractor = create_gemini_extractor(config)
         
-        # 処理フローの実行
-        process_receipt(config, image_processor, translator, currency_converter, result_manager, logger)
+        try:
+            # 既存の結果ファイルの移行
+            if args.migrate_results:
+                imported = result_manager.migrate_json_results()
+                logger.info(f"📦 結果ファイルを移行しました: {imported}件")
+                return
+            
+            # 処理統計の再構築
+            if args.rebuild_stats:
+                stats = result_manager.rebuild_processing_stats()
+                logger.info(f"📈 処理統計: {stats}")
+                overall = result_manager.rebuild_expense_index()
+                logger.info(f"💴 支出集計: {overall}")
+                return
+            
+            # 過去の処理結果のコンパクション
+            if args.compact:
+                compacted = result_manager.compact_results()
+                logger.info(f"🗜️  コンパクション結果: {compacted}")
+                return
+            
+            # 分析用エクスポート
+            if args.export_conversions:
+                exported = result_manager.export_conversions()
+                logger.info(f"📤 エクスポート結果: {exported}")
+                return
+            
+            # 画像メタデータ索引の更新
+            if args.index_images:
+                indexed = image_processor.refresh_metadata_index()
+                logger.info(f"🗂️  画像メタデータ索引: {indexed['total']}件 (更新{indexed['updated']}件・"
+                            f"削除{indexed['removed']}件, {indexed['seconds']}秒)")
+                return
+            
+            # 設定を変えたステップ以降のチェックポイントを破棄（続けて通常どおり処理する）
+            if args.invalidate_from:
+                if result_manager.checkpoints:
+                    result_manager.checkpoints.invalidate_from(config, args.invalidate_from)
+                else:
+                    logger.warning("checkpoints.enabled が無効のため --invalidate-from は無視します")
+            
+            # ステップごとのプロファイリング
+            profiler = StepProfiler(config) if args.profile else None
+            if profiler:
+                profiler.start()
+            
+            try:
+                # ジョブキューによる一括処理・常駐ワーカー
+                if args.batch or args.worker:
+                    run_job_workers(config_manager, result_manager, image_processor, args, logger, profiler)
+                elif args.import_archive:
+                    import_archive(config, image_processor, translator, currency_converter, result_manager,
+                                   args, logger, profiler, gemini_extractor)
+                else:
+                    # 処理フローの実行
+                    process_receipt(config, image_processor, translator, currency_converter, result_manager, logger,
+                                    profiler=profiler, gemini_extractor=gemini_extractor)
+            finally:
+                if profiler:
+                    profiler.stop()
+        finally:
+            # 途中で失敗しても未書き込みの結果をフラッシュする
+            result_manager.close()
         
         logger.info("✅ 処理が完了しました")
         
@@ -70,18 +172,111 @@ def main():
         logger.error(f"❌ エラーが発生しました: {str(e)}")
         sys.exit(1)
 
+def _step_load_image(context: Dict[str, Any], processors: Dict[str, Any]) -> Dict[str, Any]:
+    """画像読み込み"""
+    context["image_data"] = processors["image_processor"].load_image(context["receipt_id"], context.get("image_bytes"))
+    return {"image_loaded": True}
+
+def _step_ocr_extraction(context: Dict[str, Any], processors: Dict[str, Any]) -> Dict[str, Any]:
+    """OCRによるテキスト抽出（gemini モードでは構造化抽出を1回だけ呼び、以降のステップはその結果を使う）"""
+    gemini_extractor = processors.get("gemini_extractor")
+    if gemini_extractor:
+        extraction = gemini_extractor.extract(context["receipt_id"], context.get("image_bytes"))
+        context["extraction"] = extraction
+        if extraction:
+            context["text_data"] = {
+                "extracted_text": extraction["raw_text"],
+                "text_length": len(extraction["raw_text"]),
+                "confidence": "gemini",
+                "is_dummy": False,
+                "merchant": extraction["merchant"],
+                "receipt_date": extraction["date"],
+                "line_items": extraction["items"],
+                "tax": extraction["tax"],
+                "total": extraction["total"]
+            }
+            return context["text_data"]
+    
+    # 構造化抽出が使えない場合は従来のOCR（以降のステップも従来の処理になる）
+    context["text_data"] = processors["image_processor"].extract_text(context["receipt_id"], context.get("image_bytes"))
+    if gemini_extractor:
+        # 構造化抽出に失敗した結果はチェックポイントに保存しない（再実行時に Gemini を呼び直す）
+        context["text_data"]["fallback"] = True
+    return context["text_data"]
+
+def _step_language_detection(context: Dict[str, Any], processors: Dict[str, Any]) -> Dict[str, Any]:
+    """言語検出"""
+    if context.get("extraction"):
+        return {"detected_language": context["extraction"]["language"]}
+    return processors["translator"].detect_language_result(context["text_data"]["extracted_text"])
+
+def _step_translate(context: Dict[str, Any], processors: Dict[str, Any]) -> Dict[str, Any]:
+    """翻訳"""
+    if context.get("extraction") and context["extraction"]["translation_ja"]:
+        return {"translated_text": context["extraction"]["translation_ja"]}
+    return processors["translator"].translate_text_result(context["text_data"]["extracted_text"])
+
+def _step_amount_extraction(context: Dict[str, Any], processors: Dict[str, Any]) -> Dict[str, Any]:
+    """金額抽出"""
+    if context.get("extraction"):
+        context["amounts"] = processors["gemini_extractor"].amounts(context["extraction"])
+    else:
+        context["amounts"] = processors["currency_converter"].extract_amounts(context["text_data"]["extracted_text"])
+    return {"amounts": context["amounts"]}
+
+def _step_currency_detection(context: Dict[str, Any], processors: Dict[str, Any]) -> Dict[str, Any]:
+    """通貨検出"""
+    if context.get("extraction") and context["extraction"]["currency"] != "UNKNOWN":
+        context["currencies"] = [context["extraction"]["currency"]]
+    else:
+        context["currencies"] = processors["currency_converter"].detect_currencies(context["text_data"]["extracted_text"])
+    return {"currencies": context["currencies"]}
+
+def _step_currency_conversion(context: Dict[str, Any], processors: Dict[str, Any]) -> Dict[str, Any]:
+    """通貨換算"""
+    conversions = processors["currency_converter"].convert_currencies(context["amounts"], context["currencies"])
+    # フォールバックレートでの換算・換算の失敗は代替処理の結果として扱う
+    fallback = (bool(context["amounts"]) and not conversions) or any(
+        conversion["rate_source"] == "fallback" for conversion in conversions
+    )
+    return {"conversions": conversions, "fallback": fallback}
+
+# config.yaml の action と処理関数の対応
+STEP_ACTIONS = {
+    "load_image": _step_load_image,
+    "ocr_extraction": _step_ocr_extraction,
+    "language_detection": _step_language_detection,
+    "translate": _step_translate,
+    "amount_extraction": _step_amount_extraction,
+    "currency_detection": _step_currency_detection,
+    "currency_conversion": _step_currency_conversion,
+}
+
 def process_receipt(config: Dict[str, Any], 
                    image_processor: ImageProcessor,
                    translator: Translator,
                    currency_converter: CurrencyConverter,
                    result_manager: ResultManager,
-                   logger: logging.Logger):
-    """レシート処理のメインロジック"""
+                   logger: logging.Logger,
+                   receipt_id: str = "test_receipt_001",
+                   profiler: Optional[StepProfiler] = None,
+                   image_bytes: Optional[bytes] = None,
+                   trip_id: Optional[str] = None,
+                   gemini_extractor: Optional[GeminiExtractor] = None,
+                   source_name: Optional[str] = None) -> Dict[str, Any]:
+    """レシート処理のメインロジック
+    
+    image_bytes を渡した場合は画像ファイルを読まない。source_name（アーカイブのメンバー名など）は
+    結果のメタデータに記録する。
+    """
     
-    # テスト用のレシートID（後でダミーデータに置き換え）
-    receipt_id = "test_receipt_001"
+    logger.info("📷 レシート処理開始: %s", receipt_id)
+    started_at = time.perf_counter()
     
-    logger.info(f"📷 レシート処理開始: {receipt_id}")
+    # 進捗イベント（Webサーバーの /api/events から配信される）
+    progress = result_manager.progress
+    progress.publish(receipt_id, "run_started",
+                     phases=[{"phase": phase["phase"], "name": phase["name"]} for phase in config["processing_flow"]])
     
     # 結果を格納する辞書
     results = {
@@ -89,12 +284,76 @@ def process_receipt(config: Dict[str, Any],
         "phases": {}
     }
     
-    # 各フェーズの実行
+    # ステップ間で受け渡すデータ
+    context = {"receipt_id": receipt_id, "image_bytes": image_bytes}
+    processors = {
+        "image_processor": image_processor,
+        "translator": translator,
+        "currency_converter": currency_converter,
+        "gemini_extractor": gemini_extractor
+    }
+    
+    # 全ステップで共有する処理期限（外部APIのタイムアウトは残り時間以内に収める）
+    budget_seconds = config.get("resilience", {}).get("deadline_seconds", 60)
+    profile = profiler.begin(receipt_id) if profiler else None
+    
+    # 処理ステップのチェックポイント（画像ファイルがなくダミーデータで処理する場合は使わない）
+    checkpoints = None
+    if result_manager.checkpoints:
+        content_hash = image_processor.content_hash(receipt_id, image_bytes)
+        if content_hash:
+            checkpoints = result_manager.checkpoints.begin(receipt_id, content_hash, config)
+    
+    with deadline_budget(budget_seconds) as budget:
+        run_phases(config, context, processors, results, progress, logger, profile, checkpoints)
+    
+    # 期限バジェットの消費状況と、外部APIごとのサーキットブレーカーの状態を記録
+    results["resilience"] = {**budget.summary(), "breakers": breaker_states()}
+    
+    # 復元・保存したチェックポイント
+    if checkpoints:
+        results["checkpoint"] = checkpoints.summary()
+    
+    # ステップごとのプロファイル要約（実行間の比較用。詳細は report_dir のレポート）
+    if profile:
+        results["profile"] = profile.finish()
+    
+    # 処理時間（秒）を記録
+    results["processing_time"] = round(time.perf_counter() - started_at, 3)
+    
+    # 結果の保存
+    result_manager.save_results(results, receipt_id, trip_id=trip_id, source_name=source_name)
+    
+    failed = [key for key, phase_result in results["phases"].items() if phase_result["status"] == "error"]
+    progress.publish(receipt_id, "run_completed", status="error" if failed else "completed",
+                     failed_phases=failed, processing_time=results["processing_time"])
+    
+    # 結果の表示
+    display_results(results, logger)
+    
+    return results
+
+def run_phases(config: Dict[str, Any],
+               context: Dict[str, Any],
+               processors: Dict[str, Any],
+               results: Dict[str, Any],
+               progress: ProgressBroker,
+               logger: logging.Logger,
+               profile: Optional[ReceiptProfile] = None,
+               checkpoints: Optional[ReceiptCheckpoints] = None):
+    """処理フローの各フェーズ・ステップを順に実行し、results に記録
+    
+    checkpoints を渡した場合、先頭から連続して完了済みのステップは前回の出力を復元して省略し、
+    実行したステップの出力は保存する。
+    """
+    receipt_id = context["receipt_id"]
+    
     for phase in config["processing_flow"]:
         phase_name = phase["name"]
         phase_key = phase["phase"]
         
-        logger.info(f"🔄 {phase_name}を開始します")
+        logger.info("🔄 %sを開始します", phase_name)
+        progress.publish(receipt_id, "phase_started", phase=phase_key, name=phase_name)
         results["phases"][phase_key] = {
             "name": phase_name,
             "steps": {},
@@ -107,71 +366,169 @@ def process_receipt(config: Dict[str, Any],
                 step_name = step["step"]
                 action = step["action"]
                 
-                logger.info(f"  📝 {step['explanation']}")
-                
-                # アクションに応じた処理
-                if action == "load_image":
-                    image_data = image_processor.load_image(receipt_id)
-                    results["phases"][phase_key]["steps"][step_name] = {
-                        "status": "success",
-                        "data": {"image_loaded": True}
-                    }
-                
-                elif action == "ocr_extraction":
-                    text_data = image_processor.extract_text(receipt_id)
-                    results["phases"][phase_key]["steps"][step_name] = {
-                        "status": "success",
-                        "data": text_data
-                    }
-                
-                elif action == "language_detection":
-                    detected_lang = translator.detect_language(text_data["extracted_text"])
-                    results["phases"][phase_key]["steps"][step_name] = {
-                        "status": "success",
-                        "data": {"detected_language": detected_lang}
-                    }
+                logger.info("  📝 %s", step["explanation"])
                 
-                elif action == "translate":
-                    translated_text = translator.translate_text(text_data["extracted_text"])
-                    results["phases"][phase_key]["steps"][step_name] = {
-                        "status": "success",
-                        "data": {"translated_text": translated_text}
-                    }
+                handler = STEP_ACTIONS.get(action)
+                if handler is None:
+                    logger.warning("  未対応のアクションのためスキップします: %s", action)
+                    continue
                 
-                elif action == "amount_extraction":
-                    amounts = currency_converter.extract_amounts(text_data["extracted_text"])
-                    results["phases"][phase_key]["steps"][step_name] = {
-                        "status": "success",
-                        "data": {"amounts": amounts}
-                    }
+                progress.publish(receipt_id, "step_started", phase=phase_key, step=step_name,
+                                 explanation=step["explanation"])
+                checkpoint = checkpoints.restore(step_name) if checkpoints else None
+                if checkpoint is not None:
+                    logger.info("  ⏩ チェックポイントから復元しました: %s", step_name)
+                    context.update(checkpoint["context"])
+                    data = checkpoint["data"]
+                else:
+                    before = dict(context)
+                    step_started = time.perf_counter()
+                    with profile.step(step_name) if profile else nullcontext():
+                        data = handler(context, processors)
+                    STEP_DURATION.observe(time.perf_counter() - step_started, step=step_name)
+                    if checkpoints:
+                        checkpoints.save(step_name, data, {key: value for key, value in context.items()
+                                                           if key not in before or before[key] is not value})
                 
-                elif action == "currency_detection":
-                    currencies = currency_converter.detect_currencies(text_data["extracted_text"])
-                    results["phases"][phase_key]["steps"][step_name] = {
-                        "status": "success",
-                        "data": {"currencies": currencies}
-                    }
-                
-                elif action == "currency_conversion":
-                    conversions = currency_converter.convert_currencies(amounts, currencies)
-                    results["phases"][phase_key]["steps"][step_name] = {
-                        "status": "success",
-                        "data": {"conversions": conversions}
-                    }
+                results["phases"][phase_key]["steps"][step_name] = {
+                    "status": "success",
+                    "data": data
+                }
+                if checkpoint is not None:
+                    results["phases"][phase_key]["steps"][step_name]["restored"] = True
+                progress.publish(receipt_id, "step_completed", phase=phase_key, step=step_name,
+                                 restored=checkpoint is not None)
             
             results["phases"][phase_key]["status"] = "completed"
-            logger.info(f"✅ {phase_name}が完了しました")
+            logger.info("✅ %sが完了しました", phase_name)
+            progress.publish(receipt_id, "phase_completed", phase=phase_key)
             
         except Exception as e:
             logger.error(f"❌ {phase_name}でエラーが発生: {str(e)}")
             results["phases"][phase_key]["status"] = "error"
             results["phases"][phase_key]["error"] = str(e)
+            progress.publish(receipt_id, "phase_failed", phase=phase_key, error=str(e))
+
+def create_receipt_processor(config_manager: ConfigManager,
+                             result_manager: ResultManager,
+                             logger: logging.Logger,
+                             profiler: Optional[StepProfiler] = None):
+    """ジョブキューのワーカーから呼ばれるレシート処理関数を作成
     
-    # 結果の保存
-    result_manager.save_results(results, receipt_id)
+    設定ファイルが更新されていた場合（get_config が別のオブジェクトを返した場合）は
+    各プロセッサーを作り直す。いずれかのフェーズが失敗した場合は例外を送出して再試行させる。
+    """
+    lock = threading.Lock()
+    state = {"config": None, "processors": None}
     
-    # 結果の表示
-    display_results(results, logger)
+    def current_processors():
+        config = config_manager.get_config()
+        with lock:
+            if config is not state["config"]:
+                if state["config"] is not None:
+                    logger.info("🔁 設定が更新されたため、プロセッサーを再作成します")
+                state["processors"] = (ImageProcessor(config), Translator(config), CurrencyConverter(config),
+                                       create_gemini_extractor(config))
+                state["config"] = config
+            return config, state["processors"]
+    
+    def process(receipt_id: str) -> Dict[str, Any]:
+        config, (image_processor, translator, currency_converter, gemini_extractor) = current_processors()
+        results = process_receipt(config, image_processor, translator, currency_converter,
+                                  result_manager, logger, receipt_id=receipt_id, profiler=profiler,
+                                  gemini_extractor=gemini_extractor)
+        
+        failed = [key for key, phase in results["phases"].items() if phase["status"] == "error"]
+        if failed:
+            errors = "; ".join(f"{key}: {results['phases'][key]['error']}" for key in failed)
+            raise RuntimeError(f"処理に失敗したフェーズがあります: {errors}")
+        return results
+    
+    return process
+
+def run_job_workers(config_manager: ConfigManager,
+                    result_manager: ResultManager,
+                    image_processor: ImageProcessor,
+                    args: argparse.Namespace,
+                    logger: logging.Logger,
+                    profiler: Optional[StepProfiler] = None):
+    """ジョブキューのワーカーを起動（--batch は全画像を登録して完了まで、--worker は停止まで）"""
+    config = config_manager.get_config()
+    jobs_config = config.get("jobs", {})
+    job_queue = JobQueue(config)
+    
+    if args.batch:
+        # 撮影日時順に登録する（索引に載らない読み込めない画像は最後）
+        image_processor.refresh_metadata_index()
+        receipt_ids = image_processor.list_receipt_ids_by_capture_time()
+        indexed = set(receipt_ids)
+        receipt_ids += [receipt_id for receipt_id in image_processor.list_receipt_ids() if receipt_id not in indexed]
+        for receipt_id in receipt_ids:
+            job_queue.enqueue(receipt_id, priority="backfill")
+        logger.info(f"📥 ジョブを登録しました: {len(receipt_ids)}件")
+    
+    pool = WorkerPool(
+        job_queue,
+        create_receipt_processor(config_manager, result_manager, logger, profiler),
+        workers=args.workers or jobs_config.get("workers", 2),
+        poll_interval=jobs_config.get("poll_interval", 1.0)
+    )
+    pool.start()
+    
+    try:
+        if args.batch:
+            pool.wait_until_idle()
+        else:
+            logger.info("👷 ワーカーとして待機します（Ctrl+C で停止）")
+            while True:
+                time.sleep(3600)
+    except KeyboardInterrupt:
+        logger.info("⏹️  ワーカーを停止します")
+    finally:
+        pool.stop()
+    
+    logger.info(f"📋 ジョブの状態: {job_queue.count_by_status()}")
+
+def import_archive(config: Dict[str, Any],
+                   image_processor: ImageProcessor,
+                   translator: Translator,
+                   currency_converter: CurrencyConverter,
+                   result_manager: ResultManager,
+                   args: argparse.Namespace,
+                   logger: logging.Logger,
+                   profiler: Optional[StepProfiler] = None,
+                   gemini_extractor: Optional[GeminiExtractor] = None) -> Dict[str, int]:
+    """アーカイブ内の画像を1枚ずつ読み出し、読み終えたものから順に処理する"""
+    archive_path = args.import_archive
+    trip_id = args.trip_id or (Path(archive_path).name.split(".")[0] if archive_path != "-" else None)
+    importer = ArchiveImporter(config)
+    summary = {"processed": 0, "duplicates": 0, "failed": 0}
+    
+    logger.info("🗂️  アーカイブを取り込みます: %s (旅行ID: %s)", archive_path, trip_id)
+    for image in importer.iter_images(archive_path, is_known=result_manager.has_receipt):
+        if image["duplicate"]:
+            logger.info("⏭️  処理済みの画像のためスキップします: %s (%s)", image["name"], image["receipt_id"])
+            summary["duplicates"] += 1
+            continue
+        
+        # 再処理・Web UI で使えるよう、処理する前に画像ファイルとして保存する
+        try:
+            importer.save_image(image)
+        except OSError as e:
+            logger.error("画像を保存できないためスキップします: %s (%s)", image["name"], str(e))
+            summary["failed"] += 1
+            continue
+        
+        results = process_receipt(config, image_processor, translator, currency_converter, result_manager, logger,
+                                  receipt_id=image["receipt_id"], profiler=profiler,
+                                  image_bytes=image["content"], trip_id=trip_id,
+                                  gemini_extractor=gemini_extractor, source_name=image["name"])
+        if any(phase["status"] == "error" for phase in results["phases"].values()):
+            summary["failed"] += 1
+        summary["processed"] += 1
+    
+    logger.info("📦 アーカイブの取り込み結果: %s", summary)
+    return summary
 
 def display_results(results: Dict[str, Any], logger: logging.Logger):
     """結果の表示"""
@@ -179,20 +536,20 @@ def display_results(results: Dict[str, Any], logger: logging.Logger):
     logger.info("=" * 50)
     
     for phase_key, phase_data in results["phases"].items():
-        logger.info(f"📋 {phase_data['name']}: {phase_data['status']}")
+        logger.info("📋 %s: %s", phase_data['name'], phase_data['status'])
         
         if phase_data['status'] == 'completed':
             for step_name, step_data in phase_data['steps'].items():
                 if step_data['status'] == 'success':
-                    logger.info(f"  ✅ {step_name}")
+                    logger.info("  ✅ %s", step_name)
                     if 'data' in step_data:
                         # 重要なデータのみ表示
                         if 'extracted_text' in step_data['data']:
-                            logger.info(f"    抽出テキスト: {step_data['data']['extracted_text'][:100]}...")
+                            logger.info("    抽出テキスト: %.100s...", step_data['data']['extracted_text'])
                         if 'translated_text' in step_data['data']:
-                            logger.info(f"    翻訳テキスト: {step_data['data']['translated_text'][:100]}...")
+                            logger.info("    翻訳テキスト: %.100s...", step_data['data']['translated_text'])
                         if 'conversions' in step_data['data']:
-                            logger.info(f"    換算結果: {step_data['data']['conversions']}")
+                            logger.info("    換算結果: %s", step_data['data']['conversions'])
 
 if __name__ == "__main__":
     main()
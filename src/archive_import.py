@@ -0,0 +1,151 @@
+"""
+旅行アーカイブ（zip・tar）の取り込みモジュール（展開せずに1枚ずつ読み出す）
+"""
+
+import os
+import sys
+import hashlib
+import logging
+import tarfile
+import tempfile
+import zipfile
+import mimetypes
+from pathlib import Path, PurePosixPath
+from typing import Dict, Any, BinaryIO, Callable, Iterator, Optional, Tuple
+
+from src.image_files import image_path
+
+# mimetypes が認識しない画像形式
+EXTRA_IMAGE_TYPES = {".heic": "image/heic", ".heif": "image/heif", ".webp": "image/webp"}
+
+class ArchiveImporter:
+    """zip・tar アーカイブ内のレシート画像をディスクに展開せずに読み出すクラス
+    
+    メンバーを1つずつチャンク単位で読みながら SHA-256 を計算し、receipt_id（ハッシュ先頭16桁、
+    アップロードと同じ）を決める。メモリに載せるのは読み込み中の画像1枚分のみで、
+    max_image_bytes を超える画像はスキップする。tar は先頭から順に読むため、
+    パイプ（"-" で標準入力）や圧縮された tar（.tar.gz など）もそのまま扱える。
+    取り込んだ画像は save_image でアップロードと同じ画像ファイルとして保存する
+    （再処理・ジョブの再試行・Web UI での表示はアーカイブなしで画像ファイルを読む）。
+    """
+    
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        
+        import_config = config.get("archive_import", {})
+        self.max_image_bytes = import_config.get("max_image_bytes", 20 * 1024 * 1024)
+        self.chunk_size = import_config.get("chunk_size", 64 * 1024)
+        self.allowed_types = set(config.get("upload", {}).get("allowed_types", ["image/jpeg", "image/png"]))
+        
+        # 保存先は load_image ステップの画像ファイルパターンに合わせる
+        self.file_pattern = next(
+            (step["target_file_pattern"]
+             for phase in config["processing_flow"] for step in phase["steps"]
+             if step["action"] == "load_image" and "target_file_pattern" in step),
+            "receipts/{{receipt_id}}.jpg"
+        )
+    
+    def iter_images(self, archive_path: str,
+                    is_known: Optional[Callable[[str], bool]] = None) -> Iterator[Dict[str, Any]]:
+        """アーカイブ内の画像を順に返す
+        
+        各要素は name・receipt_id・sha256・size・duplicate・content（画像のバイト列）。
+        同じアーカイブ内で既出の画像と、is_known が True を返す処理済みの画像は
+        duplicate=True・content=None になる。
+        """
+        seen = set()
+        for name, size, stream in self._iter_members(archive_path):
+            content_type = self._content_type(name)
+            if content_type not in self.allowed_types:
+                self.logger.debug("画像以外のためスキップします: %s", name)
+                continue
+            if size is not None and size > self.max_image_bytes:
+                self.logger.warning("画像サイズが上限を超えるためスキップします: %s (%dバイト)", name, size)
+                continue
+            
+            content, sha256 = self._read_member(stream)
+            if content is None:
+                self.logger.warning("画像サイズが上限を超えるためスキップします: %s", name)
+                continue
+            
+            receipt_id = sha256[:16]
+            duplicate = sha256 in seen or bool(is_known and is_known(receipt_id))
+            seen.add(sha256)
+            yield {
+                "name": name,
+                "receipt_id": receipt_id,
+                "sha256": sha256,
+                "size": len(content),
+                "content_type": content_type,
+                "duplicate": duplicate,
+                "content": None if duplicate else content
+            }
+    
+    def save_image(self, image: Dict[str, Any]) -> Path:
+        """iter_images が返した画像を receipt_id の画像ファイルとして保存（保存済みなら何もしない）"""
+        target = image_path(self.file_pattern, image["receipt_id"], image["content_type"])
+        if target.exists():
+            return target
+        
+        # 一時ファイルに書き込んでから置き換える（中断しても途中までの画像を残さない）
+        target.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(target.parent), prefix=".import-", suffix=".tmp")
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                f.write(image["content"])
+            os.replace(tmp_path, target)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+        return target
+    
+    def _iter_members(self, archive_path: str) -> Iterator[Tuple[str, Optional[int], BinaryIO]]:
+        """(メンバー名, 宣言サイズ, 読み出しストリーム) を順に返す"""
+        if archive_path != "-" and zipfile.is_zipfile(archive_path):
+            # zip は末尾の中央ディレクトリから一覧を取得し、メンバーごとに伸長しながら読む
+            with zipfile.ZipFile(archive_path) as archive:
+                for info in archive.infolist():
+                    if info.is_dir() or self._is_hidden(info.filename):
+                        continue
+                    with archive.open(info) as stream:
+                        yield info.filename, info.file_size, stream
+            return
+        
+        # tar はストリームモード（r|*）で先頭から順に読む（シーク不要・圧縮形式は自動判別）
+        if archive_path == "-":
+            archive = tarfile.open(fileobj=sys.stdin.buffer, mode="r|*")
+        else:
+            archive = tarfile.open(archive_path, mode="r|*")
+        with archive:
+            for member in archive:
+                if not member.isfile() or self._is_hidden(member.name):
+                    continue
+                stream = archive.extractfile(member)
+                if stream is not None:
+                    yield member.name, member.size, stream
+    
+    def _read_member(self, stream: BinaryIO) -> Tuple[Optional[bytes], str]:
+        """チャンク単位で読みながらハッシュを計算（上限を超えた場合は content=None）"""
+        digest = hashlib.sha256()
+        content = bytearray()
+        while True:
+            chunk = stream.read(self.chunk_size)
+            if not chunk:
+                break
+            if len(content) + len(chunk) > self.max_image_bytes:
+                return None, ""
+            digest.update(chunk)
+            content.extend(chunk)
+        return bytes(content), digest.hexdigest()
+    
+    @staticmethod
+    def _content_type(name: str) -> Optional[str]:
+        suffix = PurePosixPath(name).suffix.lower()
+        return EXTRA_IMAGE_TYPES.get(suffix) or mimetypes.guess_type(name)[0]
+    
+    @staticmethod
+    def _is_hidden(name: str) -> bool:
+        """macOS のリソースフォーク（__MACOSX/・._*）や隠しファイル"""
+        parts = PurePosixPath(name).parts
+        return any(part.startswith(".") or part == "__MACOSX" for part in parts)
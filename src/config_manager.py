@@ -4,17 +4,57 @@
 
 import yaml
 import os
+import threading
 from pathlib import Path
-from typing import Dict, Any
+from types import MappingProxyType
+from typing import Dict, Any, Mapping, Optional
 import logging
 
+def freeze_config(value: Any) -> Any:
+    """設定を変更不可の構造に変換（dict → MappingProxyType, list → tuple）"""
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze_config(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze_config(item) for item in value)
+    return value
+
+def thaw_config(value: Any) -> Any:
+    """変更不可の設定を変更可能な構造に複製（MappingProxyType・dict → dict, tuple・list → list）"""
+    if isinstance(value, Mapping):
+        return {key: thaw_config(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [thaw_config(item) for item in value]
+    return value
+
 class ConfigManager:
     """YAML設定ファイルの管理クラス"""
     
+    # 必須の設定キー（ドット区切り）と期待する型
+    SCHEMA = {
+        "project": dict,
+        "project.name": str,
+        "project.version": str,
+        "google_apis": dict,
+        "currency": dict,
+        "currency.base_currency": str,
+        "currency.target_currencies": list,
+        "currency.api_url": str,
+        "currency.fallback_rates": dict,
+        "processing_flow": list,
+        "output": dict,
+        "output.output_dir": str,
+        "output.save_results": bool,
+    }
+    
     def __init__(self, config_path: str):
         self.config_path = config_path
         self.logger = logging.getLogger(__name__)
         
+        # 検証済み設定のキャッシュ（ファイルの更新時刻で無効化）
+        self._cached_config: Optional[Mapping[str, Any]] = None
+        self._cached_mtime: Optional[int] = None
+        self._cache_lock = threading.Lock()
+    
     def load_config(self) -> Dict[str, Any]:
         """設定ファイルを読み込み"""
         try:
@@ -28,26 +68,81 @@ class ConfigManager:
             
             self.logger.info(f"設定ファイルを読み込みました: {self.config_path}")
             return config
-            
+        
         except Exception as e:
             self.logger.error(f"設定ファイルの読み込みに失敗しました: {str(e)}")
             raise
     
+    def get_config(self) -> Mapping[str, Any]:
+        """検証済み・変更不可の設定を取得
+        
+        ファイルの更新時刻が前回読み込み時から変わった場合のみ再読み込みする。
+        再読み込みした設定が不正な場合や、ファイルが削除・置き換え中で読めない場合は、
+        エラーを記録して前回の設定を使い続ける。
+        """
+        try:
+            mtime = os.stat(self.config_path).st_mtime_ns
+        except OSError as e:
+            if self._cached_config is None:
+                raise FileNotFoundError(f"設定ファイルが見つかりません: {self.config_path}") from e
+            self.logger.error(f"設定ファイルを参照できないため、前回の設定を使用します: {str(e)}")
+            return self._cached_config
+        
+        if self._cached_config is not None and mtime == self._cached_mtime:
+            return self._cached_config
+        
+        with self._cache_lock:
+            if self._cached_config is not None and mtime == self._cached_mtime:
+                return self._cached_config
+            
+            try:
+                config = self.load_config()
+                if not self.validate_config(config):
+                    raise ValueError(f"設定ファイルの内容が不正です: {self.config_path}")
+            except Exception:
+                if self._cached_config is None:
+                    raise
+                self.logger.error("設定の再読み込みに失敗したため、前回の設定を使用します")
+                self._cached_mtime = mtime
+                return self._cached_config
+            
+            self._cached_config = freeze_config(config)
+            self._cached_mtime = mtime
+            return self._cached_config
+    
     def validate_config(self, config: Dict[str, Any]) -> bool:
         """設定の妥当性を検証"""
-        required_keys = ['project', 'google_apis', 'currency', 'processing_flow', 'output']
+        if not isinstance(config, dict):
+            self.logger.error("設定ファイルの形式が不正です")
+            return False
+        
+        for key_path, expected_type in self.SCHEMA.items():
+            value = config
+            for key in key_path.split("."):
+                if not isinstance(value, dict) or key not in value:
+                    self.logger.error(f"必須設定が見つかりません: {key_path}")
+                    return False
+                value = value[key]
+            
+            if not isinstance(value, expected_type):
+                self.logger.error(f"設定の型が不正です: {key_path} ({expected_type.__name__}が必要)")
+                return False
         
-        for key in required_keys:
-            if key not in config:
-                self.logger.error(f"必須設定が見つかりません: {key}")
+        for phase in config["processing_flow"]:
+            if not isinstance(phase, dict) or "phase" not in phase or not isinstance(phase.get("steps"), list):
+                self.logger.error(f"処理フェーズの設定が不正です: {phase}")
                 return False
+            for step in phase["steps"]:
+                if not isinstance(step, dict) or "step" not in step or "action" not in step:
+                    self.logger.error(f"処理ステップの設定が不正です: {step}")
+                    return False
         
         self.logger.info("設定の妥当性検証が完了しました")
         return True
     
     def get_api_key(self, api_name: str) -> str:
         """環境変数からAPIキーを取得"""
-        config = self.load_config()
+        config = self.get_config()
         
         if api_name not in config['google_apis']:
             raise ValueError(f"API設定が見つかりません: {api_name}")
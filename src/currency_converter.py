@@ -4,11 +4,19 @@
 
 import os
 import re
+import time
 import logging
+import threading
 import requests
-from typing import Dict, Any, List, Optional
+import numpy as np
+import pandas as pd
+from typing import Dict, Any, List, Optional, Sequence, Tuple
 from datetime import datetime
 
+from src.resilience import get_breaker, guarded_call, skip_reason, CircuitOpenError, DeadlineExceeded
+from src.metrics import FALLBACKS, CACHE_REQUESTS
+from src.rate_limiter import service_rate_limit, RateLimitExceeded
+
 class CurrencyConverter:
     """通貨換算クラス"""
     
@@ -17,10 +25,37 @@ class CurrencyConverter:
         self.logger = logging.getLogger(__name__)
         
         # 設定から通貨情報を取得
+        # 換算結果の jpy_amount・支出集計の total_jpy は基準通貨建ての金額のため、基準通貨は円に限る
         self.base_currency = config["currency"]["base_currency"]
+        if self.base_currency != "JPY":
+            raise ValueError(f"基準通貨は JPY のみ対応しています: {self.base_currency}")
         self.target_currencies = config["currency"]["target_currencies"]
         self.api_url = config["currency"]["api_url"]
         self.fallback_rates = config["currency"]["fallback_rates"]
+        self.rate_cache_seconds = config["currency"].get("rate_cache_seconds", 3600)
+        # 取得に失敗した後はこの間フォールバックレートを使い、APIを呼び直さない（レートのキャッシュ期間以下）
+        self.fallback_cache_seconds = min(config["currency"].get("fallback_cache_seconds", 60), self.rate_cache_seconds)
+        
+        # 為替レートAPIの呼び出しタイムアウトとサーキットブレーカー
+        resilience_config = config.get("resilience", {})
+        self.rates_timeout = resilience_config.get("timeouts", {}).get("exchange_rates", 5)
+        self.rates_breaker = get_breaker("exchange_rates", resilience_config.get("breaker"))
+        self.rates_rate_limit = service_rate_limit(config, "exchange_rates", config["currency"].get("rate_limit"))
+        
+        # 表示通貨（基準通貨・ホーム通貨を含む）
+        display_currencies = list(config["currency"].get("display_currencies", [self.base_currency]))
+        home_currency = config["currency"].get("home_currency")
+        if home_currency and home_currency not in display_currencies:
+            display_currencies.append(home_currency)
+        self.display_currencies = display_currencies
+        
+        # 為替レートのキャッシュ（1回の取得から全通貨ペアを算出する）
+        self._rates_cache = None
+        self._rates_fetched_at = 0.0
+        self._rates_fetching = False
+        self._fallback_until = 0.0
+        self._rates_lock = threading.Lock()
+        self._rates_condition = threading.Condition(self._rates_lock)
         
         # 通貨記号マッピング
         self.currency_symbols = {
@@ -88,9 +123,9 @@ class CurrencyConverter:
                                 "pattern_used": i
                             })
                             
-                            self.logger.debug(f"金額検出: {amount} {currency} (パターン{i})")
+                            self.logger.debug("金額検出: %s %s (パターン%d)", amount, currency, i)
                     except (ValueError, AttributeError) as e:
-                        self.logger.debug(f"金額抽出エラー: {str(e)}, マッチ: {match.groups()}")
+                        self.logger.debug("金額抽出エラー: %s, マッチ: %s", e, match.groups())
                         continue
             
             # 重複を除去（同じ位置の金額は最初のもののみ）
@@ -107,7 +142,7 @@ class CurrencyConverter:
                     seen_amounts.add(amount_key)
                     seen_positions.add(amount["position"])
             
-            self.logger.info(f"金額抽出成功: {len(unique_amounts)}個の金額を検出")
+            self.logger.info("金額抽出成功: %d個の金額を検出", len(unique_amounts))
             
             return unique_amounts
             
@@ -134,7 +169,7 @@ class CurrencyConverter:
             # 重複を除去
             unique_currencies = list(set(detected_currencies))
             
-            self.logger.info(f"通貨検出成功: {unique_currencies}")
+            self.logger.info("通貨検出成功: %s", unique_currencies)
             
             return unique_currencies
             
@@ -145,33 +180,44 @@ class CurrencyConverter:
     def convert_currencies(self, amounts: List[Dict[str, Any]], currencies: List[str]) -> List[Dict[str, Any]]:
         """通貨を日本円に換算"""
         try:
-            conversions = []
+            # 為替レートを取得（取得に失敗した場合はフォールバックレート）
+            exchange_rates, rate_source = self._current_exchange_rates()
             
-            # 為替レートを取得
-            exchange_rates = self._get_exchange_rates()
+            # 一括換算（換算日時は1回の呼び出しで共通）
+            frame = self.convert_currencies_bulk(
+                [amount_data["amount"] for amount_data in amounts],
+                [amount_data["currency"] for amount_data in amounts],
+                exchange_rates=exchange_rates,
+                target_currencies=self.display_currencies
+            )
+            conversion_date = frame.attrs["conversion_date"]
             
-            for amount_data in amounts:
-                amount = amount_data["amount"]
-                currency = amount_data["currency"]
-                
-                # 為替レートを取得
-                rate = exchange_rates.get(currency, 1.0)
-                
-                # 日本円に換算
-                jpy_amount = amount * rate
-                
+            conversions = []
+            converted_columns = {currency: frame[f"amount_{currency}"].tolist() for currency in self.display_currencies}
+            
+            for i, (amount_data, row) in enumerate(zip(amounts, frame.itertuples(index=False))):
+                # レートが分からない通貨（UNKNOWN 等）の金額は換算せず、rate_missing で示す
                 conversion = {
-                    "original_amount": amount,
-                    "original_currency": currency,
-                    "jpy_amount": round(jpy_amount, 2),
-                    "exchange_rate": rate,
-                    "conversion_date": datetime.now().isoformat(),
+                    "original_amount": amount_data["amount"],
+                    "original_currency": amount_data["currency"],
+                    "jpy_amount": None if row.rate_missing else float(row.jpy_amount),
+                    "exchange_rate": None if row.rate_missing else float(row.exchange_rate),
+                    "converted_amounts": {
+                        currency: (None if np.isnan(values[i]) else values[i])
+                        for currency, values in converted_columns.items()
+                    },
+                    "conversion_date": conversion_date,
+                    "rate_source": rate_source,
+                    "rate_missing": bool(row.rate_missing),
                     "context": amount_data.get("context", "")
                 }
                 
                 conversions.append(conversion)
             
-            self.logger.info(f"通貨換算成功: {len(conversions)}個の金額を換算")
+            missing = sorted({c["original_currency"] for c in conversions if c["rate_missing"]})
+            if missing:
+                self.logger.warning("為替レートが不明な通貨の金額は換算しません: %s", ", ".join(missing))
+            self.logger.info("通貨換算成功: %d個の金額を換算", len(conversions))
             
             return conversions
             
@@ -179,42 +225,169 @@ class CurrencyConverter:
             self.logger.error(f"通貨換算に失敗しました: {str(e)}")
             return []
     
+    def convert_currencies_bulk(self, amounts: Sequence[float], currencies: Sequence[str],
+                                exchange_rates: Optional[Dict[str, float]] = None,
+                                target_currencies: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """金額と通貨コードの配列を一括で日本円に換算（列指向の結果を返す）
+        
+        target_currencies を指定すると、同じレートから算出したクロスレートで
+        各表示通貨への換算額を amount_<通貨コード> 列として追加する。
+        レートが分からない通貨の行は換算額・レートが NaN になり、rate_missing 列が True になる。
+        """
+        amount_array = np.asarray(amounts, dtype=float)
+        currency_array = np.asarray(currencies, dtype=object)
+        
+        if amount_array.shape != currency_array.shape:
+            raise ValueError(f"金額と通貨の件数が一致しません: {len(amount_array)} != {len(currency_array)}")
+        
+        if exchange_rates is None:
+            exchange_rates = self._get_exchange_rates()
+        
+        # 通貨コードをユニーク値に分解し、クロスレート行列（換算元の通貨の種類数 × 基準通貨＋表示通貨）を
+        # 1回の取得レートから作って各行に割り当てる（追加のAPI呼び出しなし）
+        codes, unique_currencies = pd.factorize(currency_array)
+        target_currencies = list(target_currencies or [])
+        cross_rates = self.get_cross_rate_matrix(
+            list(unique_currencies), exchange_rates, [self.base_currency, *target_currencies]
+        ).to_numpy()[codes]
+        rate_array = cross_rates[:, 0]
+        
+        frame = pd.DataFrame({
+            "original_amount": amount_array,
+            "original_currency": currency_array,
+            "jpy_amount": np.round(amount_array * rate_array, 2),
+            "exchange_rate": rate_array,
+            "rate_missing": np.isnan(rate_array)
+        })
+        
+        for column, target_currency in enumerate(target_currencies, start=1):
+            frame[f"amount_{target_currency}"] = np.round(amount_array * cross_rates[:, column], 2)
+        frame.attrs["conversion_date"] = datetime.now().isoformat()
+        
+        return frame
+    
+    def get_cross_rate_matrix(self, currencies: Optional[Sequence[str]] = None,
+                              exchange_rates: Optional[Dict[str, float]] = None,
+                              target_currencies: Optional[Sequence[str]] = None) -> pd.DataFrame:
+        """1回の取得レートからクロスレート行列を作成（行: 換算元, 列: 換算先, 値: 1単位あたりの換算先通貨額）
+        
+        target_currencies を省略した場合は currencies 同士の正方行列。レートが分からない通貨は NaN。
+        """
+        if exchange_rates is None:
+            exchange_rates = self._get_exchange_rates()
+        
+        if currencies is None:
+            currencies = list(dict.fromkeys([self.base_currency, *self.target_currencies, *self.display_currencies]))
+        if target_currencies is None:
+            target_currencies = currencies
+        
+        source_per_unit = np.array([self._base_per_unit(currency, exchange_rates) for currency in currencies],
+                                   dtype=float)
+        target_per_unit = np.array([self._base_per_unit(currency, exchange_rates) for currency in target_currencies],
+                                   dtype=float)
+        
+        return pd.DataFrame(
+            source_per_unit[:, np.newaxis] / target_per_unit[np.newaxis, :],
+            index=list(currencies),
+            columns=list(target_currencies)
+        )
+    
+    def _base_per_unit(self, currency: str, exchange_rates: Dict[str, float]) -> float:
+        """1単位あたりの基準通貨額を返す（レートがない通貨はNaN）"""
+        if currency == self.base_currency:
+            return 1.0
+        return float(exchange_rates.get(currency, np.nan))
+    
     def _get_exchange_rates(self) -> Dict[str, float]:
-        """為替レートを取得"""
+        """為替レートを取得（取得に成功したレートは rate_cache_seconds の間再利用する）"""
+        return self._current_exchange_rates()[0]
+    
+    def _current_exchange_rates(self) -> Tuple[Dict[str, float], str]:
+        """為替レートとその取得元（api / fallback）を取得
+        
+        取得は1スレッドのみがロックの外で行う。他のスレッドが取得中の場合、期限切れのキャッシュが
+        あれば待たずにそれを使い、なければ取得の完了を待つ。取得に失敗した場合は
+        fallback_cache_seconds の間フォールバックレートを使う。
+        """
+        with self._rates_condition:
+            while True:
+                now = time.monotonic()
+                if self._rates_cache is not None and now - self._rates_fetched_at < self.rate_cache_seconds:
+                    CACHE_REQUESTS.inc(cache="exchange_rates", result="hit")
+                    return self._rates_cache, "api"
+                if now < self._fallback_until:
+                    CACHE_REQUESTS.inc(cache="exchange_rates", result="fallback")
+                    return self.fallback_rates, "fallback"
+                if not self._rates_fetching:
+                    break
+                if self._rates_cache is not None:
+                    CACHE_REQUESTS.inc(cache="exchange_rates", result="stale")
+                    return self._rates_cache, "api"
+                self._rates_condition.wait()
+            CACHE_REQUESTS.inc(cache="exchange_rates", result="miss")
+            self._rates_fetching = True
+        
+        rates = None
         try:
-            # 無料APIから為替レートを取得
-            response = requests.get(f"{self.api_url}{self.base_currency}")
+            rates = self._fetch_exchange_rates()
+        finally:
+            with self._rates_condition:
+                self._rates_fetching = False
+                if rates is None:
+                    self._fallback_until = time.monotonic() + self.fallback_cache_seconds
+                else:
+                    self._rates_cache = rates
+                    self._rates_fetched_at = time.monotonic()
+                    self._fallback_until = 0.0
+                self._rates_condition.notify_all()
+        
+        if rates is None:
+            return self.fallback_rates, "fallback"
+        return rates, "api"
+    
+    def _fetch_exchange_rates(self) -> Optional[Dict[str, float]]:
+        """為替レートAPIから1回だけ取得（1単位あたりの基準通貨額に変換、失敗時はNone）"""
+        try:
+            # 無料APIから為替レートを取得（エラー応答もブレーカーの失敗として数える）
+            def fetch(timeout: float) -> requests.Response:
+                response = requests.get(f"{self.api_url}{self.base_currency}", timeout=timeout)
+                if response.status_code != 200:
+                    raise RuntimeError(f"為替レートAPIエラー: {response.status_code}")
+                return response
             
-            if response.status_code == 200:
-                data = response.json()
-                rates = data.get("rates", {})
-                
-                # 必要な通貨のレートのみを抽出
-                filtered_rates = {}
-                for currency in self.target_currencies:
-                    if currency in rates:
-                        # 為替レートの妥当性をチェック
-                        rate = rates[currency]
-                        if self._is_valid_rate(currency, rate):
-                            filtered_rates[currency] = rate
-                        else:
-                            self.logger.warning(f"為替レートが異常値のためフォールバックを使用: {currency} = {rate}")
-                            filtered_rates[currency] = self.fallback_rates.get(currency, 1.0)
+            response = guarded_call(self.rates_breaker, fetch, self.rates_timeout, rate_limit=self.rates_rate_limit)
+            data = response.json()
+            rates = data.get("rates", {})
+            
+            # 必要な通貨のレートのみを抽出
+            # APIは「基準通貨1単位あたりの各通貨額」を返すため逆数を取る
+            filtered_rates = {}
+            for currency in dict.fromkeys([*self.target_currencies, *self.display_currencies]):
+                if currency == self.base_currency or not rates.get(currency):
+                    continue
                 
-                self.logger.info(f"為替レート取得成功: {filtered_rates}")
-                return filtered_rates
+                # 為替レートの妥当性をチェック
+                rate = 1.0 / rates[currency]
+                if self._is_valid_rate(currency, rate):
+                    filtered_rates[currency] = rate
+                else:
+                    self.logger.warning("為替レートが異常値のためフォールバックを使用: %s = %s", currency, rate)
+                    FALLBACKS.inc(service="exchange_rates", reason="invalid_rate")
+                    if currency in self.fallback_rates:
+                        filtered_rates[currency] = self.fallback_rates[currency]
             
-            else:
-                self.logger.warning(f"為替レートAPIエラー: {response.status_code}")
-                return self.fallback_rates
+            self.logger.info("為替レート取得成功: %s", filtered_rates)
+            return filtered_rates
                 
         except Exception as e:
-            self.logger.warning(f"為替レート取得に失敗、フォールバックレートを使用: {str(e)}")
-            return self.fallback_rates
+            self.logger.warning("為替レート取得に失敗、フォールバックレートを使用: %s", e)
+            reason = skip_reason(e) if isinstance(e, (CircuitOpenError, DeadlineExceeded, RateLimitExceeded)) else "error"
+            FALLBACKS.inc(service="exchange_rates", reason=reason)
+            return None
     
     def _is_valid_rate(self, currency: str, rate: float) -> bool:
         """為替レートの妥当性をチェック"""
-        # 通貨ごとの妥当な範囲を定義
+        # 通貨ごとの妥当な範囲を定義（日本円建て）
         valid_ranges = {
             "USD": (100, 200),    # 1 USD = 100-200 JPY
             "EUR": (120, 180),    # 1 EUR = 120-180 JPY
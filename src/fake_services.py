@@ -0,0 +1,305 @@
+"""
+負荷試験用の外部サービス代替モジュール（Vision・Translate・Gemini・為替レートAPI）
+"""
+
+import re
+import math
+import json
+import time
+import random
+import hashlib
+import logging
+import threading
+import http.server
+from collections import deque
+from types import SimpleNamespace
+from typing import Dict, Any, List, Mapping, Optional
+
+# 代替Vision APIが返すレシート本文のサンプル
+SAMPLE_RECEIPT_TEXTS = [
+    """RED ELEPHANT
+123 Jalan Bukit Bintang
+Kuala Lumpur, Malaysia
+
+Kao Mun Gai Chicken White Rice
+RM 15.90
+
+Tax: RM 0.00
+Total: RM 15.90
+
+Date: 2024-01-15""",
+    """McDonald's Bangkok
+Big Mac Meal ฿189.00
+Water Bottle ฿20.00
+Total ฿209.00
+Thank you for visiting!
+Date: 2024-02-03""",
+    """Starbucks Coffee
+Caramel Macchiato $5.45
+Chips $2.10
+Tax $0.68
+Total $8.23
+Have a great day!
+Date: 2024-03-21""",
+    """편의점 GS25
+삼각김밥 ₩1,500
+생수 ₩900
+Total ₩2400
+Date: 2024-04-09""",
+    """Café de Flore
+Croissant €3.50
+Café crème €5.80
+Total €9.30
+Date: 2024-05-30""",
+]
+
+# SAMPLE_RECEIPT_TEXTS と同じ順のレシートの言語（代替Gemini APIの応答に使う）
+SAMPLE_RECEIPT_LANGUAGES = ["en", "en", "en", "ko", "fr"]
+
+# 代替Gemini APIが金額の通貨記号を ISO 4217 コードに変換する表
+SAMPLE_CURRENCY_SYMBOLS = {"RM": "MYR", "฿": "THB", "$": "USD", "₩": "KRW", "€": "EUR"}
+
+_SAMPLE_AMOUNT_PATTERN = re.compile(r"^(?P<label>.*?):?\s*(?P<symbol>RM|฿|\$|₩|€)\s?(?P<amount>[\d,]+(?:\.\d+)?)$")
+_SAMPLE_DATE_PATTERN = re.compile(r"Date:\s*(\d{4}-\d{2}-\d{2})")
+
+class FakeServiceError(Exception):
+    """代替サービスが返すエラー（code はHTTPステータス相当）"""
+    
+    def __init__(self, message: str, code: int = 500):
+        super().__init__(message)
+        self.code = code
+
+class FakeServiceBehavior:
+    """代替サービスの応答特性（レイテンシ分布・エラー率・クォータ）
+    
+    latency の median_ms と p99_ms から対数正規分布を作る（p99_ms を省略すると一定）。
+    error_rate の確率で 500 エラー、requests_per_minute を超えると 429 エラーを返す。
+    呼び出し側のタイムアウトより遅い応答は、タイムアウト分だけ待ってから失敗させる。
+    """
+    
+    # 標準正規分布の99パーセンタイル
+    Z_99 = 2.326
+    
+    def __init__(self, name: str, settings: Optional[Mapping[str, Any]] = None, seed: Optional[int] = None):
+        settings = settings or {}
+        latency = settings.get("latency", {})
+        self.name = name
+        self.median_seconds = latency.get("median_ms", 0) / 1000.0
+        p99_seconds = latency.get("p99_ms", latency.get("median_ms", 0)) / 1000.0
+        self.sigma = 0.0
+        if self.median_seconds > 0 and p99_seconds > self.median_seconds:
+            self.sigma = math.log(p99_seconds / self.median_seconds) / self.Z_99
+        self.error_rate = settings.get("error_rate", 0.0)
+        self.requests_per_minute = settings.get("requests_per_minute")
+        
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+        self._recent = deque()
+        self.calls = 0
+        self.errors = 0
+        self.throttled = 0
+    
+    def sample_latency(self) -> float:
+        """応答までの時間（秒）を1つ取り出す"""
+        if self.median_seconds <= 0:
+            return 0.0
+        with self._lock:
+            if self.sigma == 0:
+                return self.median_seconds
+            return self.median_seconds * math.exp(self._random.gauss(0, self.sigma))
+    
+    def before_response(self, timeout: Optional[float] = None):
+        """クォータ・レイテンシ・エラーを適用（失敗時は FakeServiceError・TimeoutError）"""
+        now = time.monotonic()
+        with self._lock:
+            self.calls += 1
+            if self.requests_per_minute:
+                while self._recent and now - self._recent[0] >= 60:
+                    self._recent.popleft()
+                if len(self._recent) >= self.requests_per_minute:
+                    self.throttled += 1
+                    raise FakeServiceError(f"{self.name}: クォータを超過しました", code=429)
+                self._recent.append(now)
+            fail = self._random.random() < self.error_rate
+        
+        latency = self.sample_latency()
+        if timeout is not None and latency > timeout:
+            time.sleep(timeout)
+            raise TimeoutError(f"{self.name}: {timeout:.2f}秒以内に応答がありませんでした")
+        time.sleep(latency)
+        
+        if fail:
+            with self._lock:
+                self.errors += 1
+            raise FakeServiceError(f"{self.name}: サーバーエラー", code=500)
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """呼び出し件数の集計"""
+        with self._lock:
+            return {"calls": self.calls, "errors": self.errors, "throttled": self.throttled}
+
+class FakeVisionClient:
+    """Vision API（ImageAnnotatorClient）の代替
+    
+    画像の内容ハッシュからサンプルテキストを1つ選んで返すため、同じ画像には常に同じ結果を返す。
+    """
+    
+    def __init__(self, behavior: FakeServiceBehavior, sample_texts: List[str]):
+        self.behavior = behavior
+        self.sample_texts = sample_texts
+    
+    def text_detection(self, image: Any, timeout: Optional[float] = None, **kwargs: Any):
+        """テキスト検出（image は vision の Image・{"content": bytes}・bytes、text_annotations[0].description に全文）"""
+        self.behavior.before_response(timeout)
+        if isinstance(image, Mapping):
+            content = image.get("content")
+        elif isinstance(image, (bytes, bytearray)):
+            content = image
+        else:
+            content = getattr(image, "content", None)
+        content = bytes(content or b"")
+        index = int(hashlib.sha256(content).hexdigest(), 16) % len(self.sample_texts)
+        return SimpleNamespace(text_annotations=[SimpleNamespace(description=self.sample_texts[index])])
+
+class FakeTranslateClient:
+    """Translate API（TranslationServiceClient）の代替"""
+    
+    def __init__(self, behavior: FakeServiceBehavior, detect_language):
+        self.behavior = behavior
+        self._detect_language = detect_language
+    
+    def detect_language(self, request: Mapping[str, Any], timeout: Optional[float] = None, **kwargs: Any):
+        """言語検出（languages[0] に言語コードと信頼度）"""
+        self.behavior.before_response(timeout)
+        language = SimpleNamespace(language_code=self._detect_language(request["content"]), confidence=0.9)
+        return SimpleNamespace(languages=[language])
+    
+    def translate_text(self, request: Mapping[str, Any], timeout: Optional[float] = None, **kwargs: Any):
+        """翻訳（translations[0].translated_text に結果）"""
+        self.behavior.before_response(timeout)
+        target = request.get("target_language_code", "ja")
+        translations = [SimpleNamespace(translated_text=f"[{target}] {text}") for text in request["contents"]]
+        return SimpleNamespace(translations=translations)
+
+class FakeGeminiModel:
+    """Gemini API（GenerativeModel）の代替
+    
+    画像の内容ハッシュで選んだサンプルテキストを解析し、構造化抽出の指示どおりのJSONを返す。
+    """
+    
+    def __init__(self, behavior: FakeServiceBehavior, sample_texts: List[str] = SAMPLE_RECEIPT_TEXTS,
+                 languages: List[str] = SAMPLE_RECEIPT_LANGUAGES):
+        self.behavior = behavior
+        self.sample_texts = sample_texts
+        self.languages = languages
+    
+    def generate_content(self, contents: List[Any], request_options: Optional[Mapping[str, Any]] = None,
+                         **kwargs: Any):
+        """構造化抽出（text に JSON 文字列）"""
+        self.behavior.before_response((request_options or {}).get("timeout"))
+        content = next((part["data"] for part in contents if isinstance(part, Mapping)), b"")
+        index = int(hashlib.sha256(content).hexdigest(), 16) % len(self.sample_texts)
+        language = self.languages[index] if index < len(self.languages) else "en"
+        return SimpleNamespace(text=json.dumps(_structure_sample(self.sample_texts[index], language),
+                                               ensure_ascii=False))
+
+def _structure_sample(text: str, language: str) -> Dict[str, Any]:
+    """サンプルテキストを構造化抽出の応答形式に変換"""
+    lines = [line.strip() for line in text.splitlines() if line.strip()]
+    data: Dict[str, Any] = {
+        "merchant": lines[0] if lines else None,
+        "date": None,
+        "currency": None,
+        "language": language,
+        "items": [],
+        "tax": None,
+        "total": None,
+        "raw_text": text,
+        "translation_ja": f"[ja] {text}"
+    }
+    
+    date_match = _SAMPLE_DATE_PATTERN.search(text)
+    if date_match:
+        data["date"] = date_match.group(1)
+    
+    # 「品名 記号金額」の行と、品名の次の行に金額だけがある行の両方を扱う
+    previous = ""
+    for line in lines[1:]:
+        match = _SAMPLE_AMOUNT_PATTERN.match(line)
+        if not match:
+            previous = line
+            continue
+        label = match.group("label").strip() or previous
+        amount = float(match.group("amount").replace(",", ""))
+        data["currency"] = SAMPLE_CURRENCY_SYMBOLS[match.group("symbol")]
+        if label.lower().startswith("total"):
+            data["total"] = amount
+        elif label.lower().startswith("tax"):
+            data["tax"] = amount
+        else:
+            data["items"].append({"description": label, "description_ja": f"[ja] {label}", "amount": amount})
+        previous = ""
+    return data
+
+class _FakeRatesHandler(http.server.BaseHTTPRequestHandler):
+    """GET /v4/latest/<基準通貨> に exchangerate-api.com と同じ形式で応答"""
+    
+    def do_GET(self):
+        base = self.path.rstrip("/").rsplit("/", 1)[-1].upper()
+        try:
+            self.server.behavior.before_response()
+        except FakeServiceError as e:
+            self._send(e.code, {"error": str(e)})
+            return
+        
+        # 基準通貨1単位あたりの各通貨額（fallback_rates は各通貨1単位あたりの円）
+        base_per_unit = {"JPY": 1.0, **self.server.rates}
+        if base not in base_per_unit:
+            self._send(404, {"error": f"unsupported base: {base}"})
+            return
+        rates = {currency: base_per_unit[base] / value for currency, value in base_per_unit.items()}
+        self._send(200, {"base": base, "date": time.strftime("%Y-%m-%d"), "rates": rates})
+    
+    def _send(self, status: int, data: Dict[str, Any]):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def log_message(self, format, *args):
+        pass
+
+class FakeRatesServer(http.server.ThreadingHTTPServer):
+    """為替レートAPIの代替HTTPサーバー（バックグラウンドスレッドで起動）"""
+    
+    daemon_threads = True
+    
+    def __init__(self, behavior: FakeServiceBehavior, rates: Mapping[str, float], port: int = 0):
+        super().__init__(("127.0.0.1", port), _FakeRatesHandler)
+        self.behavior = behavior
+        self.rates = dict(rates)
+        self._thread = None
+    
+    @property
+    def api_url(self) -> str:
+        """currency.api_url に設定するURL（末尾に基準通貨を付けて呼ばれる）"""
+        return f"http://127.0.0.1:{self.server_address[1]}/v4/latest/"
+    
+    def start(self) -> "FakeRatesServer":
+        self._thread = threading.Thread(target=self.serve_forever, name="fake-rates", daemon=True)
+        self._thread.start()
+        logging.getLogger(__name__).info(f"為替レートAPIの代替サーバーを起動しました: {self.api_url}")
+        return self
+    
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def fake_settings(config: Mapping[str, Any], service: str) -> Optional[Mapping[str, Any]]:
+    """fakes.enabled が有効な場合に、サービスの代替設定を返す（無効ならNone）"""
+    fakes_config = config.get("fakes", {})
+    if not fakes_config.get("enabled", False):
+        return None
+    return fakes_config.get(service, {})
@@ -0,0 +1,222 @@
+"""
+Gemini による構造化抽出モジュール（画像1回の呼び出しで店舗・明細・金額・通貨・日付・言語・翻訳を取得）
+"""
+
+import os
+import re
+import json
+import logging
+import warnings
+import mimetypes
+from io import BytesIO
+from typing import Dict, Any, List, Optional
+
+from PIL import Image
+
+from src.resilience import get_breaker, guarded_call, skip_reason, CircuitOpenError, DeadlineExceeded
+from src.rate_limiter import service_rate_limit, RateLimitExceeded
+from src.metrics import FALLBACKS
+from src.fake_services import FakeServiceBehavior, FakeGeminiModel, fake_settings
+from src.image_files import find_image_path
+
+# Gemini に渡す指示（応答は response_mime_type で JSON に固定する）
+EXTRACTION_PROMPT = """You are reading a photo of a shop receipt. Return a single JSON object with these keys:
+- "merchant": shop name as printed, or null
+- "date": purchase date as YYYY-MM-DD, or null
+- "currency": ISO 4217 code of the amounts (e.g. "THB", "USD", "MYR"), inferred from symbols and location
+- "language": ISO 639-1 code of the receipt's main language
+- "items": list of {"description": original text, "description_ja": Japanese translation, "amount": number}
+- "tax": tax amount as a number, or null
+- "total": amount paid as a number, or null
+- "raw_text": the full receipt text transcribed line by line
+- "translation_ja": Japanese translation of the full receipt text
+Amounts are plain numbers without currency symbols or thousands separators."""
+
+CURRENCY_CODE_PATTERN = re.compile(r"^[A-Z]{3}$")
+
+class GeminiExtractor:
+    """レシート画像を Gemini に1回だけ送り、構造化JSONを受け取るクラス
+    
+    OCR・言語検出・翻訳・金額抽出（3〜4回の外部API呼び出し）を1回にまとめる。
+    Gemini が利用できない・失敗した場合は None を返し、呼び出し側は従来の処理に切り替える。
+    """
+    
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        
+        gemini_config = config["google_apis"].get("gemini", {})
+        self.model_name = gemini_config.get("model", "gemini-1.5-flash")
+        
+        # 画像ファイルパターン（image_bytes を渡されなかった場合に読み込む）
+        self.file_pattern = next(
+            (step["target_file_pattern"]
+             for phase in config["processing_flow"] for step in phase["steps"]
+             if step["action"] == "load_image" and "target_file_pattern" in step),
+            "receipts/{{receipt_id}}.jpg"
+        )
+        
+        resilience_config = config.get("resilience", {})
+        self.gemini_timeout = resilience_config.get("timeouts", {}).get("gemini", 30)
+        self.gemini_breaker = get_breaker("gemini", resilience_config.get("breaker"))
+        self.gemini_rate_limit = service_rate_limit(config, "gemini", gemini_config.get("rate_limit"))
+        
+        # Gemini APIの初期化（fakes.enabled の場合は負荷試験・テスト用の代替モデル）
+        fake_gemini = fake_settings(config, "gemini")
+        if fake_gemini is not None:
+            self.model = FakeGeminiModel(FakeServiceBehavior("gemini", fake_gemini))
+            self.logger.info("Gemini APIの代替モデルを使用します")
+        elif gemini_config.get("enabled", True):
+            self.model = self._create_model(gemini_config)
+        else:
+            self.model = None
+    
+    def _create_model(self, gemini_config: Dict[str, Any]):
+        """Gemini のモデルを作成（ライブラリ・APIキーがなければ None）"""
+        api_key = os.getenv(gemini_config.get("api_key_env", "GOOGLE_GEMINI_API_KEY"))
+        if not api_key:
+            self.logger.warning("Gemini APIキーが設定されていないため、従来の処理フローで動作します")
+            return None
+        
+        try:
+            # 使う場合のみ読み込む（読み込みに時間がかかり、廃止予定の警告も出るため）
+            with warnings.catch_warnings():
+                warnings.simplefilter("ignore", FutureWarning)
+                import google.generativeai as genai
+        except ImportError:
+            self.logger.warning("Gemini APIが利用できません（google-generativeai が未インストール）")
+            return None
+        
+        try:
+            genai.configure(api_key=api_key)
+            model = genai.GenerativeModel(
+                self.model_name,
+                generation_config={"response_mime_type": "application/json", "temperature": 0}
+            )
+            self.logger.info(f"Gemini APIを初期化しました: {self.model_name}")
+            return model
+        except Exception as e:
+            self.logger.error(f"Gemini APIの初期化に失敗: {str(e)}")
+            return None
+    
+    def extract(self, receipt_id: str, image_bytes: Optional[bytes] = None) -> Optional[Dict[str, Any]]:
+        """レシート画像から構造化データを抽出（利用できない・失敗した場合は None）"""
+        try:
+            if not self.model:
+                FALLBACKS.inc(service="gemini", reason="unavailable")
+                return None
+            
+            image_path = find_image_path(self.file_pattern, receipt_id)
+            if image_bytes is None:
+                if not image_path.exists():
+                    self.logger.warning("画像ファイルが見つかりません: %s", image_path)
+                    FALLBACKS.inc(service="gemini", reason="missing_image")
+                    return None
+                image_bytes = image_path.read_bytes()
+            mime_type = _image_mime_type(image_bytes, image_path.name)
+            
+            response = guarded_call(
+                self.gemini_breaker,
+                lambda timeout: self.model.generate_content(
+                    [EXTRACTION_PROMPT, {"mime_type": mime_type, "data": image_bytes}],
+                    request_options={"timeout": timeout}
+                ),
+                self.gemini_timeout,
+                rate_limit=self.gemini_rate_limit
+            )
+            
+            extraction = self._normalize(json.loads(response.text))
+            self.logger.info("構造化抽出成功: %s %s %s (明細%d件)", extraction["merchant"],
+                             extraction["total"], extraction["currency"], len(extraction["items"]))
+            return extraction
+        
+        except (CircuitOpenError, DeadlineExceeded, RateLimitExceeded) as e:
+            self.logger.warning("Gemini APIを呼び出さずに従来の処理フローを使用します: %s", e)
+            FALLBACKS.inc(service="gemini", reason=skip_reason(e))
+            return None
+        except Exception as e:
+            self.logger.error(f"構造化抽出に失敗しました: {str(e)}")
+            FALLBACKS.inc(service="gemini", reason="error")
+            return None
+    
+    def _normalize(self, data: Dict[str, Any]) -> Dict[str, Any]:
+        """モデルの応答を検証し、型をそろえる（不正な金額の明細は除外）"""
+        if not isinstance(data, dict):
+            raise ValueError("応答がJSONオブジェクトではありません")
+        
+        items: List[Dict[str, Any]] = []
+        for item in data.get("items") or []:
+            amount = _to_amount(item.get("amount")) if isinstance(item, dict) else None
+            if amount is None:
+                continue
+            items.append({
+                "description": str(item.get("description") or ""),
+                "description_ja": str(item.get("description_ja") or ""),
+                "amount": amount
+            })
+        
+        currency = str(data.get("currency") or "").strip().upper()
+        date = str(data.get("date") or "")
+        raw_text = str(data.get("raw_text") or "")
+        if not raw_text:
+            raise ValueError("応答に raw_text がありません")
+        
+        return {
+            "merchant": str(data["merchant"]).strip() if data.get("merchant") else None,
+            "date": date if re.fullmatch(r"\d{4}-\d{2}-\d{2}", date) else None,
+            "currency": currency if CURRENCY_CODE_PATTERN.match(currency) else "UNKNOWN",
+            "language": str(data.get("language") or "und").strip().lower(),
+            "items": items,
+            "tax": _to_amount(data.get("tax")),
+            "total": _to_amount(data.get("total")),
+            "raw_text": raw_text,
+            "translation_ja": str(data.get("translation_ja") or "")
+        }
+    
+    def amounts(self, extraction: Dict[str, Any]) -> List[Dict[str, Any]]:
+        """換算対象の金額（extract_amounts と同じ形式、合計があれば合計のみ・なければ明細）"""
+        if extraction["total"] is not None:
+            entries = [("Total", extraction["total"])]
+        else:
+            entries = [(item["description"], item["amount"]) for item in extraction["items"]]
+        
+        return [
+            {
+                "amount": amount,
+                "currency": extraction["currency"],
+                "symbol": None,
+                "position": position,
+                "context": context,
+                "pattern_used": "gemini"
+            }
+            for position, (context, amount) in enumerate(entries)
+        ]
+
+def _to_amount(value: Any) -> Optional[float]:
+    """数値・数値文字列（桁区切りを含む）を金額に変換（変換できなければ None）"""
+    if isinstance(value, bool) or value is None:
+        return None
+    if isinstance(value, (int, float)):
+        return float(value)
+    try:
+        return float(str(value).replace(",", "").strip())
+    except ValueError:
+        return None
+
+def _image_mime_type(image_bytes: bytes, filename: str) -> str:
+    """画像の内容から MIME タイプを判定（Pillow で判定できなければファイル名、それも不明なら JPEG）"""
+    try:
+        # ヘッダーのみ解析し、画素は展開しない
+        with Image.open(BytesIO(image_bytes)) as image:
+            mime_type = Image.MIME.get(image.format)
+        if mime_type:
+            return mime_type
+    except Exception:
+        pass
+    return mimetypes.guess_type(filename)[0] or "image/jpeg"
+
+def create_gemini_extractor(config: Dict[str, Any]) -> Optional[GeminiExtractor]:
+    """processing.mode が gemini の場合に構造化抽出を作成（それ以外は None）"""
+    if config.get("processing", {}).get("mode", "pipeline") != "gemini":
+        return None
+    return GeminiExtractor(config)
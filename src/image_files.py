@@ -0,0 +1,54 @@
+"""
+レシート画像ファイルのパス解決モジュール（画像形式ごとの拡張子）
+"""
+
+from pathlib import Path
+from typing import List, Optional
+
+# 画像形式ごとの保存時の拡張子（画像ファイルパターンの拡張子は既定の形式として扱う）
+IMAGE_SUFFIXES = {
+    "image/jpeg": ".jpg",
+    "image/png": ".png",
+    "image/webp": ".webp",
+    "image/heic": ".heic",
+    "image/heif": ".heif"
+}
+
+def image_path(file_pattern: str, receipt_id: str, content_type: Optional[str] = None) -> Path:
+    """receipt_id の画像を保存するパス（content_type を渡すとその形式の拡張子にする）"""
+    path = Path(file_pattern.replace("{{receipt_id}}", receipt_id))
+    suffix = IMAGE_SUFFIXES.get(content_type or "")
+    if suffix and path.suffix.lower() not in _suffixes_of(content_type):
+        path = path.with_suffix(suffix)
+    return path
+
+def find_image_path(file_pattern: str, receipt_id: str) -> Path:
+    """receipt_id の既存の画像ファイルを探す（見つからなければ画像ファイルパターンどおりのパス）"""
+    path = image_path(file_pattern, receipt_id)
+    if path.exists():
+        return path
+    
+    for suffix in dict.fromkeys(IMAGE_SUFFIXES.values()):
+        candidate = path.with_suffix(suffix)
+        if candidate != path and candidate.exists():
+            return candidate
+    return path
+
+def list_image_receipt_ids(file_pattern: str) -> List[str]:
+    """画像ファイルパターン（拡張子は画像形式ごとに読み替え）に一致する画像の receipt_id 一覧"""
+    pattern = Path(file_pattern)
+    prefix, _, suffix = pattern.name.partition("{{receipt_id}}")
+    stem_suffix = suffix[:-len(pattern.suffix)] if pattern.suffix else suffix
+    suffixes = {pattern.suffix.lower(), *IMAGE_SUFFIXES.values()}
+    
+    receipt_ids = set()
+    for path in pattern.parent.glob(f"{prefix}*{stem_suffix}.*"):
+        if path.name.startswith(".") or path.suffix.lower() not in suffixes:
+            continue
+        receipt_ids.add(path.name[len(prefix):len(path.name) - len(stem_suffix) - len(path.suffix)])
+    return sorted(receipt_ids)
+
+def _suffixes_of(content_type: str) -> List[str]:
+    """画像形式の拡張子の表記（.jpeg も JPEG として扱う）"""
+    suffix = IMAGE_SUFFIXES[content_type]
+    return [suffix, ".jpeg"] if suffix == ".jpg" else [suffix]
@@ -3,19 +3,39 @@
 """
 
 import os
+import time
+import json
 import base64
+import hashlib
 from pathlib import Path
-from typing import Dict, Any, Optional
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional
 import logging
 from PIL import Image
 import io
 
+from src.resilience import get_breaker, guarded_call, skip_reason, CircuitOpenError, DeadlineExceeded
+from src.rate_limiter import service_rate_limit, RateLimitExceeded
+from src.metrics import FALLBACKS, IMAGE_BYTES
+from src.fake_services import FakeServiceBehavior, FakeVisionClient, SAMPLE_RECEIPT_TEXTS, fake_settings
+from src.result_writer import atomic_write_json
+from src.image_files import find_image_path, list_image_receipt_ids
+
+# EXIF タグ（Orientation・DateTime は IFD0、DateTimeOriginal・OffsetTimeOriginal は Exif IFD）
+EXIF_IFD = 0x8769
+EXIF_ORIENTATION = 0x0112
+EXIF_DATETIME = 0x0132
+EXIF_DATETIME_ORIGINAL = 0x9003
+EXIF_OFFSET_TIME_ORIGINAL = 0x9011
+
 # Google Cloud Vision API
 try:
     from google.cloud import vision
     from google.cloud.vision_v1 import types
 except ImportError:
     vision = None
+    types = None
     logging.warning("Google Cloud Vision APIが利用できません")
 
 class ImageProcessor:
@@ -25,8 +45,31 @@ class ImageProcessor:
         self.config = config
         self.logger = logging.getLogger(__name__)
         
-        # Google Cloud Vision APIの初期化
-        if vision:
+        # 画像ファイルパターンを処理フローの load_image ステップから1回だけ取得
+        self.file_pattern = next(
+            (step["target_file_pattern"]
+             for phase in config["processing_flow"] for step in phase["steps"]
+             if step["action"] == "load_image" and "target_file_pattern" in step),
+            "receipts/{{receipt_id}}.jpg"
+        )
+        
+        # 画像メタデータ索引（ヘッダーとEXIFのみ読み、更新日時が変わった画像だけ読み直す）
+        index_config = config.get("image_index", {})
+        self.metadata_index_path = Path(index_config.get("path", "results/image_index.json"))
+        self.metadata_index_workers = index_config.get("workers", 4)
+        
+        # 呼び出しタイムアウトとサーキットブレーカー（失敗が続いたらすぐダミーに切り替える）
+        resilience_config = config.get("resilience", {})
+        self.vision_timeout = resilience_config.get("timeouts", {}).get("vision", 10)
+        self.vision_breaker = get_breaker("vision", resilience_config.get("breaker"))
+        self.vision_rate_limit = service_rate_limit(config, "vision", config["google_apis"].get("vision", {}).get("rate_limit"))
+        
+        # Google Cloud Vision APIの初期化（fakes.enabled の場合は負荷試験用の代替クライアント）
+        fake_vision = fake_settings(config, "vision")
+        if fake_vision is not None:
+            self.vision_client = FakeVisionClient(FakeServiceBehavior("vision", fake_vision), SAMPLE_RECEIPT_TEXTS)
+            self.logger.info("Vision APIの代替クライアントを使用します")
+        elif vision:
             try:
                 # 認証情報が設定されているかチェック
                 import os
@@ -42,18 +85,26 @@ class ImageProcessor:
         else:
             self.vision_client = None
     
-    def load_image(self, receipt_id: str) -> Dict[str, Any]:
-        """レシート画像を読み込み"""
+    def load_image(self, receipt_id: str, image_bytes: Optional[bytes] = None) -> Dict[str, Any]:
+        """レシート画像を読み込み（image_bytes を渡した場合はファイルを読まずにそれを使う）"""
         try:
-            # 設定からファイルパターンを取得
-            file_pattern = self.config["processing_flow"][0]["steps"][0]["target_file_pattern"]
-            file_path = file_pattern.replace("{{receipt_id}}", receipt_id)
+            if image_bytes is not None:
+                # アーカイブ等から読み出した画像（ディスクを経由しない）
+                IMAGE_BYTES.observe(len(image_bytes))
+                return {
+                    "image_loaded": True,
+                    "image_size": len(image_bytes),
+                    "in_memory": True,
+                    "is_dummy": False
+                }
             
-            image_path = Path(file_path)
+            # アップロードした画像は形式ごとの拡張子で保存されている
+            image_path = find_image_path(self.file_pattern, receipt_id)
             
             if not image_path.exists():
                 # ダミー画像データを返す（テスト用）
-                self.logger.warning(f"画像ファイルが見つかりません: {image_path}")
+                self.logger.warning("画像ファイルが見つかりません: %s", image_path)
+                FALLBACKS.inc(service="image", reason="missing_file")
                 return {
                     "image_loaded": True,
                     "is_dummy": True,
@@ -64,7 +115,8 @@ class ImageProcessor:
             with open(image_path, 'rb') as f:
                 image_data = f.read()
             
-            self.logger.info(f"画像を読み込みました: {image_path}")
+            self.logger.info("画像を読み込みました: %s", image_path)
+            IMAGE_BYTES.observe(len(image_data))
             
             return {
                 "image_loaded": True,
@@ -77,35 +129,170 @@ class ImageProcessor:
             self.logger.error(f"画像の読み込みに失敗しました: {str(e)}")
             raise
     
-    def extract_text(self, receipt_id: str) -> Dict[str, Any]:
-        """画像からテキストを抽出（OCR）"""
+    def list_receipt_ids(self) -> List[str]:
+        """画像ファイルパターンに一致するレシート画像の receipt_id 一覧を取得（拡張子は形式ごと）"""
+        return list_image_receipt_ids(self.file_pattern)
+    
+    def refresh_metadata_index(self) -> Dict[str, Any]:
+        """画像メタデータ索引を更新し、集計（total・updated・removed・changed・seconds）を返す
+        
+        各画像のサイズ・撮影日時・向き・ファイルサイズ・SHA-256 を記録する。前回の索引と
+        更新日時（ナノ秒）とファイルサイズが同じ画像は読み直さないため、変更がなければ stat のみで終わる。
+        """
+        started = time.perf_counter()
+        index = self.load_metadata_index()
+        
+        paths = {receipt_id: find_image_path(self.file_pattern, receipt_id)
+                 for receipt_id in self.list_receipt_ids()}
+        
+        changed = []
+        for receipt_id, path in paths.items():
+            stat = path.stat()
+            entry = index.get(receipt_id)
+            if entry is None or entry["mtime_ns"] != stat.st_mtime_ns or entry["file_size"] != stat.st_size:
+                changed.append(receipt_id)
+        removed = [receipt_id for receipt_id in index if receipt_id not in paths]
+        for receipt_id in removed:
+            del index[receipt_id]
+        
+        # 変更された画像のみ読み込む（ハッシュ計算は GIL を解放するためスレッドで並列化）
+        if changed:
+            with ThreadPoolExecutor(max_workers=self.metadata_index_workers) as executor:
+                for receipt_id, entry in zip(changed, executor.map(lambda receipt_id: self._read_image_metadata(
+                        receipt_id, paths[receipt_id]), changed)):
+                    if entry is not None:
+                        index[receipt_id] = entry
+        
+        if changed or removed or not self.metadata_index_path.exists():
+            self.metadata_index_path.parent.mkdir(parents=True, exist_ok=True)
+            atomic_write_json(self.metadata_index_path,
+                              {"generated_at": datetime.now().isoformat(), "images": index}, indent=None)
+        
+        summary = {
+            "total": len(index),
+            "updated": len(changed),
+            "removed": len(removed),
+            "changed": changed,
+            "seconds": round(time.perf_counter() - started, 3)
+        }
+        self.logger.info("画像メタデータ索引を更新しました: %d件 (更新%d件・削除%d件, %.3f秒)",
+                         summary["total"], summary["updated"], summary["removed"], summary["seconds"])
+        return summary
+    
+    def load_metadata_index(self) -> Dict[str, Dict[str, Any]]:
+        """保存済みの画像メタデータ索引（receipt_id → メタデータ、未作成なら空）"""
+        try:
+            with open(self.metadata_index_path, 'r', encoding='utf-8') as f:
+                return json.load(f).get("images", {})
+        except FileNotFoundError:
+            return {}
+        except Exception as e:
+            self.logger.error(f"画像メタデータ索引の読み込みに失敗しました: {str(e)}")
+            return {}
+    
+    def list_receipt_ids_by_capture_time(self) -> List[str]:
+        """索引の receipt_id を撮影日時順に取得（撮影日時がない画像は更新日時で並べる）
+        
+        撮影日時はタイムゾーン付き（OffsetTimeOriginal あり）となしが混在するため、
+        タイムゾーンなしはこのマシンの現地時刻とみなして比較する。
+        """
+        index = self.load_metadata_index()
+        
+        def capture_time(receipt_id: str) -> datetime:
+            entry = index[receipt_id]
+            if entry["captured_at"]:
+                try:
+                    return datetime.fromisoformat(entry["captured_at"]).astimezone()
+                except ValueError:
+                    pass
+            return datetime.fromtimestamp(entry["mtime_ns"] / 1e9).astimezone()
+        
+        return sorted(index, key=lambda receipt_id: (capture_time(receipt_id), receipt_id))
+    
+    def _read_image_metadata(self, receipt_id: str, path: Path) -> Optional[Dict[str, Any]]:
+        """1枚分のメタデータ（Pillow の遅延読み込みでヘッダーとEXIFのみ解析し、画素は展開しない）"""
+        try:
+            stat = path.stat()
+            digest = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                    digest.update(chunk)
+                f.seek(0)
+                with Image.open(f) as image:
+                    width, height = image.size
+                    image_format = image.format
+                    exif = image.getexif()
+                    exif_ifd = exif.get_ifd(EXIF_IFD)
+                    captured_at = _exif_datetime(exif_ifd.get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME),
+                                                 exif_ifd.get(EXIF_OFFSET_TIME_ORIGINAL))
+                    orientation = exif.get(EXIF_ORIENTATION) or 1
+            
+            return {
+                "path": str(path),
+                "file_size": stat.st_size,
+                "mtime_ns": stat.st_mtime_ns,
+                "sha256": digest.hexdigest(),
+                "format": image_format,
+                "width": width,
+                "height": height,
+                "orientation": int(orientation),
+                "captured_at": captured_at
+            }
+        except Exception as e:
+            self.logger.error(f"画像メタデータの読み込みに失敗しました: {path}: {str(e)}")
+            return None
+    
+    def content_hash(self, receipt_id: str, image_bytes: Optional[bytes] = None) -> Optional[str]:
+        """画像内容の SHA-256（画像ファイルがなければ None）"""
+        if image_bytes is not None:
+            return hashlib.sha256(image_bytes).hexdigest()
+        
+        image_path = find_image_path(self.file_pattern, receipt_id)
+        if not image_path.exists():
+            return None
+        digest = hashlib.sha256()
+        with open(image_path, 'rb') as f:
+            for chunk in iter(lambda: f.read(65536), b""):
+                digest.update(chunk)
+        return digest.hexdigest()
+    
+    def extract_text(self, receipt_id: str, image_bytes: Optional[bytes] = None) -> Dict[str, Any]:
+        """画像からテキストを抽出（OCR、image_bytes を渡した場合はファイルを読まない）"""
         try:
             if not self.vision_client:
                 # ダミーテキストを返す（テスト用）
                 self.logger.warning("Google Cloud Vision APIが利用できないため、ダミーテキストを使用します")
-                return self._get_dummy_text()
+                return self._get_dummy_text("unavailable")
             
-            # 画像を読み込み
-            image_data = self.load_image(receipt_id)
-            
-            if image_data.get("is_dummy", False):
-                return self._get_dummy_text()
-            
-            # Google Cloud Vision APIでテキスト抽出
-            image_path = image_data["image_path"]
-            
-            with open(image_path, 'rb') as f:
-                content = f.read()
+            if image_bytes is not None:
+                content = image_bytes
+            else:
+                # 画像を読み込み
+                image_data = self.load_image(receipt_id)
+                
+                if image_data.get("is_dummy", False):
+                    return self._get_dummy_text("missing_image")
+                
+                image_path = image_data["image_path"]
+                
+                with open(image_path, 'rb') as f:
+                    content = f.read()
             
-            image = types.Image(content=content)
+            # Google Cloud Vision APIでテキスト抽出（ライブラリがない場合は代替クライアントのため型を作らない）
+            image = types.Image(content=content) if types else {"content": content}
             
             # テキスト検出
-            response = self.vision_client.text_detection(image=image)
+            response = guarded_call(
+                self.vision_breaker,
+                lambda timeout: self.vision_client.text_detection(image=image, timeout=timeout),
+                self.vision_timeout,
+                rate_limit=self.vision_rate_limit
+            )
             texts = response.text_annotations
             
             if texts:
                 extracted_text = texts[0].description
-                self.logger.info(f"テキスト抽出成功: {len(extracted_text)}文字")
+                self.logger.info("テキスト抽出成功: %d文字", len(extracted_text))
                 
                 return {
                     "extracted_text": extracted_text,
@@ -115,15 +302,19 @@ class ImageProcessor:
                 }
             else:
                 self.logger.warning("テキストが検出されませんでした")
-                return self._get_dummy_text()
+                return self._get_dummy_text("no_text")
                 
+        except (CircuitOpenError, DeadlineExceeded, RateLimitExceeded) as e:
+            self.logger.warning("Vision APIを呼び出さずにダミーテキストを使用します: %s", e)
+            return self._get_dummy_text(skip_reason(e))
         except Exception as e:
             self.logger.error(f"テキスト抽出に失敗しました: {str(e)}")
             # エラー時はダミーテキストを返す
-            return self._get_dummy_text()
+            return self._get_dummy_text("error")
     
-    def _get_dummy_text(self) -> Dict[str, Any]:
-        """ダミーテキストを返す（テスト用）"""
+    def _get_dummy_text(self, reason: str) -> Dict[str, Any]:
+        """ダミーテキストを返す（テスト用、reason はメトリクスに記録するフォールバック理由）"""
+        FALLBACKS.inc(service="vision", reason=reason)
         # 実際のRED ELEPHANTレシートの情報を使用
         red_elephant_text = """RED ELEPHANT
 123 Jalan Bukit Bintang
@@ -146,3 +337,18 @@ Time: 14:30"""
             "is_dummy": True,
             "message": "RED ELEPHANTレシートのダミーテキストを使用しています"
         }
+
+def _exif_datetime(value: Any, offset: Any = None) -> Optional[str]:
+    """EXIF の日時（YYYY:MM:DD HH:MM:SS）を ISO 8601 形式に変換（解析できなければ None）"""
+    if not value:
+        return None
+    try:
+        captured_at = datetime.strptime(str(value).strip("\x00 "), "%Y:%m:%d %H:%M:%S")
+    except ValueError:
+        return None
+    if offset:
+        try:
+            return datetime.fromisoformat(f"{captured_at.isoformat()}{str(offset).strip()}").isoformat()
+        except ValueError:
+            pass
+    return captured_at.isoformat()
@@ -0,0 +1,399 @@
+"""
+処理ジョブキューモジュール（SQLite）
+"""
+
+import os
+import time
+import uuid
+import random
+import socket
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, Callable, Iterator, List, Optional
+
+class JobQueue:
+    """SQLite（WALモード）による永続的なレシート処理ジョブキュークラス
+    
+    ジョブは priority の高い順、同じ優先度では登録順に取り出される。
+    状態は queued → running → completed と遷移し、失敗時は retrying（バックオフ待ち）を
+    経て max_attempts 回まで再実行され、それでも失敗すると failed になる。
+    実行中のジョブにはリース期限があり、ワーカーは処理中に期限を延長し続ける。
+    延長されずに期限切れになったジョブ（ワーカーの異常終了）は別のワーカーが再取得し、
+    再試行回数の上限に達していれば failed にする。
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS jobs (
+            job_id TEXT PRIMARY KEY,
+            receipt_id TEXT NOT NULL,
+            priority INTEGER NOT NULL DEFAULT 0,
+            status TEXT NOT NULL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            max_attempts INTEGER NOT NULL,
+            run_after REAL NOT NULL,
+            lease_expires REAL,
+            worker TEXT,
+            error TEXT,
+            created_at TEXT NOT NULL,
+            started_at TEXT,
+            finished_at TEXT
+        );
+        CREATE INDEX IF NOT EXISTS idx_jobs_ready ON jobs (status, priority DESC, run_after, created_at);
+        CREATE INDEX IF NOT EXISTS idx_jobs_receipt ON jobs (receipt_id, status);
+    """
+    
+    # 取り出し対象の状態と、まだ終わっていない状態
+    READY_STATUSES = ("queued", "retrying")
+    ACTIVE_STATUSES = ("queued", "retrying", "running")
+    
+    JOB_COLUMNS = ("job_id", "receipt_id", "priority", "status", "attempts", "max_attempts",
+                   "worker", "error", "created_at", "started_at", "finished_at")
+    
+    # list_jobs で一度に取得する件数の上限
+    MAX_LIST_LIMIT = 200
+    
+    def __init__(self, config: Dict[str, Any]):
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+        
+        jobs_config = config.get("jobs", {})
+        self.db_path = Path(jobs_config.get("db_path", "results/jobs.db"))
+        self.priorities = dict(jobs_config.get("priorities", {"interactive": 10, "backfill": 0}))
+        self.max_attempts = jobs_config.get("max_attempts", 3)
+        self.backoff_seconds = jobs_config.get("backoff_seconds", 5)
+        self.max_backoff_seconds = jobs_config.get("max_backoff_seconds", 300)
+        self.lease_seconds = jobs_config.get("lease_seconds", 600)
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """スレッドごとの接続を取得"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """書き込みトランザクション（プロセス間でも排他される）"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+    
+    def enqueue(self, receipt_id: str, priority: str = "interactive") -> str:
+        """レシートの処理ジョブを登録し、ジョブIDを返す（未完了のジョブがあればそのIDを返す）"""
+        if priority not in self.priorities:
+            raise ValueError(f"未定義の優先度です: {priority}")
+        
+        with self.transaction() as conn:
+            placeholders = ",".join("?" * len(self.ACTIVE_STATUSES))
+            row = conn.execute(
+                f"SELECT job_id, priority FROM jobs WHERE receipt_id = ? AND status IN ({placeholders})",
+                (receipt_id, *self.ACTIVE_STATUSES)
+            ).fetchone()
+            if row is not None:
+                # 待機中のバックフィルをアップロードが追い越せるよう、優先度は高い方に揃える
+                if self.priorities[priority] > row[1]:
+                    conn.execute("UPDATE jobs SET priority = ? WHERE job_id = ?", (self.priorities[priority], row[0]))
+                return row[0]
+            
+            job_id = uuid.uuid4().hex
+            conn.execute(
+                "INSERT INTO jobs (job_id, receipt_id, priority, status, max_attempts, run_after, created_at) "
+                "VALUES (?, ?, ?, 'queued', ?, ?, ?)",
+                (job_id, receipt_id, self.priorities[priority], self.max_attempts, time.time(), datetime.now().isoformat())
+            )
+        
+        self.logger.info(f"処理ジョブを登録しました: {job_id} ({receipt_id}, {priority})")
+        return job_id
+    
+    def claim(self, worker: str) -> Optional[Dict[str, Any]]:
+        """実行可能なジョブを1件取り出して running にする（無ければNone）"""
+        now = time.time()
+        with self.transaction() as conn:
+            # リース切れのジョブのうち再試行回数の上限に達したものは再取得せずに失敗とする
+            expired = conn.execute(
+                "UPDATE jobs SET status = 'failed', lease_expires = NULL, error = ?, finished_at = ? "
+                "WHERE status = 'running' AND lease_expires < ? AND attempts >= max_attempts",
+                ("リース期限切れ（再試行回数の上限）", datetime.now().isoformat(), now)
+            ).rowcount
+            if expired:
+                self.logger.error(f"リース期限切れのジョブを失敗にしました: {expired}件")
+            
+            placeholders = ",".join("?" * len(self.READY_STATUSES))
+            row = conn.execute(
+                f"SELECT job_id FROM jobs WHERE status IN ({placeholders}) AND run_after <= ? "
+                "ORDER BY priority DESC, run_after, created_at LIMIT 1",
+                (*self.READY_STATUSES, now)
+            ).fetchone()
+            if row is None:
+                # リース切れ（ワーカーが異常終了した）のジョブを再取得
+                row = conn.execute(
+                    "SELECT job_id FROM jobs WHERE status = 'running' AND lease_expires < ? "
+                    "ORDER BY priority DESC, created_at LIMIT 1",
+                    (now,)
+                ).fetchone()
+            if row is None:
+                return None
+            
+            conn.execute(
+                "UPDATE jobs SET status = 'running', attempts = attempts + 1, worker = ?, "
+                "lease_expires = ?, started_at = ? WHERE job_id = ?",
+                (worker, now + self.lease_seconds, datetime.now().isoformat(), row[0])
+            )
+            return self._fetch_job(conn, row[0])
+    
+    def renew_lease(self, job_id: str, worker: str) -> bool:
+        """実行中のジョブのリース期限を延長（別のワーカーに再取得されていれば False）"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND status = 'running' AND worker = ?",
+                (time.time() + self.lease_seconds, job_id, worker)
+            )
+            return cursor.rowcount == 1
+    
+    def complete(self, job_id: str, worker: str) -> bool:
+        """ジョブを完了にする（リースが切れて別のワーカーに再取得されていれば何もせず False）"""
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "UPDATE jobs SET status = 'completed', lease_expires = NULL, error = NULL, finished_at = ? "
+                "WHERE job_id = ? AND status = 'running' AND worker = ?",
+                (datetime.now().isoformat(), job_id, worker)
+            )
+            if cursor.rowcount != 1:
+                self.logger.warning(f"完了を記録できませんでした（別のワーカーが再取得）: {job_id}")
+                return False
+            return True
+    
+    def fail(self, job_id: str, worker: str, error: str) -> Optional[str]:
+        """ジョブの失敗を記録し、再試行か失敗確定かの状態を返す（別のワーカーに再取得されていれば None）"""
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT attempts, max_attempts FROM jobs WHERE job_id = ? AND status = 'running' AND worker = ?",
+                (job_id, worker)
+            ).fetchone()
+            if row is None:
+                self.logger.warning(f"失敗を記録できませんでした（別のワーカーが再取得）: {job_id} ({error})")
+                return None
+            
+            attempts, max_attempts = row
+            if attempts < max_attempts:
+                # 指数バックオフ（ジッター付き）で再試行を待つ
+                delay = min(self.backoff_seconds * 2 ** (attempts - 1), self.max_backoff_seconds)
+                delay *= random.uniform(0.8, 1.2)
+                conn.execute(
+                    "UPDATE jobs SET status = 'retrying', run_after = ?, lease_expires = NULL, error = ? "
+                    "WHERE job_id = ?",
+                    (time.time() + delay, error, job_id)
+                )
+                self.logger.warning(f"処理ジョブを{delay:.1f}秒後に再試行します: {job_id} ({attempts}/{max_attempts}回目)")
+                return "retrying"
+            
+            conn.execute(
+                "UPDATE jobs SET status = 'failed', lease_expires = NULL, error = ?, finished_at = ? "
+                "WHERE job_id = ?",
+                (error, datetime.now().isoformat(), job_id)
+            )
+            self.logger.error(f"処理ジョブが失敗しました: {job_id} ({error})")
+            return "failed"
+    
+    def recover_orphaned(self) -> int:
+        """このホストで終了済みのプロセスが実行中のままにしたジョブを再登録（再試行回数の上限なら失敗）"""
+        hostname = socket.gethostname()
+        recovered = 0
+        with self.transaction() as conn:
+            rows = conn.execute(
+                "SELECT job_id, worker, attempts, max_attempts FROM jobs WHERE status = 'running'"
+            ).fetchall()
+            for job_id, worker, attempts, max_attempts in rows:
+                host, _, pid = (worker or "").partition(":")
+                if host != hostname or _process_alive(int(pid.split(":")[0] or 0)):
+                    continue
+                if attempts >= max_attempts:
+                    conn.execute(
+                        "UPDATE jobs SET status = 'failed', lease_expires = NULL, error = ?, finished_at = ? "
+                        "WHERE job_id = ?",
+                        ("処理中にプロセスが終了しました（再試行回数の上限）", datetime.now().isoformat(), job_id)
+                    )
+                    continue
+                conn.execute(
+                    "UPDATE jobs SET status = 'queued', run_after = ?, lease_expires = NULL WHERE job_id = ?",
+                    (time.time(), job_id)
+                )
+                recovered += 1
+        
+        if recovered:
+            self.logger.info(f"中断されていた処理ジョブを再登録しました: {recovered}件")
+        return recovered
+    
+    def get_job(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """ジョブの状態を取得"""
+        return self._fetch_job(self._connect(), job_id)
+    
+    def list_jobs(self, status: Optional[str] = None, limit: int = 50) -> List[Dict[str, Any]]:
+        """ジョブを登録の新しい順に取得（件数は MAX_LIST_LIMIT まで）"""
+        limit = min(max(limit, 1), self.MAX_LIST_LIMIT)
+        where = "WHERE status = ?" if status else ""
+        params = [status] if status else []
+        rows = self._connect().execute(
+            f"SELECT {', '.join(self.JOB_COLUMNS)} FROM jobs {where} ORDER BY created_at DESC LIMIT ?",
+            [*params, limit]
+        ).fetchall()
+        return [dict(zip(self.JOB_COLUMNS, row)) for row in rows]
+    
+    def count_by_status(self) -> Dict[str, int]:
+        """状態ごとのジョブ件数を取得"""
+        return dict(self._connect().execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall())
+    
+    def pending_count(self) -> int:
+        """未完了（待機中・再試行待ち・実行中）のジョブ件数"""
+        placeholders = ",".join("?" * len(self.ACTIVE_STATUSES))
+        return self._connect().execute(
+            f"SELECT COUNT(*) FROM jobs WHERE status IN ({placeholders})", self.ACTIVE_STATUSES
+        ).fetchone()[0]
+    
+    def _fetch_job(self, conn: sqlite3.Connection, job_id: str) -> Optional[Dict[str, Any]]:
+        row = conn.execute(
+            f"SELECT {', '.join(self.JOB_COLUMNS)} FROM jobs WHERE job_id = ?", (job_id,)
+        ).fetchone()
+        return dict(zip(self.JOB_COLUMNS, row)) if row else None
+    
+    def close(self):
+        """現在のスレッドの接続を閉じる"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+def _process_alive(pid: int) -> bool:
+    """同じホスト上のプロセスが生存しているかどうか"""
+    if pid <= 0:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+class WorkerPool:
+    """ジョブキューからジョブを取り出して処理するワーカースレッドのプール
+    
+    ワーカー数だけ並行にレシートを処理する（処理の大半は外部APIの待ち時間のため
+    スレッドで十分にスループットが伸びる）。処理関数が例外を送出したジョブは
+    ジョブキューの再試行ポリシーに従って再実行される。処理中のジョブのリースは
+    ハートビートスレッドがリース期間の1/3ごとに延長する。
+    """
+    
+    def __init__(self, job_queue: JobQueue, processor: Callable[[str], Any],
+                 workers: int = 1, poll_interval: float = 1.0):
+        self.job_queue = job_queue
+        self.processor = processor
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self.logger = logging.getLogger(__name__)
+        self._stop = threading.Event()
+        self._threads: List[threading.Thread] = []
+        
+        # 処理中のジョブ（job_id → ワーカー名）と、そのリースを延長するハートビート
+        self._running: Dict[str, str] = {}
+        self._running_lock = threading.Lock()
+        self._heartbeat_stop = threading.Event()
+        self._heartbeat: Optional[threading.Thread] = None
+    
+    def start(self):
+        """ワーカースレッドを起動（stop() の後に再び起動できる）"""
+        self.job_queue.recover_orphaned()
+        self._stop.clear()
+        self._heartbeat_stop.clear()
+        self._heartbeat = threading.Thread(target=self._renew_leases, name="receipt-worker-heartbeat", daemon=True)
+        self._heartbeat.start()
+        for i in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f"receipt-worker-{i}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        self.logger.info(f"ワーカーを起動しました: {self.workers}スレッド")
+    
+    def stop(self):
+        """実行中のジョブを処理し終えてからワーカーを停止"""
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        self._threads = []
+        
+        # 実行中のジョブが終わるまではリースを延長し続ける
+        self._heartbeat_stop.set()
+        if self._heartbeat:
+            self._heartbeat.join()
+            self._heartbeat = None
+    
+    def wait_until_idle(self):
+        """未完了のジョブが無くなるまで待機（バッチ処理用）"""
+        while self.job_queue.pending_count() > 0 and not self._stop.is_set():
+            time.sleep(self.poll_interval)
+    
+    def _run(self):
+        """ワーカースレッド本体"""
+        worker = f"{socket.gethostname()}:{os.getpid()}:{threading.current_thread().name}"
+        while not self._stop.is_set():
+            try:
+                job = self.job_queue.claim(worker)
+            except Exception as e:
+                self.logger.error(f"ジョブの取得に失敗しました: {str(e)}")
+                job = None
+            
+            if job is None:
+                self._stop.wait(self.poll_interval)
+                continue
+            
+            with self._running_lock:
+                self._running[job["job_id"]] = worker
+            try:
+                self.processor(job["receipt_id"])
+            except Exception as e:
+                self._record(self.job_queue.fail, job["job_id"], worker, str(e))
+            else:
+                self._record(self.job_queue.complete, job["job_id"], worker)
+            finally:
+                with self._running_lock:
+                    self._running.pop(job["job_id"], None)
+        
+        self.job_queue.close()
+    
+    def _record(self, method: Callable[..., Any], job_id: str, *args: Any):
+        """ジョブの結果を記録（記録できなくてもワーカーは止めず、リース切れ後に再取得される）"""
+        try:
+            method(job_id, *args)
+        except Exception as e:
+            self.logger.error(f"ジョブの結果の記録に失敗しました: {job_id}: {str(e)}")
+    
+    def _renew_leases(self):
+        """ハートビートスレッド本体（処理中のジョブのリースを定期的に延長）"""
+        interval = max(self.job_queue.lease_seconds / 3, 0.01)
+        while not self._heartbeat_stop.wait(interval):
+            with self._running_lock:
+                running = list(self._running.items())
+            for job_id, worker in running:
+                try:
+                    if not self.job_queue.renew_lease(job_id, worker):
+                        self.logger.warning(f"ジョブのリースが失われました（別のワーカーが再取得）: {job_id}")
+                except Exception as e:
+                    self.logger.error(f"ジョブのリース延長に失敗しました: {job_id}: {str(e)}")
+        
+        self.job_queue.close()
@@ -0,0 +1,191 @@
+"""
+メトリクスモジュール（Prometheus テキスト形式で公開するカウンター・ヒストグラム）
+"""
+
+import math
+import threading
+from typing import Dict, Any, List, Sequence, Tuple
+
+# Prometheus テキスト形式の Content-Type
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(labels: Sequence[Tuple[str, str]]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(str(value))}"' for name, value in labels) + "}"
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+class _Metric:
+    """ラベルごとの値を保持するメトリクスの基底クラス"""
+    
+    TYPE = "untyped"
+    
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], Any] = {}
+    
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"ラベルが一致しません: {self.name} {sorted(labels)} != {sorted(self.labelnames)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+    
+    def render(self) -> List[str]:
+        """HELP・TYPE 行とサンプル行"""
+        lines = [f"# HELP {self.name} {_escape(self.documentation)}", f"# TYPE {self.name} {self.TYPE}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._samples(list(zip(self.labelnames, key)), value))
+        return lines
+    
+    def _samples(self, labels: List[Tuple[str, str]], value: Any) -> List[str]:
+        return [f"{self.name}{_format_labels(labels)} {_format_value(value)}"]
+
+class Counter(_Metric):
+    """増加のみのカウンター"""
+    
+    TYPE = "counter"
+    
+    def inc(self, amount: float = 1, **labels: Any):
+        """カウンターを加算"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+class Gauge(_Metric):
+    """現在値を表すゲージ（公開時に値を設定する用途）"""
+    
+    TYPE = "gauge"
+    
+    def set(self, value: float, **labels: Any):
+        """値を設定"""
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+class Histogram(_Metric):
+    """累積バケット・合計・件数を持つヒストグラム"""
+    
+    TYPE = "histogram"
+    
+    def __init__(self, name: str, documentation: str, buckets: Sequence[float], labelnames: Sequence[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(float(bucket) for bucket in buckets)
+    
+    def observe(self, value: float, **labels: Any):
+        """値を1件記録"""
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+                self._values[key] = state
+            for i, upper in enumerate(self.buckets):
+                if value <= upper:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+    
+    def _samples(self, labels: List[Tuple[str, str]], state: Dict[str, Any]) -> List[str]:
+        lines = []
+        cumulative = 0
+        for upper, count in zip(self.buckets, state["counts"]):
+            cumulative += count
+            lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', _format_value(upper))])} {cumulative}")
+        lines.append(f"{self.name}_bucket{_format_labels(labels + [('le', '+Inf')])} {state['count']}")
+        lines.append(f"{self.name}_sum{_format_labels(labels)} {_format_value(state['sum'])}")
+        lines.append(f"{self.name}_count{_format_labels(labels)} {state['count']}")
+        return lines
+
+class MetricsRegistry:
+    """メトリクスの登録と Prometheus テキスト形式での出力
+    
+    同じ名前で登録した場合は既存のメトリクスを返すため、プロセッサーを作り直しても値は引き継がれる。
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._metrics: Dict[str, _Metric] = {}
+    
+    def _register(self, metric_class, name: str, *args: Any, **kwargs: Any):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = metric_class(name, *args, **kwargs)
+                self._metrics[name] = metric
+            elif not isinstance(metric, metric_class):
+                raise ValueError(f"メトリクスの種類が一致しません: {name}")
+            return metric
+    
+    def counter(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Counter:
+        """カウンターを取得（未登録なら作成）"""
+        return self._register(Counter, name, documentation, labelnames)
+    
+    def gauge(self, name: str, documentation: str, labelnames: Sequence[str] = ()) -> Gauge:
+        """ゲージを取得（未登録なら作成）"""
+        return self._register(Gauge, name, documentation, labelnames)
+    
+    def histogram(self, name: str, documentation: str, buckets: Sequence[float],
+                  labelnames: Sequence[str] = ()) -> Histogram:
+        """ヒストグラムを取得（未登録なら作成）"""
+        return self._register(Histogram, name, documentation, buckets, labelnames)
+    
+    def render(self) -> str:
+        """Prometheus テキスト形式で出力"""
+        with self._lock:
+            metrics = [self._metrics[name] for name in sorted(self._metrics)]
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+# プロセス全体で共有するレジストリ
+REGISTRY = MetricsRegistry()
+
+# レシート処理パイプラインのメトリクス
+API_CALLS = REGISTRY.counter(
+    "receipt_api_calls_total", "外部API呼び出しの件数（outcome: success / failure / short_circuited / deadline_exceeded / rate_limited）",
+    ["service", "outcome"]
+)
+FALLBACKS = REGISTRY.counter(
+    "receipt_fallbacks_total", "外部APIの代わりにダミー・フォールバックデータを使用した件数",
+    ["service", "reason"]
+)
+CACHE_REQUESTS = REGISTRY.counter(
+    "receipt_cache_requests_total", "キャッシュの参照件数（result: hit / miss / stale）",
+    ["cache", "result"]
+)
+STEP_DURATION = REGISTRY.histogram(
+    "receipt_step_duration_seconds", "処理ステップの所要時間（秒）",
+    [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30],
+    ["step"]
+)
+IMAGE_BYTES = REGISTRY.histogram(
+    "receipt_image_bytes", "読み込んだレシート画像のサイズ（バイト）",
+    [65536, 262144, 524288, 1048576, 2097152, 4194304, 8388608, 16777216]
+)
+RESULTS_SAVED = REGISTRY.counter(
+    "receipt_results_saved_total", "保存した処理結果の件数（status: completed / error）",
+    ["status"]
+)
+JOBS = REGISTRY.gauge(
+    "receipt_jobs", "ジョブキューの状態ごとのジョブ数（/metrics の取得時点）",
+    ["status"]
+)
+CIRCUIT_BREAKER_OPEN = REGISTRY.gauge(
+    "receipt_circuit_breaker_open", "サーキットブレーカーが閉じていない場合は1（/metrics の取得時点）",
+    ["service"]
+)
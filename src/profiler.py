@@ -0,0 +1,274 @@
+"""
+処理ステップのプロファイリングモジュール（cProfile・tracemalloc・スタックサンプリング）
+"""
+
+import io
+import sys
+import time
+import random
+import pstats
+import cProfile
+import logging
+import threading
+import tracemalloc
+from pathlib import Path
+from datetime import datetime
+from collections import Counter
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, List, Optional
+
+class StackSampler:
+    """登録されたスレッドのコールスタックを一定間隔で採取するサンプラー
+    
+    採取したスタックは「ラベル;関数;関数 件数」の collapsed 形式で集計するため、
+    flamegraph.pl や speedscope でそのまま読み込める。
+    """
+    
+    def __init__(self, interval: float):
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._targets: Dict[int, tuple] = {}
+        self._counts: Dict[str, Counter] = {}
+        self._total = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+    
+    def start(self):
+        """サンプリングスレッドを開始"""
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name="stack-sampler", daemon=True)
+        self._thread.start()
+    
+    def stop(self):
+        """サンプリングスレッドを停止"""
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+            self._thread = None
+    
+    def register(self, thread_id: int, key: str, label: str):
+        """スレッドをサンプリング対象にする（key ごとに集計、label はスタックの根）"""
+        with self._lock:
+            self._targets[thread_id] = (key, label)
+    
+    def unregister(self, thread_id: int):
+        """スレッドをサンプリング対象から外す"""
+        with self._lock:
+            self._targets.pop(thread_id, None)
+    
+    def pop_counts(self, key: str) -> Counter:
+        """key の集計を取り出す"""
+        with self._lock:
+            return self._counts.pop(key, Counter())
+    
+    def total_counts(self) -> Counter:
+        """全体の集計"""
+        with self._lock:
+            return Counter(self._total)
+    
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            with self._lock:
+                for thread_id, (key, label) in self._targets.items():
+                    frame = frames.get(thread_id)
+                    if frame is None:
+                        continue
+                    stack = self._collapse(frame, label)
+                    self._counts.setdefault(key, Counter())[stack] += 1
+                    self._total[stack] += 1
+    
+    @staticmethod
+    def _collapse(frame, label: str) -> str:
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{Path(code.co_filename).name}:{code.co_name}")
+            frame = frame.f_back
+        names.append(label)
+        return ";".join(reversed(names))
+
+class ReceiptProfile:
+    """レシート1件分のプロファイル（ステップごとのレポートと結果に記録する要約）"""
+    
+    def __init__(self, profiler: "StepProfiler", receipt_id: str, run_id: str):
+        self.profiler = profiler
+        self.receipt_id = receipt_id
+        self.report_dir = profiler.output_dir / receipt_id / run_id
+        self.steps: Dict[str, Dict[str, Any]] = {}
+        self.report_dir.mkdir(parents=True, exist_ok=True)
+    
+    @contextmanager
+    def step(self, step_name: str) -> Iterator[None]:
+        """ステップの実行を計測し、レポートを書き出す"""
+        profiler = self.profiler
+        thread_id = threading.get_ident()
+        
+        # cProfile は同時に1つしか有効にできないため、他のスレッドが計測中なら時間のみ記録する。
+        # tracemalloc の割り当て量・ピークもプロセス全体の値のため、ロックを持つスレッドだけが計測する
+        measured = profiler._cprofile_lock.acquire(blocking=False)
+        profile = cProfile.Profile() if measured else None
+        snapshot = tracemalloc.take_snapshot() if measured and profiler.memory_top else None
+        if measured:
+            tracemalloc.reset_peak()
+            memory_before = tracemalloc.get_traced_memory()[0]
+        profiler.sampler.register(thread_id, str(self.report_dir), step_name)
+        wall_started = time.perf_counter()
+        cpu_started = time.thread_time()
+        
+        try:
+            if profile:
+                profile.enable()
+            yield
+        finally:
+            if profile:
+                profile.disable()
+            wall = time.perf_counter() - wall_started
+            cpu = time.thread_time() - cpu_started
+            profiler.sampler.unregister(thread_id)
+            memory_delta_kb = memory_peak_kb = after = None
+            if measured:
+                memory_after, memory_peak = tracemalloc.get_traced_memory()
+                after = tracemalloc.take_snapshot() if snapshot else None
+                profiler._cprofile_lock.release()
+                memory_delta_kb = round((memory_after - memory_before) / 1024, 1)
+                memory_peak_kb = round(max(memory_peak - memory_before, 0) / 1024, 1)
+            
+            self.steps[step_name] = {
+                "wall_seconds": round(wall, 4),
+                "cpu_seconds": round(cpu, 4),
+                "memory_delta_kb": memory_delta_kb,
+                "memory_peak_kb": memory_peak_kb,
+                "cprofile": profile is not None,
+                "top_functions": []
+            }
+            try:
+                self._write_step_report(step_name, profile, snapshot, after)
+            except Exception as e:
+                profiler.logger.error(f"プロファイルレポートの書き出しエラー: {step_name}: {str(e)}")
+    
+    def _write_step_report(self, step_name: str, profile: Optional[cProfile.Profile],
+                           before: Optional[tracemalloc.Snapshot], after: Optional[tracemalloc.Snapshot]):
+        """ステップのレポート（<step>.prof と <step>.txt）を書き出す"""
+        summary = self.steps[step_name]
+        lines = [
+            f"receipt: {self.receipt_id}",
+            f"step: {step_name}",
+            f"wall: {summary['wall_seconds']}s  cpu: {summary['cpu_seconds']}s",
+            f"memory: delta {summary['memory_delta_kb']}KB  peak {summary['memory_peak_kb']}KB"
+            if profile else "memory: -",
+            ""
+        ]
+        
+        if profile:
+            stream = io.StringIO()
+            stats = pstats.Stats(profile, stream=stream)
+            stats.dump_stats(str(self.report_dir / f"{step_name}.prof"))
+            stats.sort_stats("cumulative").print_stats(self.profiler.top_functions)
+            lines.append(stream.getvalue())
+            summary["top_functions"] = self._top_functions(stats)
+        else:
+            lines.append("（他のスレッドが計測中のため関数別・メモリの計測は省略）")
+        
+        if before and after:
+            filters = self.profiler.memory_filters
+            lines.append(f"メモリ割り当て上位 {self.profiler.memory_top} 件:")
+            for stat in after.filter_traces(filters).compare_to(before.filter_traces(filters),
+                                                                "lineno")[:self.profiler.memory_top]:
+                lines.append(f"  {stat}")
+        
+        with open(self.report_dir / f"{step_name}.txt", 'w', encoding='utf-8') as f:
+            f.write("\n".join(lines) + "\n")
+    
+    def _top_functions(self, stats: pstats.Stats) -> List[Dict[str, Any]]:
+        """自己時間の長い関数（結果に記録する分のみ）"""
+        entries = sorted(stats.stats.items(), key=lambda item: item[1][2], reverse=True)
+        top = []
+        for (filename, line, name), (_, calls, self_time, cumulative, _) in entries[:self.profiler.summary_functions]:
+            top.append({
+                "function": f"{Path(filename).name}:{line}({name})",
+                "calls": calls,
+                "self_seconds": round(self_time, 4),
+                "cumulative_seconds": round(cumulative, 4)
+            })
+        return top
+    
+    def finish(self) -> Dict[str, Any]:
+        """スタックを collapsed 形式で書き出し、結果に記録する要約を返す"""
+        counts = self.profiler.sampler.pop_counts(str(self.report_dir))
+        try:
+            _write_collapsed(self.report_dir / "stacks.collapsed", counts)
+        except Exception as e:
+            self.profiler.logger.error(f"スタックの書き出しエラー: {str(e)}")
+        
+        return {
+            "report_dir": str(self.report_dir),
+            "samples": sum(counts.values()),
+            "steps": self.steps
+        }
+
+class StepProfiler:
+    """処理ステップごとに CPU 時間・メモリ割り当て・コールスタックを計測するプロファイラー
+    
+    start() から stop() までの間、begin() で作成した ReceiptProfile の step() で
+    囲んだ処理を計測する。sample_rate でプロファイルするレシートの割合を指定できる。
+    """
+    
+    def __init__(self, config: Dict[str, Any]):
+        self.logger = logging.getLogger(__name__)
+        profiling_config = config.get("profiling", {})
+        
+        self.output_dir = Path(profiling_config.get("output_dir", "results/profiles/"))
+        self.sample_rate = profiling_config.get("sample_rate", 1.0)
+        self.top_functions = profiling_config.get("top_functions", 30)
+        self.summary_functions = profiling_config.get("summary_functions", 5)
+        self.memory_top = profiling_config.get("memory_top", 10)
+        # プロファイラー自身の割り当ては除外する
+        self.memory_filters = [
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, cProfile.__file__),
+            tracemalloc.Filter(False, pstats.__file__),
+            tracemalloc.Filter(False, __file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>")
+        ]
+        self.sampler = StackSampler(profiling_config.get("sample_interval_ms", 5) / 1000.0)
+        
+        self._cprofile_lock = threading.Lock()
+        self._random = random.Random()
+        self._started_tracemalloc = False
+    
+    def start(self):
+        """プロファイリングを開始"""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        if not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._started_tracemalloc = True
+        self.sampler.start()
+        self.logger.info(f"プロファイリングを開始しました（レポート: {self.output_dir}）")
+    
+    def stop(self):
+        """プロファイリングを終了し、全体のスタックを書き出す"""
+        self.sampler.stop()
+        if self._started_tracemalloc:
+            tracemalloc.stop()
+            self._started_tracemalloc = False
+        
+        path = self.output_dir / "stacks.collapsed"
+        try:
+            _write_collapsed(path, self.sampler.total_counts())
+            self.logger.info(f"プロファイリングを終了しました（全体のスタック: {path}）")
+        except Exception as e:
+            self.logger.error(f"スタックの書き出しエラー: {str(e)}")
+    
+    def begin(self, receipt_id: str) -> Optional[ReceiptProfile]:
+        """レシートのプロファイルを開始（sample_rate により対象外なら None）"""
+        if self.sample_rate < 1.0 and self._random.random() >= self.sample_rate:
+            return None
+        return ReceiptProfile(self, receipt_id, datetime.now().strftime("%Y%m%d_%H%M%S_%f"))
+
+def _write_collapsed(path: Path, counts: Counter):
+    """collapsed 形式（スタック 件数）で書き出す"""
+    with open(path, 'w', encoding='utf-8') as f:
+        for stack, count in sorted(counts.items()):
+            f.write(f"{stack} {count}\n")
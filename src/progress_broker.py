@@ -0,0 +1,164 @@
+"""
+処理進捗イベント配信モジュール
+"""
+
+import time
+import atexit
+import logging
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, Any, List, Tuple
+
+from src.result_store import ResultStore
+
+class ProgressBroker:
+    """処理パイプラインの進捗イベント（フェーズ・ステップの開始/完了）を配信するクラス
+    
+    イベントは進捗ストア（結果ストアとは別のDBファイル）に記録するため、別プロセス
+    （main.py --worker）で実行中の処理の進捗も Webサーバーから購読できる。記録は書き込みスレッドが
+    まとめて1トランザクションで行い、処理スレッドは SQLite の書き込みロックを待たない。
+    このプロセスで発行したイベントは記録後にメモリにも保持し、購読側には条件変数で通知して
+    メモリから返す（ストアは読まない）。別プロセスが処理中のレシートのみ poll_interval ごとに
+    ストアを確認する。終了した処理のイベントは retention_seconds を過ぎたら削除する。
+    """
+    
+    # 処理の終了を表すイベント（購読側はこれを受け取ったらストリームを閉じる）
+    TERMINAL_EVENTS = ("run_completed",)
+    
+    def __init__(self, store: ResultStore, poll_interval: float = 0.5, retention_seconds: float = 3600):
+        self.store = store
+        self.poll_interval = poll_interval
+        self.retention_seconds = retention_seconds
+        self.logger = logging.getLogger(__name__)
+        self._condition = threading.Condition()
+        
+        # このプロセスで発行した処理の記録済みイベント（receipt_id → [(ID, イベント名, データ)]、_condition で保護）
+        self._recent: Dict[str, List[Tuple[int, str, Dict[str, Any]]]] = {}
+        
+        # 記録待ちのイベント（receipt_id, イベント名, データ）と、発行・記録済みの件数
+        self._pending: List[Tuple[str, str, Dict[str, Any]]] = []
+        self._pending_condition = threading.Condition()
+        self._published = 0
+        self._written = 0
+        self._closed = False
+        self._last_pruned = 0.0
+        
+        self._thread = threading.Thread(target=self._run, name="progress-writer", daemon=True)
+        self._thread.start()
+        
+        # 終了時に未記録のイベントをフラッシュ
+        atexit.register(self.close)
+    
+    def publish(self, receipt_id: str, event: str, **data: Any):
+        """進捗イベントを発行（記録は書き込みスレッドで行い、失敗しても処理は止めない）"""
+        data["timestamp"] = datetime.now().isoformat()
+        with self._pending_condition:
+            if not self._closed:
+                self._pending.append((receipt_id, event, data))
+                self._published += 1
+                self._pending_condition.notify_all()
+                return
+        
+        # 停止後はその場で記録する
+        self._write([(receipt_id, event, data)])
+    
+    def flush(self):
+        """発行済みのイベントがすべて記録されるまで待機"""
+        with self._pending_condition:
+            target = self._published
+            while self._written < target and not self._closed:
+                self._pending_condition.wait()
+    
+    def close(self):
+        """未記録のイベントを記録して書き込みスレッドを停止"""
+        with self._pending_condition:
+            if self._closed:
+                return
+            self._closed = True
+            self._pending_condition.notify_all()
+        self._thread.join()
+    
+    def wait_for_events(self, receipt_id: str, last_id: int,
+                        timeout: float) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """last_id より後のイベントを待って取得（timeout 秒以内に無ければ空リスト）
+        
+        このプロセスで発行した処理はメモリから返し、記録の通知を待つ。それ以外（別プロセスの処理）は
+        poll_interval ごとにストアを確認する。
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            with self._condition:
+                recent = self._recent.get(receipt_id)
+                if recent is not None:
+                    events = [event for event in recent if event[0] > last_id]
+                    remaining = deadline - time.monotonic()
+                    if events or remaining <= 0:
+                        return events
+                    self._condition.wait(remaining)
+                    continue
+            
+            events = self.store.progress_events_since(receipt_id, last_id)
+            if events:
+                return events
+            
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return []
+            with self._condition:
+                self._condition.wait(min(self.poll_interval, remaining))
+    
+    def _run(self):
+        """書き込みスレッド本体（溜まったイベントをまとめて記録）"""
+        while True:
+            with self._pending_condition:
+                while not self._pending and not self._closed:
+                    self._pending_condition.wait()
+                batch, self._pending = self._pending, []
+                if not batch and self._closed:
+                    break
+            
+            self._write(batch)
+            with self._pending_condition:
+                self._written += len(batch)
+                self._pending_condition.notify_all()
+            self._prune_if_due()
+        
+        self.store.close()
+    
+    def _write(self, batch: List[Tuple[str, str, Dict[str, Any]]]):
+        """イベントを記録し、購読側に通知"""
+        try:
+            # 新しい処理の開始時に、同じレシートの前回の進捗を破棄する
+            event_ids = self.store.append_progress_events(
+                [(receipt_id, event, data, event == "run_started") for receipt_id, event, data in batch]
+            )
+        except Exception as e:
+            self.logger.error(f"進捗イベントの記録に失敗しました: {str(e)}")
+            return
+        
+        with self._condition:
+            for event_id, (receipt_id, event, data) in zip(event_ids, batch):
+                if event == "run_started" or receipt_id not in self._recent:
+                    self._recent[receipt_id] = []
+                self._recent[receipt_id].append((event_id, event, data))
+            self._condition.notify_all()
+    
+    def _prune_if_due(self):
+        """終了から retention_seconds を過ぎた処理のイベントを削除（確認は1分に1回まで）"""
+        now = time.monotonic()
+        if now - self._last_pruned < min(self.retention_seconds, 60):
+            return
+        self._last_pruned = now
+        
+        cutoff = (datetime.now() - timedelta(seconds=self.retention_seconds)).isoformat()
+        with self._condition:
+            for receipt_id, events in list(self._recent.items()):
+                if any(event in self.TERMINAL_EVENTS and data["timestamp"] < cutoff for _, event, data in events):
+                    del self._recent[receipt_id]
+        try:
+            deleted = self.store.prune_progress_events(self.TERMINAL_EVENTS, cutoff)
+        except Exception as e:
+            self.logger.error(f"進捗イベントの削除に失敗しました: {str(e)}")
+            return
+        if deleted:
+            self.logger.debug("終了した処理の進捗イベントを削除しました: %d件", deleted)
@@ -0,0 +1,205 @@
+"""
+外部APIのレート制限モジュール（SQLiteで共有するトークンバケット）
+"""
+
+import time
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from typing import Dict, Any, Iterator, Mapping, Optional
+
+class RateLimitExceeded(Exception):
+    """許容待ち時間内にトークンを確保できない場合の例外"""
+
+class RateLimiter:
+    """サービスごとのトークンバケットを SQLite に保持するレート制限クラス
+    
+    バケットの状態を BEGIN IMMEDIATE のトランザクションで更新するため、同じDBを使う
+    スレッド・プロセス（Webサーバー内ワーカー、main.py --worker など）の間で
+    1つのクォータを共有できる。トークンが足りない場合は先に予約（残量をマイナスに）
+    してから待機するため、バーストは許可レートに平準化され、待機順も公平になる。
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS rate_buckets (
+            service TEXT PRIMARY KEY,
+            tokens REAL NOT NULL,
+            updated_at REAL NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS rate_limit_stats (
+            service TEXT PRIMARY KEY,
+            acquired INTEGER NOT NULL DEFAULT 0,
+            waited INTEGER NOT NULL DEFAULT 0,
+            rejected INTEGER NOT NULL DEFAULT 0,
+            total_wait_seconds REAL NOT NULL DEFAULT 0,
+            max_wait_seconds REAL NOT NULL DEFAULT 0
+        );
+    """
+    
+    # 待ち時間の統計を読むクエリ
+    STATS_QUERY = ("SELECT service, acquired, waited, rejected, total_wait_seconds, max_wait_seconds "
+                   "FROM rate_limit_stats ORDER BY service")
+    
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """スレッドごとの接続を取得"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """書き込みトランザクション（プロセス間でも排他される）"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+    
+    def acquire(self, service: str, requests_per_minute: float, burst: int,
+                max_wait: Optional[float] = None) -> float:
+        """トークンを1つ確保し、必要なら待機する（待機した秒数を返す）
+        
+        待ち時間が max_wait を超える場合はトークンを確保せず、確保できなかった件数を
+        コミットしてから RateLimitExceeded を送出する。
+        """
+        _validate_rate(service, requests_per_minute, burst)
+        rate = requests_per_minute / 60.0
+        now = time.time()
+        
+        with self.transaction() as conn:
+            row = conn.execute(
+                "SELECT tokens, updated_at FROM rate_buckets WHERE service = ?", (service,)
+            ).fetchone()
+            tokens = burst if row is None else min(burst, row[0] + (now - row[1]) * rate)
+            
+            wait = 0.0 if tokens >= 1 else (1 - tokens) / rate
+            rejected = max_wait is not None and wait > max_wait
+            if rejected:
+                self._record(conn, service, wait=None)
+            else:
+                conn.execute(
+                    "INSERT INTO rate_buckets (service, tokens, updated_at) VALUES (?, ?, ?) "
+                    "ON CONFLICT(service) DO UPDATE SET tokens = excluded.tokens, updated_at = excluded.updated_at",
+                    (service, tokens - 1, now)
+                )
+                self._record(conn, service, wait=wait)
+        
+        if rejected:
+            raise RateLimitExceeded(f"レート制限の待ち時間が上限を超えます: {service} ({wait:.1f}秒)")
+        if wait > 0:
+            self.logger.debug("レート制限のため待機します: %s (%.2f秒)", service, wait)
+            time.sleep(wait)
+        return wait
+    
+    def _record(self, conn: sqlite3.Connection, service: str, wait: Optional[float]):
+        """待ち時間の統計を加算（wait=None は確保できなかった場合）"""
+        if wait is None:
+            conn.execute(
+                "INSERT INTO rate_limit_stats (service, rejected) VALUES (?, 1) "
+                "ON CONFLICT(service) DO UPDATE SET rejected = rejected + 1",
+                (service,)
+            )
+            return
+        
+        conn.execute(
+            "INSERT INTO rate_limit_stats (service, acquired, waited, total_wait_seconds, max_wait_seconds) "
+            "VALUES (?, 1, ?, ?, ?) "
+            "ON CONFLICT(service) DO UPDATE SET acquired = acquired + 1, waited = waited + excluded.waited, "
+            "total_wait_seconds = total_wait_seconds + excluded.total_wait_seconds, "
+            "max_wait_seconds = MAX(max_wait_seconds, excluded.max_wait_seconds)",
+            (service, 1 if wait > 0 else 0, wait, wait)
+        )
+    
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """サービスごとの待ち時間の統計を取得"""
+        return _format_stats(self._connect().execute(self.STATS_QUERY).fetchall())
+
+def _format_stats(rows) -> Dict[str, Dict[str, Any]]:
+    """統計の行をサービスごとの辞書にする"""
+    stats = {}
+    for service, acquired, waited, rejected, total_wait, max_wait in rows:
+        stats[service] = {
+            "acquired": acquired,
+            "waited": waited,
+            "rejected": rejected,
+            "total_wait_seconds": round(total_wait, 3),
+            "average_wait_seconds": round(total_wait / acquired, 3) if acquired else 0,
+            "max_wait_seconds": round(max_wait, 3)
+        }
+    return stats
+
+def _validate_rate(service: str, requests_per_minute: float, burst: int):
+    """レート・バースト数の妥当性をチェック（0以下ではトークンが補充されない）"""
+    if not requests_per_minute > 0:
+        raise ValueError(f"requests_per_minute は正の数を指定してください: {service} ({requests_per_minute})")
+    if not burst >= 1:
+        raise ValueError(f"burst は1以上を指定してください: {service} ({burst})")
+
+class ServiceRateLimit:
+    """1つのサービスに対するレート制限（config.yaml の rate_limit 設定）"""
+    
+    def __init__(self, limiter: RateLimiter, service: str, settings: Mapping[str, Any]):
+        self.limiter = limiter
+        self.service = service
+        self.requests_per_minute = settings.get("requests_per_minute", 60)
+        self.burst = settings.get("burst", 1)
+        _validate_rate(service, self.requests_per_minute, self.burst)
+    
+    def acquire(self, max_wait: Optional[float] = None) -> float:
+        """トークンを1つ確保（待機した秒数を返す）"""
+        return self.limiter.acquire(self.service, self.requests_per_minute, self.burst, max_wait)
+
+# DBパス → レート制限（同じプロセス内では接続を共有する）
+_limiters: Dict[str, RateLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_rate_limiter(db_path: str) -> RateLimiter:
+    """DBパスに対応するレート制限を取得"""
+    with _limiters_lock:
+        limiter = _limiters.get(db_path)
+        if limiter is None:
+            limiter = RateLimiter(db_path)
+            _limiters[db_path] = limiter
+        return limiter
+
+def read_rate_limit_stats(db_path: str) -> Dict[str, Dict[str, Any]]:
+    """待ち時間の統計を読み取り専用の接続で取得（DB・テーブルがなければ空で、作成はしない）"""
+    path = Path(db_path)
+    if not path.exists():
+        return {}
+    
+    conn = sqlite3.connect(f"{path.absolute().as_uri()}?mode=ro", uri=True, timeout=30)
+    try:
+        return _format_stats(conn.execute(RateLimiter.STATS_QUERY).fetchall())
+    except sqlite3.OperationalError:
+        # 統計テーブルがまだ作成されていない
+        return {}
+    finally:
+        conn.close()
+
+def service_rate_limit(config: Mapping[str, Any], service: str,
+                       settings: Optional[Mapping[str, Any]]) -> Optional[ServiceRateLimit]:
+    """サービスのレート制限を作成（rate_limit が未設定なら None）"""
+    if not settings:
+        return None
+    db_path = config.get("resilience", {}).get("rate_limit_db", "results/rate_limits.db")
+    return ServiceRateLimit(get_rate_limiter(db_path), service, settings)
@@ -0,0 +1,272 @@
+"""
+合成レシートコーパス生成モジュール（負荷試験・ストレステスト用の再現可能なレシート本文と画像）
+"""
+
+import io
+import json
+import random
+import logging
+from datetime import date, timedelta
+from pathlib import Path
+from typing import Dict, Any, IO, Iterator, List, Optional
+
+from PIL import Image, ImageDraw, ImageFont
+
+# ロケールごとの店舗・品目・表記（通貨記号は CurrencyConverter.currency_symbols と同じもの）
+# price_range は1品あたりの価格の (最小, 最大, 刻み)（補助単位。小数なしの通貨は通貨単位）
+LOCALES: Dict[str, Dict[str, Any]] = {
+    "en_US": {
+        "language": "en", "currency": "USD", "symbol": "$", "symbol_position": "prefix", "decimals": 2,
+        "decimal_separator": ".", "thousands_separator": ",", "date_format": "{month:02d}/{day:02d}/{year}",
+        "tax_rate": 0.08875, "price_range": (150, 2500, 5), "tax_included": False,
+        "labels": {"subtotal": "Subtotal", "tax": "Tax", "total": "Total", "date": "Date", "thanks": "Thank you!"},
+        "merchants": ["Starbucks Coffee", "Joe's Diner", "Duane Reade", "Whole Foods Market", "Shake Shack"],
+        "items": ["Caramel Macchiato", "Bagel w/ Cream Cheese", "Bottled Water", "Cheeseburger", "French Fries",
+                  "Chicken Caesar Salad", "Blueberry Muffin", "Iced Tea", "Sunscreen SPF 50", "Subway MetroCard"]
+    },
+    "ms_MY": {
+        "language": "ms", "currency": "MYR", "symbol": "RM", "symbol_position": "prefix", "decimals": 2,
+        "decimal_separator": ".", "thousands_separator": ",", "date_format": "{day:02d}/{month:02d}/{year}",
+        "tax_rate": 0.06, "price_range": (200, 4500, 10), "tax_included": False,
+        "labels": {"subtotal": "Jumlah Kecil", "tax": "SST", "total": "Jumlah", "date": "Tarikh",
+                   "thanks": "Terima kasih!"},
+        "merchants": ["RED ELEPHANT", "Restoran Nasi Kandar Pelita", "Old Town White Coffee", "99 Speedmart"],
+        "items": ["Nasi Lemak Ayam", "Kao Mun Gai Chicken White Rice", "Teh Tarik", "Roti Canai", "Mee Goreng Mamak",
+                  "Kopi O Ais", "Air Mineral", "Char Kuey Teow", "Satay Ayam (10 cucuk)"]
+    },
+    "en_MY": {
+        "language": "en", "currency": "MYR", "symbol": "MYR", "symbol_position": "prefix", "decimals": 2,
+        "decimal_separator": ".", "thousands_separator": ",", "date_format": "{day:02d}-{month:02d}-{year}",
+        "tax_rate": 0.06, "price_range": (500, 30000, 50), "tax_included": False,
+        "labels": {"subtotal": "Sub Total", "tax": "Service Tax", "total": "Grand Total", "date": "Date",
+                   "thanks": "Thank you, please come again"},
+        "merchants": ["KLIA Duty Free", "Pavilion Food Court", "Uniqlo Suria KLCC"],
+        "items": ["Chocolate Gift Box", "Beryl's Tiramisu", "Airism T-Shirt", "White Coffee 3-in-1", "Bak Kut Teh Set"]
+    },
+    "th_TH": {
+        "language": "th", "currency": "THB", "symbol": "฿", "symbol_position": "prefix", "decimals": 2,
+        "decimal_separator": ".", "thousands_separator": ",", "date_format": "{day:02d}/{month:02d}/{buddhist_year}",
+        "tax_rate": 0.07, "price_range": (2000, 45000, 500), "tax_included": True,
+        "labels": {"subtotal": "รวม", "tax": "ภาษีมูลค่าเพิ่ม", "total": "ยอดสุทธิ", "date": "วันที่",
+                   "thanks": "ขอบคุณค่ะ"},
+        "merchants": ["7-Eleven สาขาสีลม", "McDonald's Bangkok", "ร้านข้าวมันไก่ประตูน้ำ", "Tops Market"],
+        "items": ["ข้าวมันไก่", "ผัดไทยกุ้งสด", "ชาเย็น", "น้ำดื่ม", "ต้มยำกุ้ง", "Big Mac Meal", "มะม่วงข้าวเหนียว",
+                  "กาแฟเย็น", "ส้มตำไทย"]
+    },
+    "ko_KR": {
+        "language": "ko", "currency": "KRW", "symbol": "₩", "symbol_position": "prefix", "decimals": 0,
+        "decimal_separator": ".", "thousands_separator": ",", "date_format": "{year}-{month:02d}-{day:02d}",
+        "tax_rate": 0.10, "price_range": (900, 15000, 100), "tax_included": True,
+        "labels": {"subtotal": "소계", "tax": "부가세", "total": "합계", "date": "일시", "thanks": "감사합니다"},
+        "merchants": ["편의점 GS25", "CU 명동점", "이디야커피", "본죽 강남점"],
+        "items": ["삼각김밥", "생수", "바나나맛우유", "아메리카노", "신라면", "떡볶이", "김밥", "소주", "호두과자"]
+    },
+    "ja_JP": {
+        "language": "ja", "currency": "JPY", "symbol": "¥", "symbol_position": "prefix", "decimals": 0,
+        "decimal_separator": ".", "thousands_separator": ",", "date_format": "{year}年{month:02d}月{day:02d}日",
+        "tax_rate": 0.10, "price_range": (100, 1500, 10), "tax_included": True,
+        "labels": {"subtotal": "小計", "tax": "内消費税", "total": "合計", "date": "日付",
+                   "thanks": "ありがとうございました"},
+        "merchants": ["セブン-イレブン 新宿店", "吉野家 渋谷店", "ローソン 京都駅前店", "ドトールコーヒー"],
+        "items": ["おにぎり 鮭", "お茶 500ml", "牛丼 並盛", "ブレンドコーヒー", "サンドイッチ", "からあげクン",
+                  "缶ビール 350ml", "ミルクレープ"]
+    },
+    "zh_CN": {
+        "language": "zh", "currency": "CNY", "symbol": "元", "symbol_position": "suffix", "decimals": 2,
+        "decimal_separator": ".", "thousands_separator": "", "date_format": "{year}-{month:02d}-{day:02d}",
+        "tax_rate": 0.0, "price_range": (800, 18000, 100), "tax_included": True,
+        "labels": {"subtotal": "小计", "tax": "税额", "total": "合计", "date": "日期", "thanks": "谢谢惠顾"},
+        "merchants": ["全家便利店", "海底捞火锅", "瑞幸咖啡", "庆丰包子铺"],
+        "items": ["小笼包", "拿铁咖啡", "牛肉面", "矿泉水", "宫保鸡丁", "炒饭", "豆浆", "烤鸭半只"]
+    },
+    "fr_FR": {
+        "language": "fr", "currency": "EUR", "symbol": "€", "symbol_position": "suffix", "decimals": 2,
+        "decimal_separator": ",", "thousands_separator": " ", "date_format": "{day:02d}/{month:02d}/{year}",
+        "tax_rate": 0.10, "price_range": (150, 2500, 10), "tax_included": True,
+        "labels": {"subtotal": "Sous-total", "tax": "TVA", "total": "Total", "date": "Date", "thanks": "Merci !"},
+        "merchants": ["Café de Flore", "Boulangerie Poilâne", "Monoprix", "Brasserie Lipp"],
+        "items": ["Croissant", "Café crème", "Pain au chocolat", "Croque-monsieur", "Eau minérale",
+                  "Salade niçoise", "Verre de vin rouge", "Tarte aux pommes"]
+    },
+    "de_DE": {
+        "language": "de", "currency": "EUR", "symbol": "€", "symbol_position": "prefix", "decimals": 2,
+        "decimal_separator": ".", "thousands_separator": ",", "date_format": "{day:02d}.{month:02d}.{year}",
+        "tax_rate": 0.19, "price_range": (150, 2500, 10), "tax_included": True,
+        "labels": {"subtotal": "Zwischensumme", "tax": "MwSt", "total": "Total", "date": "Datum",
+                   "thanks": "Vielen Dank!"},
+        "merchants": ["Bäckerei Schmidt", "REWE City", "Brauhaus Sion", "dm-drogerie markt"],
+        "items": ["Brezel", "Currywurst mit Pommes", "Apfelschorle", "Kölsch 0,2l", "Schnitzel Wiener Art",
+                  "Mineralwasser", "Laugenstange", "Kaffee"]
+    },
+}
+
+# 明細行数の範囲と既定の出現割合（pathological はパーサーの計算量・メモリの確認用）
+RECEIPT_SIZES = {
+    "tiny": (1, 2),
+    "typical": (3, 12),
+    "long": (30, 80),
+    "pathological": (500, 2000),
+}
+DEFAULT_SIZE_WEIGHTS = {"tiny": 0.15, "typical": 0.70, "long": 0.13, "pathological": 0.02}
+
+class ReceiptCorpusGenerator:
+    """シード付きの合成レシート生成クラス
+    
+    i 番目のレシートは (seed, i) だけから決まるため、件数を変えても同じ番号のレシートは同じになり、
+    途中から生成したり分割して並列に生成したりできる。各レシートには本文（text）と、
+    店舗・日付・明細・税・合計などの正解データを含める。
+    """
+    
+    def __init__(self, seed: int = 0, locales: Optional[List[str]] = None,
+                 size_weights: Optional[Dict[str, float]] = None):
+        self.seed = seed
+        self.logger = logging.getLogger(__name__)
+        self.locales = list(locales or LOCALES)
+        unknown = [locale for locale in self.locales if locale not in LOCALES]
+        if unknown:
+            raise ValueError(f"未対応のロケールです: {unknown}（{', '.join(LOCALES)}）")
+        weights = size_weights or DEFAULT_SIZE_WEIGHTS
+        self.sizes = [size for size in RECEIPT_SIZES if weights.get(size, 0) > 0]
+        self.size_weights = [weights[size] for size in self.sizes]
+        if not self.sizes:
+            raise ValueError("明細行数の割合がすべて0です")
+    
+    def generate(self, index: int) -> Dict[str, Any]:
+        """index 番目のレシート"""
+        rng = random.Random(f"{self.seed}:{index}")
+        locale_code = rng.choice(self.locales)
+        locale = LOCALES[locale_code]
+        size = rng.choices(self.sizes, weights=self.size_weights)[0]
+        scale = 10 ** locale["decimals"]
+        low, high, step = locale["price_range"]
+        
+        items = []
+        for _ in range(rng.randint(*RECEIPT_SIZES[size])):
+            quantity = rng.choice([1, 1, 1, 1, 2, 3])
+            unit_price = rng.randrange(low, high + 1, step)
+            items.append({
+                "description": rng.choice(locale["items"]),
+                "quantity": quantity,
+                "unit_price": unit_price / scale,
+                "amount": round(quantity * unit_price / scale, locale["decimals"])
+            })
+        
+        subtotal_minor = sum(round(item["amount"] * scale) for item in items)
+        rate = locale["tax_rate"]
+        if locale["tax_included"]:
+            tax_minor = round(subtotal_minor * rate / (1 + rate))
+            total_minor = subtotal_minor
+        else:
+            tax_minor = round(subtotal_minor * rate)
+            total_minor = subtotal_minor + tax_minor
+        
+        receipt_date = date(2023, 1, 1) + timedelta(days=rng.randrange(730))
+        receipt = {
+            "receipt_id": f"synthetic_{self.seed}_{index:06d}",
+            "locale": locale_code,
+            "language": locale["language"],
+            "currency": locale["currency"],
+            "symbol": locale["symbol"],
+            "size": size,
+            "merchant": rng.choice(locale["merchants"]),
+            "date": receipt_date.isoformat(),
+            "items": items,
+            "subtotal": subtotal_minor / scale,
+            "tax": tax_minor / scale,
+            "total": total_minor / scale
+        }
+        receipt["text"] = self._render_text(receipt, locale, rng)
+        return receipt
+    
+    def iter_receipts(self, count: int, start: int = 0) -> Iterator[Dict[str, Any]]:
+        """start 番目から count 件のレシートを順に返す（1件ずつ生成するためメモリは一定）"""
+        for index in range(start, start + count):
+            yield self.generate(index)
+    
+    def write_jsonl(self, stream: IO[str], count: int, start: int = 0,
+                    image_dir: Optional[Path] = None, font_path: Optional[str] = None) -> Dict[str, Any]:
+        """レシートを1行1件の JSON で書き出す（image_dir を指定すると <receipt_id>.jpg も書き出す）"""
+        summary = {"receipts": 0, "lines": 0, "images": 0, "by_locale": {}, "by_size": {}}
+        font = load_font(font_path) if image_dir else None
+        if image_dir:
+            image_dir.mkdir(parents=True, exist_ok=True)
+        
+        for receipt in self.iter_receipts(count, start):
+            stream.write(json.dumps(receipt, ensure_ascii=False, separators=(",", ":")) + "\n")
+            if image_dir:
+                (image_dir / f"{receipt['receipt_id']}.jpg").write_bytes(render_image(receipt["text"], font))
+                summary["images"] += 1
+            summary["receipts"] += 1
+            summary["lines"] += receipt["text"].count("\n") + 1
+            summary["by_locale"][receipt["locale"]] = summary["by_locale"].get(receipt["locale"], 0) + 1
+            summary["by_size"][receipt["size"]] = summary["by_size"].get(receipt["size"], 0) + 1
+        return summary
+    
+    def _render_text(self, receipt: Dict[str, Any], locale: Dict[str, Any], rng: random.Random) -> str:
+        """レシート本文（店舗名・明細・小計・税・合計・日付）"""
+        labels = locale["labels"]
+        year, month, day = (int(part) for part in receipt["date"].split("-"))
+        lines = [receipt["merchant"], f"#{rng.randint(1000, 99999)}", ""]
+        
+        for item in receipt["items"]:
+            if item["quantity"] > 1:
+                lines.append(f"{item['description']} x{item['quantity']} @ {format_amount(item['unit_price'], locale)}")
+                lines.append(f"    {format_amount(item['amount'], locale)}")
+            else:
+                lines.append(f"{item['description']} {format_amount(item['amount'], locale)}")
+            # 長いレシートには区切り線・バーコード等のノイズ行を混ぜる
+            if receipt["size"] in ("long", "pathological") and rng.random() < 0.05:
+                lines.append(rng.choice(["-" * 32, "*" * 24, str(rng.randrange(10 ** 12, 10 ** 13)), ""]))
+        
+        lines.append("")
+        lines.append(f"{labels['subtotal']} {format_amount(receipt['subtotal'], locale)}")
+        if locale["tax_rate"]:
+            lines.append(f"{labels['tax']} {format_amount(receipt['tax'], locale)}")
+        lines.append(f"{labels['total']}: {format_amount(receipt['total'], locale)}")
+        lines.append("")
+        lines.append(f"{labels['date']}: " + locale["date_format"].format(
+            year=year, month=month, day=day, buddhist_year=year + 543))
+        lines.append(labels["thanks"])
+        return "\n".join(lines)
+
+def format_amount(amount: float, locale: Dict[str, Any]) -> str:
+    """ロケールの表記（桁区切り・小数点・通貨記号の位置）で金額を整形"""
+    number = f"{amount:,.{locale['decimals']}f}"
+    number = number.replace(",", "\0").replace(".", locale["decimal_separator"]) \
+        .replace("\0", locale["thousands_separator"])
+    symbol = locale["symbol"]
+    if locale["symbol_position"] == "suffix":
+        return f"{number} {symbol}" if symbol == "€" else f"{number}{symbol}"
+    return f"{symbol} {number}" if symbol.isalpha() else f"{symbol}{number}"
+
+def load_font(font_path: Optional[str] = None, size: int = 20) -> ImageFont.ImageFont:
+    """描画用フォント（未指定の場合は Pillow の既定フォント。ラテン文字以外は表示できない）"""
+    if font_path:
+        return ImageFont.truetype(font_path, size)
+    return ImageFont.load_default(size)
+
+def render_image(text: str, font: Optional[ImageFont.ImageFont] = None, width: int = 640) -> bytes:
+    """レシート本文を白地に黒で描画した JPEG（グレースケール）"""
+    font = font or load_font()
+    lines = text.splitlines()
+    line_height = int(getattr(font, "size", 12) * 1.4)
+    margin = 24
+    image = Image.new("L", (width, margin * 2 + line_height * max(len(lines), 1)), 255)
+    draw = ImageDraw.Draw(image)
+    for i, line in enumerate(lines):
+        draw.text((margin, margin + i * line_height), line, fill=0, font=font)
+    
+    buffer = io.BytesIO()
+    image.save(buffer, "JPEG", quality=80)
+    return buffer.getvalue()
+
+def parse_size_weights(value: str) -> Dict[str, float]:
+    """明細行数区分の割合（例: tiny=1,typical=8,long=1）を解析"""
+    weights = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        name = name.strip()
+        if name not in RECEIPT_SIZES:
+            raise ValueError(f"未対応の明細行数区分です: {name}（{', '.join(RECEIPT_SIZES)}）")
+        weights[name] = float(weight)
+    return weights
@@ -0,0 +1,251 @@
+"""
+レシート画像アップロードモジュール（multipart/form-data のストリーミング受信）
+"""
+
+import os
+import hashlib
+import logging
+import tempfile
+from pathlib import Path
+from typing import Dict, Any, BinaryIO, List, Optional
+
+from src.image_files import image_path
+
+class UploadError(Exception):
+    """アップロード内容が不正な場合の例外（status はHTTPステータスコード）"""
+    
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+class ReceiptUploader:
+    """multipart/form-data の本文をチャンク単位で読み、画像をディスクへ直接書き込むクラス
+    
+    本文全体をメモリに載せず、受信しながら SHA-256 を計算する。保存先は内容ハッシュから
+    決まる receipt_id（ハッシュ先頭16桁）と画像形式の拡張子のファイルで、同じ内容の画像は再保存しない。
+    途中でエラーになった場合は、そのリクエストで保存した画像を削除する（ジョブは登録されないため）。
+    """
+    
+    # パートヘッダーの上限（バイト）
+    MAX_HEADER_SIZE = 16 * 1024
+    
+    def __init__(self, config: Dict[str, Any]):
+        self.config = config
+        self.logger = logging.getLogger(__name__)
+        
+        upload_config = config.get("upload", {})
+        self.max_bytes = upload_config.get("max_bytes", 20 * 1024 * 1024)
+        self.chunk_size = upload_config.get("chunk_size", 64 * 1024)
+        self.allowed_types = set(upload_config.get("allowed_types", ["image/jpeg", "image/png"]))
+        
+        # 保存先は load_image ステップの画像ファイルパターンに合わせる
+        self.file_pattern = next(
+            (step["target_file_pattern"]
+             for phase in config["processing_flow"] for step in phase["steps"]
+             if step["action"] == "load_image" and "target_file_pattern" in step),
+            "receipts/{{receipt_id}}.jpg"
+        )
+    
+    def image_path(self, receipt_id: str, content_type: Optional[str] = None) -> Path:
+        """receipt_id に対応する画像ファイルのパス（content_type の形式の拡張子）"""
+        return image_path(self.file_pattern, receipt_id, content_type)
+    
+    def receive(self, stream: BinaryIO, content_type: str, content_length: int) -> List[Dict[str, Any]]:
+        """multipart本文を読み込み、保存した画像ごとに receipt_id・ハッシュ・重複有無を返す"""
+        boundary = self._parse_boundary(content_type)
+        if content_length > self.max_bytes:
+            raise UploadError(f"アップロードサイズが上限を超えています: {content_length}バイト", status=413)
+        
+        saved_paths: List[Path] = []
+        try:
+            return self._receive_parts(_BoundedReader(stream, content_length, self.chunk_size), boundary,
+                                       saved_paths)
+        except Exception:
+            # 後続のパートでエラーになった場合も、このリクエストで保存した画像を残さない
+            for path in saved_paths:
+                self._remove(path)
+            raise
+    
+    def _receive_parts(self, reader: "_BoundedReader", boundary: bytes,
+                       saved_paths: List[Path]) -> List[Dict[str, Any]]:
+        """multipart本文のパートを順に読み込む（新しく保存した画像のパスは saved_paths に追加）"""
+        delimiter = b"\r\n--" + boundary
+        
+        # 最初の区切り行の前に CRLF を補い、以降の区切りと同じ形で探せるようにする
+        buffer = b"\r\n"
+        uploads = []
+        
+        while True:
+            # 区切り行を探す（前置きは読み捨てる）
+            buffer = self._stream_part(reader, buffer, delimiter, None)[len(delimiter):]
+            
+            buffer = self._fill(reader, buffer, 2)
+            if buffer.startswith(b"--"):
+                # 終端の区切り（--boundary--）以降は読み捨てる
+                while reader.read():
+                    pass
+                break
+            if not buffer.startswith(b"\r\n"):
+                raise UploadError("multipartの区切り行が不正です")
+            buffer = buffer[2:]
+            
+            headers, buffer = self._read_headers(reader, buffer)
+            filename = self._disposition_param(headers.get("content-disposition", ""), "filename")
+            part_type = headers.get("content-type", "application/octet-stream").split(";")[0].strip().lower()
+            
+            if filename is None:
+                # 画像以外のフィールドは読み捨てる
+                buffer = self._stream_part(reader, buffer, delimiter, None)
+                continue
+            
+            if part_type not in self.allowed_types:
+                raise UploadError(f"対応していないファイル形式です: {filename} ({part_type})", status=415)
+            
+            upload, buffer = self._save_part(reader, buffer, delimiter, filename, part_type)
+            uploads.append(upload)
+            if not upload["duplicate"]:
+                saved_paths.append(self.image_path(upload["receipt_id"], part_type))
+        
+        return uploads
+    
+    def _save_part(self, reader: "_BoundedReader", buffer: bytes, delimiter: bytes,
+                   filename: str, part_type: str):
+        """画像パートを一時ファイルへ書き込みながらハッシュを計算し、内容ハッシュ名で確定する
+        
+        確定はハードリンクで行い、同じ画像を同時に受信しても既存のファイルを置き換えない
+        （リンク先が存在すれば重複として扱う）。ハードリンクを作れないファイルシステムでは
+        既存のファイルを確認してから置き換える（同じ内容のため置き換えても問題はない）。
+        """
+        upload_dir = Path(self.file_pattern).parent
+        upload_dir.mkdir(parents=True, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=str(upload_dir), prefix=".upload-", suffix=".tmp")
+        digest = hashlib.sha256()
+        
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                def sink(data: bytes):
+                    digest.update(data)
+                    f.write(data)
+                
+                buffer = self._stream_part(reader, buffer, delimiter, sink)
+                size = f.tell()
+            
+            sha256 = digest.hexdigest()
+            receipt_id = sha256[:16]
+            target = self.image_path(receipt_id, part_type)
+            
+            try:
+                os.link(tmp_path, target)
+                duplicate = False
+            except FileExistsError:
+                duplicate = True
+            except OSError:
+                duplicate = target.exists()
+                if not duplicate:
+                    os.replace(tmp_path, target)
+        finally:
+            self._remove(Path(tmp_path))
+        
+        self.logger.info(f"画像を受信しました: {filename} → {target} ({size}バイト{'、重複' if duplicate else ''})")
+        return {
+            "receipt_id": receipt_id,
+            "filename": filename,
+            "sha256": sha256,
+            "size": size,
+            "duplicate": duplicate
+        }, buffer
+    
+    def _remove(self, path: Path):
+        """ファイルを削除（存在しなければ何もしない）"""
+        try:
+            path.unlink()
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            self.logger.error(f"ファイルの削除に失敗しました: {path}: {str(e)}")
+    
+    def _stream_part(self, reader: "_BoundedReader", buffer: bytes, delimiter: bytes, sink) -> bytes:
+        """次の区切り行までのパート本文を sink に渡し、区切り行以降の残りを返す"""
+        while True:
+            index = buffer.find(delimiter)
+            if index >= 0:
+                if sink:
+                    sink(buffer[:index])
+                return buffer[index:]
+            
+            # 区切り行がチャンクをまたぐ可能性があるため、末尾は次のチャンクと合わせて探す
+            keep = len(delimiter) - 1
+            if len(buffer) > keep:
+                if sink:
+                    sink(buffer[:-keep])
+                buffer = buffer[-keep:]
+            
+            chunk = reader.read()
+            if not chunk:
+                raise UploadError("アップロードが途中で終了しました")
+            buffer += chunk
+    
+    def _read_headers(self, reader: "_BoundedReader", buffer: bytes):
+        """パートヘッダーを読み込み、(小文字のヘッダー名→値, 残り) を返す"""
+        while b"\r\n\r\n" not in buffer:
+            if len(buffer) > self.MAX_HEADER_SIZE:
+                raise UploadError("パートヘッダーが大きすぎます")
+            chunk = reader.read()
+            if not chunk:
+                raise UploadError("アップロードが途中で終了しました")
+            buffer += chunk
+        
+        raw_headers, buffer = buffer.split(b"\r\n\r\n", 1)
+        headers = {}
+        for line in raw_headers.decode('utf-8', errors='replace').split("\r\n"):
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+        return headers, buffer
+    
+    def _fill(self, reader: "_BoundedReader", buffer: bytes, size: int) -> bytes:
+        """バッファが size バイト以上になるまで読み込む"""
+        while len(buffer) < size:
+            chunk = reader.read()
+            if not chunk:
+                raise UploadError("アップロードが途中で終了しました")
+            buffer += chunk
+        return buffer
+    
+    @staticmethod
+    def _parse_boundary(content_type: str) -> bytes:
+        """Content-Type から multipart の境界文字列を取得"""
+        media_type, _, params = content_type.partition(";")
+        if media_type.strip().lower() != "multipart/form-data":
+            raise UploadError("multipart/form-data で送信してください", status=415)
+        
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "boundary" and value:
+                return value.strip('"').encode('latin-1')
+        raise UploadError("multipartの境界文字列が指定されていません")
+    
+    @staticmethod
+    def _disposition_param(disposition: str, name: str) -> Optional[str]:
+        """Content-Disposition のパラメータ値を取得"""
+        for param in disposition.split(";")[1:]:
+            key, _, value = param.strip().partition("=")
+            if key.lower() == name:
+                return value.strip('"')
+        return None
+
+class _BoundedReader:
+    """Content-Length を超えて読み込まないリーダー"""
+    
+    def __init__(self, stream: BinaryIO, length: int, chunk_size: int):
+        self.stream = stream
+        self.remaining = length
+        self.chunk_size = chunk_size
+    
+    def read(self) -> bytes:
+        """最大 chunk_size バイトを読み込む（終端では空）"""
+        if self.remaining <= 0:
+            return b""
+        chunk = self.stream.read(min(self.chunk_size, self.remaining))
+        self.remaining -= len(chunk)
+        return chunk
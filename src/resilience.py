@@ -0,0 +1,233 @@
+"""
+外部API呼び出しの耐障害性モジュール（期限バジェット・サーキットブレーカー）
+"""
+
+import time
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Dict, Any, Callable, Iterator, Mapping, Optional, TypeVar
+
+from src.rate_limiter import RateLimitExceeded, ServiceRateLimit
+from src.metrics import API_CALLS
+
+T = TypeVar("T")
+
+class DeadlineExceeded(Exception):
+    """レシート1件あたりの処理期限を使い切った場合の例外"""
+
+class CircuitOpenError(Exception):
+    """サーキットブレーカーが開いているため呼び出しを行わなかった場合の例外"""
+
+class DeadlineBudget:
+    """レシート1件の処理全体で共有する期限バジェット
+    
+    各ステップの外部API呼び出しは、サービスごとのタイムアウトと残り時間の
+    短い方をタイムアウトとして使う。呼び出し結果はサービスごとに集計する。
+    """
+    
+    def __init__(self, seconds: float):
+        self.seconds = seconds
+        self.deadline = time.monotonic() + seconds
+        self.calls: Dict[str, Dict[str, int]] = {}
+        self.rate_limit_waits: Dict[str, float] = {}
+        self.exceeded = False
+    
+    def remaining(self) -> float:
+        """残り時間（秒）"""
+        return max(self.deadline - time.monotonic(), 0.0)
+    
+    def timeout(self, service_timeout: float) -> float:
+        """今回の呼び出しに使うタイムアウト（残り時間が無ければ DeadlineExceeded）"""
+        remaining = self.remaining()
+        if remaining <= 0:
+            self.exceeded = True
+            raise DeadlineExceeded(f"処理期限（{self.seconds}秒）を超過しました")
+        return min(service_timeout, remaining)
+    
+    def record(self, service: str, outcome: str):
+        """呼び出し結果（success / failure / short_circuited / deadline_exceeded / rate_limited）を記録"""
+        outcomes = self.calls.setdefault(service, {})
+        outcomes[outcome] = outcomes.get(outcome, 0) + 1
+    
+    def record_wait(self, service: str, seconds: float):
+        """レート制限による待ち時間を記録"""
+        self.rate_limit_waits[service] = self.rate_limit_waits.get(service, 0.0) + seconds
+    
+    def summary(self) -> Dict[str, Any]:
+        """結果に記録する集計"""
+        return {
+            "deadline_seconds": self.seconds,
+            "remaining_seconds": round(self.remaining(), 3),
+            "deadline_exceeded": self.exceeded,
+            "calls": {service: dict(outcomes) for service, outcomes in self.calls.items()},
+            "rate_limit_wait_seconds": {service: round(seconds, 3) for service, seconds in self.rate_limit_waits.items()}
+        }
+
+class CircuitBreaker:
+    """連続した失敗で開き、一定時間は呼び出しを行わずにすぐ失敗させるサーキットブレーカー
+    
+    closed: 通常どおり呼び出す。failure_threshold 回連続で失敗すると open になる。
+    open: reset_seconds の間は呼び出さない。経過後は half_open になる。
+    half_open: 1件だけ試行し、成功すれば closed、失敗すれば再び open に戻る。
+    """
+    
+    def __init__(self, name: str, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_seconds = reset_seconds
+        self.logger = logging.getLogger(__name__)
+        
+        self._lock = threading.Lock()
+        self._state = "closed"
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._open_count = 0
+    
+    @property
+    def state(self) -> str:
+        """現在の状態（open の期限が過ぎていれば half_open）"""
+        with self._lock:
+            return self._current_state()
+    
+    def _current_state(self) -> str:
+        if self._state == "open" and time.monotonic() - self._opened_at >= self.reset_seconds:
+            self._state = "half_open"
+            self._trial_in_flight = False
+        return self._state
+    
+    def allow_request(self) -> bool:
+        """呼び出しを行ってよいかどうか（half_open では同時に1件のみ許可）"""
+        with self._lock:
+            state = self._current_state()
+            if state == "closed":
+                return True
+            if state == "half_open" and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+    
+    def record_success(self):
+        """呼び出し成功を記録"""
+        with self._lock:
+            if self._state != "closed":
+                self.logger.info(f"サーキットブレーカーを閉じました: {self.name}")
+            self._state = "closed"
+            self._failures = 0
+            self._trial_in_flight = False
+    
+    def record_failure(self):
+        """呼び出し失敗を記録"""
+        with self._lock:
+            self._failures += 1
+            if self._state == "half_open" or self._failures >= self.failure_threshold:
+                if self._state != "open":
+                    self._open_count += 1
+                    self.logger.warning(f"サーキットブレーカーが開きました: {self.name} "
+                                        f"({self._failures}回連続失敗、{self.reset_seconds}秒間は呼び出しません)")
+                self._state = "open"
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+    
+    def release_trial(self):
+        """呼び出しを行わなかった場合に half_open の試行枠を返却"""
+        with self._lock:
+            self._trial_in_flight = False
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """状態のスナップショット"""
+        with self._lock:
+            return {
+                "state": self._current_state(),
+                "consecutive_failures": self._failures,
+                "open_count": self._open_count
+            }
+
+# サービス名 → サーキットブレーカー（プロセス内で共有し、プロセッサーを作り直しても状態を保つ）
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+# 処理中のレシートの期限バジェット（スレッドごと）
+_current_budget: ContextVar[Optional[DeadlineBudget]] = ContextVar("deadline_budget", default=None)
+
+def get_breaker(name: str, settings: Optional[Mapping[str, Any]] = None) -> CircuitBreaker:
+    """サービスのサーキットブレーカーを取得（設定が変わっていれば閾値を更新）"""
+    settings = settings or {}
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = CircuitBreaker(name)
+            _breakers[name] = breaker
+        breaker.failure_threshold = settings.get("failure_threshold", breaker.failure_threshold)
+        breaker.reset_seconds = settings.get("reset_seconds", breaker.reset_seconds)
+        return breaker
+
+def breaker_states() -> Dict[str, Dict[str, Any]]:
+    """すべてのサーキットブレーカーの状態"""
+    with _breakers_lock:
+        breakers = list(_breakers.values())
+    return {breaker.name: breaker.snapshot() for breaker in breakers}
+
+@contextmanager
+def deadline_budget(seconds: float) -> Iterator[DeadlineBudget]:
+    """このブロック内の外部API呼び出しで共有する期限バジェットを設定"""
+    budget = DeadlineBudget(seconds)
+    token = _current_budget.set(budget)
+    try:
+        yield budget
+    finally:
+        _current_budget.reset(token)
+
+def skip_reason(error: Exception) -> str:
+    """呼び出しを行わなかった理由（メトリクスのラベル）"""
+    if isinstance(error, CircuitOpenError):
+        return "circuit_open"
+    if isinstance(error, RateLimitExceeded):
+        return "rate_limited"
+    return "deadline_exceeded"
+
+def _record_call(budget: Optional[DeadlineBudget], service: str, outcome: str):
+    """呼び出し結果を期限バジェットとメトリクスに記録"""
+    API_CALLS.inc(service=service, outcome=outcome)
+    if budget:
+        budget.record(service, outcome)
+
+def guarded_call(breaker: CircuitBreaker, func: Callable[[float], T], service_timeout: float,
+                 rate_limit: Optional[ServiceRateLimit] = None) -> T:
+    """サーキットブレーカー・レート制限・期限バジェットを適用して外部APIを呼び出す
+    
+    func はタイムアウト（秒）を受け取って呼び出しを行う関数。ブレーカーが開いている場合は
+    CircuitOpenError、レート制限の待ちが残り時間を超える場合は RateLimitExceeded、
+    期限切れの場合は DeadlineExceeded を呼び出し前に送出する。
+    """
+    budget = _current_budget.get()
+    
+    if not breaker.allow_request():
+        _record_call(budget, breaker.name, "short_circuited")
+        raise CircuitOpenError(f"サーキットブレーカーが開いています: {breaker.name}")
+    
+    try:
+        if rate_limit:
+            waited = rate_limit.acquire(max_wait=budget.remaining() if budget else None)
+            if budget and waited > 0:
+                budget.record_wait(breaker.name, waited)
+        timeout = budget.timeout(service_timeout) if budget else service_timeout
+    except (DeadlineExceeded, RateLimitExceeded) as e:
+        # 呼び出していないためブレーカーの試行枠は返却する（成功・失敗には数えない）
+        # レート制限で待てなかった場合は期限超過とは区別する（期限はまだ残っている）
+        breaker.release_trial()
+        _record_call(budget, breaker.name, skip_reason(e))
+        raise
+    
+    try:
+        result = func(timeout)
+    except Exception:
+        breaker.record_failure()
+        _record_call(budget, breaker.name, "failure")
+        raise
+    
+    breaker.record_success()
+    _record_call(budget, breaker.name, "success")
+    return result
@@ -0,0 +1,104 @@
+"""
+結果アーカイブモジュール（gzip圧縮 JSON Lines）
+"""
+
+import os
+import gzip
+import json
+import zlib
+import logging
+from pathlib import Path
+from typing import Dict, Any, Iterator, List, Optional
+
+class ResultArchive:
+    """置き換えられた過去の処理結果を圧縮保存するアーカイブクラス
+    
+    レシートごとに <receipt_id>.jsonl.gz を1ファイル持ち、コンパクションのたびに
+    一時ファイルへ書き直して置き換える（書き込み中に中断しても既存のアーカイブは壊れない）。
+    処理結果は処理日時（metadata.processed_at）で識別し、アーカイブ済みの結果は追記しない。
+    """
+    
+    SUFFIX = ".jsonl.gz"
+    
+    def __init__(self, archive_dir: str):
+        self.archive_dir = Path(archive_dir)
+        self.logger = logging.getLogger(__name__)
+    
+    def _archive_path(self, receipt_id: str) -> Path:
+        return self.archive_dir / f"{receipt_id}{self.SUFFIX}"
+    
+    def append(self, receipt_id: str, runs: List[Dict[str, Any]]) -> int:
+        """未アーカイブの処理結果を追記し、追記した件数を返す（書き込み完了後に戻る）
+        
+        コンパクションが削除前に中断して同じ結果を再度渡しても、重複して保存しない。
+        """
+        if not runs:
+            return 0
+        
+        existing_runs = list(self.iter_runs(receipt_id))
+        archived = {run.get("metadata", {}).get("processed_at", "") for run in existing_runs}
+        new_runs = []
+        for run in runs:
+            processed_at = run.get("metadata", {}).get("processed_at", "")
+            if processed_at not in archived:
+                archived.add(processed_at)
+                new_runs.append(run)
+        if not new_runs:
+            return 0
+        
+        self.archive_dir.mkdir(parents=True, exist_ok=True)
+        lines = "".join(json.dumps(run, ensure_ascii=False, separators=(",", ":")) + "\n"
+                        for run in existing_runs + new_runs)
+        
+        archive_path = self._archive_path(receipt_id)
+        tmp_path = archive_path.with_name(archive_path.name + ".tmp")
+        with open(tmp_path, 'wb') as f:
+            f.write(gzip.compress(lines.encode('utf-8')))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, archive_path)
+        
+        self.logger.info(f"結果をアーカイブしました: {receipt_id} ({len(new_runs)}件)")
+        return len(new_runs)
+    
+    def iter_runs(self, receipt_id: str) -> Iterator[Dict[str, Any]]:
+        """アーカイブされた処理結果を順に返す（末尾が途中で切れていれば、読めた分までを返す）"""
+        archive_path = self._archive_path(receipt_id)
+        if not archive_path.exists():
+            return
+        
+        try:
+            with gzip.open(archive_path, 'rt', encoding='utf-8') as f:
+                for line in f:
+                    if line.strip():
+                        yield json.loads(line)
+        except (EOFError, gzip.BadGzipFile, zlib.error, json.JSONDecodeError) as e:
+            # 以前の追記方式で書き込み中に中断したアーカイブ
+            self.logger.warning(f"アーカイブの末尾が壊れているため以降を読み飛ばします: {archive_path}: {str(e)}")
+    
+    def iter_all_runs(self) -> Iterator[Dict[str, Any]]:
+        """全レシートのアーカイブされた処理結果を順に返す"""
+        if not self.archive_dir.exists():
+            return
+        
+        for archive_path in sorted(self.archive_dir.glob(f"*{self.SUFFIX}")):
+            yield from self.iter_runs(archive_path.name[:-len(self.SUFFIX)])
+    
+    def list_runs(self, receipt_id: str) -> List[str]:
+        """アーカイブされた処理日時の一覧を新しい順に取得"""
+        processed = {run.get("metadata", {}).get("processed_at", "") for run in self.iter_runs(receipt_id)}
+        return sorted(processed, reverse=True)
+    
+    def load(self, receipt_id: str, processed_at: Optional[str] = None) -> Optional[Dict[str, Any]]:
+        """アーカイブから処理結果を取得（processed_at 省略時は最新）"""
+        selected = None
+        
+        for run in self.iter_runs(receipt_id):
+            run_at = run.get("metadata", {}).get("processed_at", "")
+            if processed_at is not None:
+                if run_at == processed_at:
+                    return run
+            elif selected is None or run_at > selected.get("metadata", {}).get("processed_at", ""):
+                selected = run
+        
+        return selected
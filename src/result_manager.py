@@ -3,12 +3,34 @@
 """
 
 import os
+import re
 import json
+import itertools
 import logging
 from pathlib import Path
-from typing import Dict, Any
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 from datetime import datetime
 
+import pandas as pd
+import pyarrow as pa
+
+from src.result_store import ResultStore
+from src.result_archive import ResultArchive
+from src.progress_broker import ProgressBroker
+from src.step_checkpoints import StepCheckpoints
+from src.rate_limiter import read_rate_limit_stats
+from src.metrics import REGISTRY, RESULTS_SAVED
+from src.result_writer import AsyncResultWriter, atomic_write_json
+
+# 従来形式の結果ファイル名（<receipt_id>_YYYYMMDD_HHMMSS.json）
+RUN_FILE_PATTERN = re.compile(r"^(?P<receipt_id>.+)_(?P<timestamp>\d{8}_\d{6})\.json$")
+
+# レシート本文中の日付（2024-01-15 / 2024/01/15 / 2024.01.15）
+RECEIPT_DATE_PATTERN = re.compile(r"(\d{4})[-/.](\d{1,2})[-/.](\d{1,2})")
+
+# 旅行IDが指定されていないレシートの集計キー
+UNASSIGNED_TRIP = "未分類"
+
 class ResultManager:
     """結果管理クラス"""
     
@@ -20,14 +42,61 @@ class ResultManager:
         self.output_config = config["output"]
         self.output_dir = Path(self.output_config["output_dir"])
         self.should_save_results = self.output_config["save_results"]
+        self.write_json_files = self.output_config.get("write_json_files", False)
         
         # 出力ディレクトリを作成
         self.output_dir.mkdir(exist_ok=True)
         
+        # 結果ストア（receipt_id・処理日時でインデックス）
+        store_path = self.output_config.get("store_path", str(self.output_dir / "results.db"))
+        self.store = ResultStore(store_path)
+        
+        # 処理進捗イベント（Webサーバーが Server-Sent Events で配信）
+        # 発行のたびに書き込むため、結果の保存と書き込みロックを取り合わないよう別のDBファイルに記録する
+        progress_config = self.output_config.get("progress", {})
+        self.progress_store = ResultStore(progress_config.get("db_path", str(self.output_dir / "progress.db")))
+        self.progress = ProgressBroker(self.progress_store, poll_interval=progress_config.get("poll_interval", 0.5),
+                                       retention_seconds=progress_config.get("retention_seconds", 3600))
+        self.progress_keepalive = progress_config.get("keepalive_seconds", 15)
+        
+        # 処理ステップのチェックポイント（再実行時は完了済みのステップから再開する）
+        self.checkpoints = None
+        if config.get("checkpoints", {}).get("enabled", True):
+            self.checkpoints = StepCheckpoints(self.store)
+        
+        # 過去の処理結果の保持件数と圧縮アーカイブ
+        retention_config = self.output_config.get("retention", {})
+        self.keep_latest_runs = retention_config.get("keep_latest_runs", 3)
+        self.archive = ResultArchive(retention_config.get("archive_dir", str(self.output_dir / "archive")))
+        
+        # 支出集計インデックス（保存時に更新する1ファイルのJSON）
+        self.expense_index_path = Path(self.output_config.get("expense_index_file", str(self.output_dir / "expense_index.json")))
+        
+        # 分析用エクスポート（Parquet）の出力先
+        export_config = self.output_config.get("export", {})
+        self.export_dir = Path(export_config.get("conversions_dir", str(self.output_dir / "analytics" / "conversions")))
+        self.display_currencies = config["currency"].get("display_currencies", [config["currency"]["base_currency"]])
+        
+        # 非同期書き込み（処理パイプラインをディスクI/Oで待たせない）
+        self.writer = None
+        if self.output_config.get("async_writes", False):
+            self.writer = AsyncResultWriter(
+                max_queue_size=self.output_config.get("writer_queue_size", 256),
+                batch_size=self.output_config.get("writer_batch_size", 32)
+            )
+        
+        # 処理時間ヒストグラムのバケット上限（秒）
+        stats_config = self.output_config.get("stats", {})
+        self.latency_buckets = sorted(stats_config.get("latency_buckets", [0.5, 1, 2, 5, 10, 30, 60]))
+        self.processing_seconds = REGISTRY.histogram(
+            "receipt_processing_seconds", "レシート1件の処理時間（秒）", self.latency_buckets
+        )
+        
         self.logger.info(f"結果管理モジュールを初期化しました: {self.output_dir}")
     
-    def save_results(self, results: Dict[str, Any], receipt_id: str):
-        """処理結果を保存"""
+    def save_results(self, results: Dict[str, Any], receipt_id: str, trip_id: Optional[str] = None,
+                     source_name: Optional[str] = None):
+        """処理結果を保存（source_name はアーカイブのメンバー名など、画像の元のファイル名）"""
         try:
             if not self.should_save_results:
                 self.logger.info("結果保存が無効になっています")
@@ -40,24 +109,59 @@ class ResultManager:
                 "project_version": self.config["project"]["version"],
                 "receipt_id": receipt_id
             }
+            if trip_id:
+                results["metadata"]["trip_id"] = trip_id
+            if source_name:
+                results["metadata"]["source_name"] = source_name
             
-            # ファイル名を生成
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            filename = f"{receipt_id}_{timestamp}.json"
-            filepath = self.output_dir / filename
+            # メトリクス（/metrics）
+            failed = any(phase_data.get("status") == "error" for phase_data in results.get("phases", {}).values())
+            RESULTS_SAVED.inc(status="error" if failed else "completed")
+            if results.get("processing_time") is not None:
+                self.processing_seconds.observe(results["processing_time"])
             
-            # JSONファイルとして保存
-            with open(filepath, 'w', encoding='utf-8') as f:
-                json.dump(results, f, ensure_ascii=False, indent=2)
-            
-            self.logger.info(f"結果を保存しました: {filepath}")
-            
-            # サマリーファイルも作成
-            self._create_summary(results, receipt_id)
+            if self.writer:
+                # サマリーは同じレシートの書き込みがバッチ内で重なった場合、最新のみ書き込む
+                self.writer.submit(self._write_results, results, receipt_id)
+                self.writer.submit(self._create_summary, results, receipt_id, key=f"summary:{receipt_id}")
+                self.writer.submit(self._write_expense_index, key="expense_index")
+            else:
+                self._write_results(results, receipt_id)
+                self._create_summary(results, receipt_id)
+                self._write_expense_index()
             
         except Exception as e:
             self.logger.error(f"結果保存に失敗しました: {str(e)}")
     
+    def _write_results(self, results: Dict[str, Any], receipt_id: str):
+        """結果ストア・JSONファイルへの書き込み（非同期時はライタースレッドで実行）"""
+        # 結果ストアに保存（統計・支出集計も同じトランザクションで更新）
+        counters, latency_bucket = self._stats_delta(results)
+        index_row, contributions = self._expense_contributions(results)
+        with self.store.transaction() as conn:
+            self.store.insert_result(conn, receipt_id, results["metadata"]["processed_at"], results)
+            self.store.increment_stats(conn, counters, latency_bucket)
+            self.store.update_receipt_aggregates(conn, index_row, contributions)
+        self.logger.info("結果を保存しました: %s (%s)", receipt_id, self.store.db_path)
+        
+        # 従来形式のJSONファイル（設定で有効な場合のみ）
+        if self.write_json_files:
+            processed_at = datetime.fromisoformat(results["metadata"]["processed_at"])
+            filepath = self.output_dir / f"{receipt_id}_{processed_at.strftime('%Y%m%d_%H%M%S')}.json"
+            atomic_write_json(filepath, results)
+            self.logger.info("結果ファイルを保存しました: %s", filepath)
+    
+    def flush(self):
+        """非同期書き込みの完了を待機"""
+        if self.writer:
+            self.writer.flush()
+    
+    def close(self):
+        """未書き込みの結果・進捗イベントをフラッシュして終了"""
+        if self.writer:
+            self.writer.close()
+        self.progress.close()
+    
     def _create_summary(self, results: Dict[str, Any], receipt_id: str):
         """処理結果のサマリーを作成"""
         try:
@@ -90,10 +194,9 @@ class ResultManager:
             summary_filename = f"{receipt_id}_summary.json"
             summary_filepath = self.output_dir / summary_filename
             
-            with open(summary_filepath, 'w', encoding='utf-8') as f:
-                json.dump(summary, f, ensure_ascii=False, indent=2)
+            atomic_write_json(summary_filepath, summary)
             
-            self.logger.info(f"サマリーを作成しました: {summary_filepath}")
+            self.logger.info("サマリーを作成しました: %s", summary_filepath)
             
         except Exception as e:
             self.logger.error(f"サマリー作成に失敗しました: {str(e)}")
@@ -126,14 +229,19 @@ class ResultManager:
                 if conversions:
                     extracted["conversions"] = conversions
                     # 合計金額を計算（重複を避けるため、ユニークな金額のみ）
-                    unique_amounts = {}
-                    for conv in conversions:
-                        key = (conv["original_amount"], conv["original_currency"])
-                        if key not in unique_amounts or conv["jpy_amount"] > unique_amounts[key]:
-                            unique_amounts[key] = conv["jpy_amount"]
+                    unique_conversions = self._unique_conversions(conversions)
                     
-                    total_jpy = sum(unique_amounts.values())
+                    total_jpy = sum(conv["jpy_amount"] for conv in unique_conversions)
                     extracted["total_jpy"] = total_jpy
+                    
+                    # 表示通貨ごとの合計（換算時のクロスレートから算出済みの金額を集計）
+                    totals = {}
+                    for conv in unique_conversions:
+                        for currency, converted in conv.get("converted_amounts", {}).items():
+                            if converted is not None:
+                                totals[currency] = round(totals.get(currency, 0) + converted, 2)
+                    if totals:
+                        extracted["totals"] = totals
             
             # 画像処理フェーズからテキストを抽出
             if "image_processing" in results["phases"]:
@@ -148,79 +256,453 @@ class ResultManager:
         
         return extracted
     
-    def load_results(self, receipt_id: str) -> Dict[str, Any]:
-        """保存された結果を読み込み"""
+    def _unique_conversions(self, conversions: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """同じ金額・通貨の換算結果を1件にまとめる（円換算額が最大のものを残す）
+        
+        為替レートが不明で換算できなかった金額（jpy_amount が None）は合計に含めないため除く。
+        """
+        unique_amounts = {}
+        for conv in conversions:
+            if conv.get("jpy_amount") is None:
+                continue
+            key = (conv["original_amount"], conv["original_currency"])
+            if key not in unique_amounts or conv["jpy_amount"] > unique_amounts[key]["jpy_amount"]:
+                unique_amounts[key] = conv
+        return list(unique_amounts.values())
+    
+    def _receipt_date(self, results: Dict[str, Any]) -> str:
+        """利用日（構造化抽出の日付かレシート本文の日付、見つからなければ処理日）"""
+        text_data = results.get("phases", {}).get("image_processing", {}).get("steps", {}) \
+            .get("extract_text", {}).get("data", {})
+        receipt_date = results.get("metadata", {}).get("processed_at", "")[:10]
+        date_match = RECEIPT_DATE_PATTERN.search(text_data.get("receipt_date") or text_data.get("extracted_text", ""))
+        if date_match:
+            year, month, day = (int(part) for part in date_match.groups())
+            if 1 <= month <= 12 and 1 <= day <= 31:
+                receipt_date = f"{year:04d}-{month:02d}-{day:02d}"
+        return receipt_date
+    
+    def _expense_contributions(self, results: Dict[str, Any]) -> Tuple[Dict[str, Any], List[Tuple[str, str, float, float]]]:
+        """1件の処理結果から、レシート一覧の行と支出集計への寄与を計算"""
+        metadata = results.get("metadata", {})
+        phases = results.get("phases", {})
+        
+        text_data = phases.get("image_processing", {}).get("steps", {}) \
+            .get("extract_text", {}).get("data", {})
+        original_text = text_data.get("extracted_text", "")
+        conversions = phases.get("currency_conversion", {}).get("steps", {}) \
+            .get("convert_currency", {}).get("data", {}).get("conversions", [])
+        unique_conversions = self._unique_conversions(conversions)
+        receipt_date = self._receipt_date(results)
+        
+        # 店舗名は構造化抽出の店舗名、なければレシート本文の先頭行
+        merchant = text_data.get("merchant") \
+            or next((line.strip() for line in original_text.splitlines() if line.strip()), "")
+        merchant = merchant[:64] or "不明"
+        trip_id = metadata.get("trip_id") or results.get("trip_id") or UNASSIGNED_TRIP
+        
+        # 通貨ごとの合計
+        currency_totals: Dict[str, List[float]] = {}
+        for conv in unique_conversions:
+            totals = currency_totals.setdefault(conv["original_currency"], [0.0, 0.0])
+            totals[0] += conv["jpy_amount"]
+            totals[1] += conv["original_amount"]
+        
+        total_jpy = round(sum(totals[0] for totals in currency_totals.values()), 2)
+        main_currency = max(currency_totals, key=lambda c: currency_totals[c][0]) if currency_totals else None
+        status = "completed" if all(phase.get("status") == "completed" for phase in phases.values()) else "error"
+        
+        index_row = {
+            "receipt_id": metadata.get("receipt_id") or results.get("receipt_id"),
+            "processed_at": metadata.get("processed_at", ""),
+            "receipt_date": receipt_date,
+            "trip_id": trip_id,
+            "merchant": merchant,
+            "currency": main_currency,
+            "status": status,
+            "total_jpy": total_jpy
+        }
+        
+        contributions = [
+            ("all", "all", total_jpy, 0.0),
+            ("day", receipt_date, total_jpy, 0.0),
+            ("trip", trip_id, total_jpy, 0.0),
+            ("merchant", merchant, total_jpy, 0.0)
+        ]
+        contributions.extend(
+            ("currency", currency, round(totals[0], 2), round(totals[1], 2))
+            for currency, totals in currency_totals.items()
+        )
+        
+        return index_row, contributions
+    
+    def _write_expense_index(self):
+        """支出集計インデックスのJSONファイルを書き出す（集計済みの値を読むだけ）"""
         try:
-            # 最新の結果ファイルを検索
-            pattern = f"{receipt_id}_*.json"
-            result_files = list(self.output_dir.glob(pattern))
+            totals = self.store.get_expense_totals()
+            overall = totals.get("all", {}).get("all", {"total_jpy": 0, "receipt_count": 0})
+            
+            expense_index = {
+                "generated_at": datetime.now().isoformat(),
+                "total_jpy": overall["total_jpy"],
+                "receipt_count": overall["receipt_count"],
+                "by_day": totals.get("day", {}),
+                "by_trip": totals.get("trip", {}),
+                "by_currency": totals.get("currency", {}),
+                "by_merchant": totals.get("merchant", {})
+            }
             
-            if not result_files:
-                raise FileNotFoundError(f"結果ファイルが見つかりません: {receipt_id}")
+            atomic_write_json(self.expense_index_path, expense_index)
+            self.logger.info("支出集計インデックスを更新しました: %s", self.expense_index_path)
             
-            # 最新のファイルを取得
-            latest_file = max(result_files, key=lambda x: x.stat().st_mtime)
+        except Exception as e:
+            self.logger.error(f"支出集計インデックスの更新に失敗しました: {str(e)}")
+    
+    def rebuild_expense_index(self) -> Dict[str, Any]:
+        """結果ストアから支出集計インデックスを再構築（復旧用）"""
+        self.flush()
+        
+        with self.store.transaction() as conn:
+            self.store.clear_receipt_aggregates(conn)
+            for results in self.store.iter_results_by_time():
+                index_row, contributions = self._expense_contributions(results)
+                if index_row["receipt_id"]:
+                    self.store.update_receipt_aggregates(conn, index_row, contributions)
+        
+        self._write_expense_index()
+        return self.store.get_expense_totals().get("all", {}).get("all", {})
+    
+    def list_receipts(self, page: int = 1, per_page: int = 20, **filters: Any) -> Dict[str, Any]:
+        """レシート一覧をページ単位で取得（保存時に更新したインデックスから読む）"""
+        self.flush()
+        
+        page = max(page, 1)
+        per_page = min(max(per_page, 1), 100)
+        items, total = self.store.list_receipts(filters, limit=per_page, offset=(page - 1) * per_page)
+        
+        return {
+            "items": items,
+            "page": page,
+            "per_page": per_page,
+            "total": total,
+            "pages": (total + per_page - 1) // per_page
+        }
+    
+    def get_receipt(self, receipt_id: str) -> Optional[Dict[str, Any]]:
+        """レシート1件の一覧情報と最新の処理結果を取得（存在しない場合はNone）"""
+        self.flush()
+        
+        receipt = self.store.get_receipt(receipt_id)
+        results = self.store.load_latest(receipt_id)
+        if receipt is None and results is None:
+            return None
+        
+        return {"receipt": receipt, "results": results}
+    
+    def has_receipt(self, receipt_id: str) -> bool:
+        """最新の処理がすべてのフェーズを完了したレシートかどうか（書き込み待ちの結果は含まない）
+        
+        失敗したフェーズがあるレシートは False（アーカイブの再取り込みで処理し直す）。
+        """
+        receipt = self.store.get_receipt(receipt_id)
+        return receipt is not None and receipt["status"] == "completed"
+    
+    def load_results(self, receipt_id: str, processed_at: Optional[str] = None) -> Dict[str, Any]:
+        """保存された結果を読み込み（processed_at 省略時は最新、アーカイブ済みの結果も透過的に読む）"""
+        try:
+            self.flush()
+            
+            # 結果ストアから取得
+            if processed_at is None:
+                results = self.store.load_latest(receipt_id)
+            else:
+                results = self.store.load_run(receipt_id, processed_at)
+            if results is not None:
+                self.logger.info(f"結果を読み込みました: {receipt_id}")
+                return results
+            
+            # 未移行の結果ファイルを検索
+            if processed_at is None:
+                result_files = self._run_files(receipt_id).get(receipt_id, [])
+                if result_files:
+                    latest_file = max(result_files, key=lambda x: x.stat().st_mtime)
+                    
+                    with open(latest_file, 'r', encoding='utf-8') as f:
+                        results = json.load(f)
+                    
+                    self.logger.info(f"結果を読み込みました: {latest_file}")
+                    return results
             
-            with open(latest_file, 'r', encoding='utf-8') as f:
-                results = json.load(f)
+            # 圧縮アーカイブから取得
+            results = self.archive.load(receipt_id, processed_at)
+            if results is not None:
+                self.logger.info(f"アーカイブから結果を読み込みました: {receipt_id}")
+                return results
             
-            self.logger.info(f"結果を読み込みました: {latest_file}")
-            return results
+            raise FileNotFoundError(f"結果ファイルが見つかりません: {receipt_id}")
             
         except Exception as e:
             self.logger.error(f"結果読み込みに失敗しました: {str(e)}")
             raise
     
+    def _run_files(self, receipt_id: Optional[str] = None) -> Dict[str, List[Path]]:
+        """従来形式の結果ファイルをレシートIDごとに取得"""
+        pattern = f"{receipt_id}_*.json" if receipt_id else "*.json"
+        run_files: Dict[str, List[Path]] = {}
+        
+        for file_path in self.output_dir.glob(pattern):
+            match = RUN_FILE_PATTERN.match(file_path.name)
+            if match and (receipt_id is None or match.group("receipt_id") == receipt_id):
+                run_files.setdefault(match.group("receipt_id"), []).append(file_path)
+        
+        return run_files
+    
+    def compact_results(self, keep_latest: Optional[int] = None) -> Dict[str, int]:
+        """レシートごとに最新 keep_latest 件を残し、それより古い結果を圧縮アーカイブへ移動"""
+        keep_latest = self.keep_latest_runs if keep_latest is None else keep_latest
+        compacted = {"store_runs": 0, "json_files": 0}
+        
+        self.flush()
+        
+        # 結果ストア内の古い結果（アーカイブへの書き込み完了後に削除）
+        for receipt_id in self.store.receipts_exceeding(keep_latest):
+            superseded = self.store.superseded_runs(receipt_id, keep_latest)
+            self.archive.append(receipt_id, [results for _, results in superseded])
+            compacted["store_runs"] += self.store.delete_runs(
+                receipt_id, [processed_at for processed_at, _ in superseded]
+            )
+        
+        # 従来形式の結果ファイル（ファイル名のタイムスタンプ順）
+        for receipt_id, result_files in self._run_files().items():
+            superseded_files = sorted(result_files, key=lambda x: x.name, reverse=True)[keep_latest:]
+            if not superseded_files:
+                continue
+            
+            runs = []
+            for file_path in superseded_files:
+                with open(file_path, 'r', encoding='utf-8') as f:
+                    runs.append(json.load(f))
+            
+            self.archive.append(receipt_id, runs)
+            for file_path in superseded_files:
+                file_path.unlink()
+            compacted["json_files"] += len(superseded_files)
+        
+        self.logger.info(f"結果をコンパクションしました: {compacted}")
+        return compacted
+    
+    def migrate_json_results(self) -> int:
+        """出力ディレクトリの結果JSONファイルを結果ストアに取り込む"""
+        imported = self.store.import_json_dir(self.output_dir)
+        if imported:
+            self.rebuild_processing_stats()
+            self.rebuild_expense_index()
+        return imported
+    
+    def export_conversions(self, export_dir: Optional[str] = None) -> Dict[str, Any]:
+        """換算結果を平坦化して Parquet データセットに追記（利用日・通貨でパーティション分割）
+        
+        前回エクスポートした結果ストアの行IDを記録し、それ以降の結果だけを書き出す。
+        """
+        export_dir = Path(export_dir) if export_dir else self.export_dir
+        export_dir.mkdir(parents=True, exist_ok=True)
+        state_path = export_dir / "_export_state.json"
+        
+        self.flush()
+        
+        last_id = 0
+        if state_path.exists():
+            with open(state_path, 'r', encoding='utf-8') as f:
+                last_id = json.load(f).get("last_result_id", 0)
+        
+        rows = []
+        max_id = last_id
+        result_count = 0
+        for result_id, results in self.store.iter_results_since(last_id):
+            rows.extend(self._iter_conversion_rows(result_id, results))
+            max_id = result_id
+            result_count += 1
+        
+        if rows:
+            # 列の型は値から推定せず固定する（すべて None の列が null 型になりパーティション間で食い違うため）
+            schema = self._conversion_schema()
+            frame = pd.DataFrame(rows, columns=schema.names)
+            frame.to_parquet(
+                export_dir,
+                engine="pyarrow",
+                schema=schema,
+                partition_cols=["receipt_date", "original_currency"],
+                index=False,
+                basename_template=f"part-{last_id + 1}-{max_id}-{{i}}.parquet"
+            )
+        
+        if max_id != last_id:
+            atomic_write_json(state_path, {"last_result_id": max_id})
+        
+        exported = {"rows": len(rows), "results": result_count,
+                    "last_result_id": max_id, "export_dir": str(export_dir)}
+        self.logger.info(f"換算結果をエクスポートしました: {exported}")
+        return exported
+    
+    def _conversion_schema(self) -> pa.Schema:
+        """エクスポートする換算結果の列と型"""
+        return pa.schema(
+            [
+                ("result_id", pa.int64()),
+                ("receipt_id", pa.string()),
+                ("processed_at", pa.string()),
+                ("processed_date", pa.string()),
+                ("receipt_date", pa.string()),
+                ("detected_language", pa.string()),
+                ("original_amount", pa.float64()),
+                ("original_currency", pa.string()),
+                ("jpy_amount", pa.float64()),
+                ("exchange_rate", pa.float64()),
+                ("conversion_date", pa.string())
+            ]
+            + [(f"amount_{currency}", pa.float64()) for currency in self.display_currencies]
+        )
+    
+    def _iter_conversion_rows(self, result_id: int, results: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+        """1件の処理結果から換算結果の行を取り出す"""
+        phases = results.get("phases", {})
+        metadata = results.get("metadata", {})
+        processed_at = metadata.get("processed_at", "")
+        receipt_date = self._receipt_date(results)
+        
+        detected_language = phases.get("translation", {}).get("steps", {}) \
+            .get("detect_language", {}).get("data", {}).get("detected_language")
+        convert_step = phases.get("currency_conversion", {}).get("steps", {}).get("convert_currency", {})
+        
+        for conversion in convert_step.get("data", {}).get("conversions", []):
+            row = {
+                "result_id": result_id,
+                "receipt_id": metadata.get("receipt_id") or results.get("receipt_id"),
+                "processed_at": processed_at,
+                "processed_date": processed_at[:10],
+                "receipt_date": receipt_date,
+                "detected_language": detected_language,
+                "original_amount": float(conversion["original_amount"]),
+                "original_currency": conversion["original_currency"],
+                "jpy_amount": _optional_float(conversion["jpy_amount"]),
+                "exchange_rate": _optional_float(conversion["exchange_rate"]),
+                "conversion_date": conversion.get("conversion_date")
+            }
+            
+            # 表示通貨ごとの換算額は固定列にする（パーティション間でスキーマを揃える）
+            converted_amounts = conversion.get("converted_amounts", {})
+            for currency in self.display_currencies:
+                row[f"amount_{currency}"] = _optional_float(converted_amounts.get(currency))
+            
+            yield row
+    
+    def _stats_delta(self, results: Dict[str, Any]) -> Tuple[Dict[str, float], Optional[str]]:
+        """1件の処理結果による統計の増分を計算"""
+        all_successful = all(phase_data.get("status") == "completed"
+                             for phase_data in results.get("phases", {}).values())
+        
+        counters = {
+            "total_files": 1,
+            "successful_files": 1 if all_successful else 0,
+            "failed_files": 0 if all_successful else 1
+        }
+        
+        # 外部APIの呼び出し結果（サービス・結果ごと）、レート制限の待ち時間、処理終了時に開いていたブレーカー
+        resilience = results.get("resilience", {})
+        for service, outcomes in resilience.get("calls", {}).items():
+            for outcome, count in outcomes.items():
+                counters[f"{service}_{outcome}"] = count
+        for service, seconds in resilience.get("rate_limit_wait_seconds", {}).items():
+            counters[f"{service}_rate_limit_wait_seconds"] = seconds
+        for service, breaker in resilience.get("breakers", {}).items():
+            if breaker.get("state") != "closed":
+                counters[f"{service}_breaker_open_files"] = 1
+        if resilience.get("deadline_exceeded"):
+            counters["deadline_exceeded_files"] = 1
+        
+        processing_time = results.get("processing_time")
+        if processing_time is None:
+            return counters, None
+        
+        counters["timed_files"] = 1
+        counters["total_processing_time"] = processing_time
+        
+        latency_bucket = "+Inf"
+        for upper_bound in self.latency_buckets:
+            if processing_time <= upper_bound:
+                latency_bucket = str(upper_bound)
+                break
+        
+        return counters, latency_bucket
+    
+    def rebuild_processing_stats(self) -> Dict[str, Any]:
+        """結果ストアと圧縮アーカイブの全結果から統計を再構築（復旧用）
+        
+        コンパクションで移動した結果も数えるため、再構築しても過去の処理件数は減らない。
+        結果ストアとアーカイブの両方にある結果（レシートID・処理日時が同じもの）は1件として数える。
+        """
+        counters: Dict[str, float] = {}
+        histogram: Dict[str, int] = {}
+        seen = set()
+        
+        for results in itertools.chain(self.store.iter_results(), self.archive.iter_all_runs()):
+            metadata = results.get("metadata", {})
+            run_key = (metadata.get("receipt_id") or results.get("receipt_id"), metadata.get("processed_at", ""))
+            if run_key in seen:
+                continue
+            seen.add(run_key)
+            
+            delta, latency_bucket = self._stats_delta(results)
+            for name, value in delta.items():
+                counters[name] = counters.get(name, 0) + value
+            if latency_bucket is not None:
+                histogram[latency_bucket] = histogram.get(latency_bucket, 0) + 1
+        
+        self.store.replace_stats(counters, histogram)
+        self.logger.info(f"処理統計を再構築しました: {int(counters.get('total_files', 0))}件")
+        
+        return self.get_processing_stats()
+    
     def get_processing_stats(self) -> Dict[str, Any]:
-        """処理統計を取得"""
+        """処理統計を取得（保存時に加算済みの集計を読むだけで、結果件数に依存しない）"""
         try:
+            self.flush()
+            stored = self.store.get_stats()
+            counters = stored["counters"]
+            
             stats = {
-                "total_files": 0,
-                "successful_files": 0,
-                "failed_files": 0,
-                "total_processing_time": 0,
+                "total_files": int(counters.get("total_files", 0)),
+                "successful_files": int(counters.get("successful_files", 0)),
+                "failed_files": int(counters.get("failed_files", 0)),
+                "total_processing_time": round(counters.get("total_processing_time", 0), 3),
                 "average_processing_time": 0
             }
             
-            # 結果ファイルを検索
-            result_files = list(self.output_dir.glob("*.json"))
+            # 平均処理時間を計算（処理時間が記録されている結果のみ）
+            timed_files = counters.get("timed_files", 0)
+            if timed_files > 0:
+                stats["average_processing_time"] = round(counters["total_processing_time"] / timed_files, 3)
             
-            for file_path in result_files:
-                if file_path.name.endswith("_summary.json"):
-                    continue
-                
-                stats["total_files"] += 1
-                
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        result = json.load(f)
-                    
-                    # 処理時間を計算
-                    if "metadata" in result and "processed_at" in result["metadata"]:
-                        processed_at = datetime.fromisoformat(result["metadata"]["processed_at"])
-                        stats["total_processing_time"] += 1  # 簡易計算
-                    
-                    # 成功/失敗を判定
-                    all_successful = True
-                    for phase_data in result.get("phases", {}).values():
-                        if phase_data.get("status") != "completed":
-                            all_successful = False
-                            break
-                    
-                    if all_successful:
-                        stats["successful_files"] += 1
-                    else:
-                        stats["failed_files"] += 1
-                        
-                except Exception:
-                    stats["failed_files"] += 1
-            
-            # 平均処理時間を計算
-            if stats["total_files"] > 0:
-                stats["average_processing_time"] = stats["total_processing_time"] / stats["total_files"]
+            # ヒストグラムはバケット順に並べる
+            bucket_order = [str(upper_bound) for upper_bound in self.latency_buckets] + ["+Inf"]
+            stats["latency_histogram"] = {
+                bucket: stored["latency_histogram"].get(bucket, 0) for bucket in bucket_order
+            }
+            
+            # 外部APIの呼び出し結果・待ち時間（サービスごと）とレート制限の待ち時間の統計
+            base_counters = {"total_files", "successful_files", "failed_files", "timed_files", "total_processing_time"}
+            stats["external_apis"] = {
+                name: counters[name] for name in sorted(counters) if name not in base_counters
+            }
+            rate_limit_db = self.config.get("resilience", {}).get("rate_limit_db", "results/rate_limits.db")
+            stats["rate_limits"] = read_rate_limit_stats(rate_limit_db)
             
             return stats
             
         except Exception as e:
             self.logger.error(f"統計取得に失敗しました: {str(e)}")
             return {}
+
+def _optional_float(value: Any) -> Optional[float]:
+    """数値を float に変換（None はそのまま）"""
+    return float(value) if value is not None else None
@@ -0,0 +1,462 @@
+"""
+結果ストアモジュール（SQLite）
+"""
+
+import json
+import sqlite3
+import logging
+import threading
+from pathlib import Path
+from contextlib import contextmanager
+from datetime import datetime
+from typing import Dict, Any, List, Optional, Iterator, Tuple
+
+class ResultStore:
+    """SQLite（WALモード）による処理結果ストアクラス
+    
+    結果は receipt_id と処理日時でインデックスされ、最新結果の取得は
+    インデックス探索のみで完了する。接続はスレッドごとに保持し、
+    書き込みは BEGIN IMMEDIATE のトランザクションで直列化する。
+    """
+    
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS results (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            receipt_id TEXT NOT NULL,
+            processed_at TEXT NOT NULL,
+            payload TEXT NOT NULL
+        );
+        CREATE UNIQUE INDEX IF NOT EXISTS idx_results_receipt_time
+            ON results (receipt_id, processed_at);
+        CREATE TABLE IF NOT EXISTS stats_counters (
+            name TEXT PRIMARY KEY,
+            value REAL NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS latency_histogram (
+            bucket TEXT PRIMARY KEY,
+            count INTEGER NOT NULL DEFAULT 0
+        );
+        CREATE TABLE IF NOT EXISTS receipt_index (
+            receipt_id TEXT PRIMARY KEY,
+            processed_at TEXT NOT NULL,
+            receipt_date TEXT,
+            trip_id TEXT,
+            merchant TEXT,
+            currency TEXT,
+            status TEXT,
+            total_jpy REAL NOT NULL DEFAULT 0
+        );
+        CREATE INDEX IF NOT EXISTS idx_receipt_index_processed ON receipt_index (processed_at);
+        CREATE INDEX IF NOT EXISTS idx_receipt_index_date ON receipt_index (receipt_date, processed_at);
+        CREATE INDEX IF NOT EXISTS idx_receipt_index_currency ON receipt_index (currency, processed_at);
+        CREATE INDEX IF NOT EXISTS idx_receipt_index_status ON receipt_index (status, processed_at);
+        CREATE TABLE IF NOT EXISTS receipt_contributions (
+            receipt_id TEXT NOT NULL,
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            total_jpy REAL NOT NULL DEFAULT 0,
+            original_amount REAL NOT NULL DEFAULT 0,
+            PRIMARY KEY (receipt_id, dimension, key)
+        );
+        CREATE TABLE IF NOT EXISTS expense_totals (
+            dimension TEXT NOT NULL,
+            key TEXT NOT NULL,
+            total_jpy REAL NOT NULL DEFAULT 0,
+            original_amount REAL NOT NULL DEFAULT 0,
+            receipt_count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, key)
+        );
+        CREATE TABLE IF NOT EXISTS progress_events (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            receipt_id TEXT NOT NULL,
+            event TEXT NOT NULL,
+            payload TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_progress_events_receipt ON progress_events (receipt_id, id);
+        CREATE TABLE IF NOT EXISTS step_checkpoints (
+            content_hash TEXT NOT NULL,
+            step TEXT NOT NULL,
+            step_hash TEXT NOT NULL,
+            receipt_id TEXT NOT NULL,
+            payload TEXT NOT NULL,
+            created_at TEXT NOT NULL,
+            PRIMARY KEY (content_hash, step)
+        );
+        CREATE INDEX IF NOT EXISTS idx_step_checkpoints_step ON step_checkpoints (step);
+    """
+    
+    def __init__(self, db_path: str):
+        self.db_path = Path(db_path)
+        self.logger = logging.getLogger(__name__)
+        self._local = threading.local()
+        
+        self.db_path.parent.mkdir(parents=True, exist_ok=True)
+        self._connect().executescript(self.SCHEMA)
+    
+    def _connect(self) -> sqlite3.Connection:
+        """スレッドごとの接続を取得"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # isolation_level=None で自動コミットとし、トランザクションは明示的に開始する
+            conn = sqlite3.connect(str(self.db_path), timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=30000")
+            self._local.conn = conn
+        return conn
+    
+    @contextmanager
+    def transaction(self) -> Iterator[sqlite3.Connection]:
+        """書き込みトランザクション（プロセス間でも排他される）"""
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        else:
+            conn.execute("COMMIT")
+    
+    def save(self, receipt_id: str, processed_at: str, results: Dict[str, Any]) -> int:
+        """処理結果を1件保存し、行IDを返す"""
+        with self.transaction() as conn:
+            return self.insert_result(conn, receipt_id, processed_at, results)
+    
+    def insert_result(self, conn: sqlite3.Connection, receipt_id: str, processed_at: str,
+                      results: Dict[str, Any]) -> int:
+        """トランザクション内で処理結果を1件挿入"""
+        payload = json.dumps(results, ensure_ascii=False, separators=(",", ":"))
+        cursor = conn.execute(
+            "INSERT OR REPLACE INTO results (receipt_id, processed_at, payload) VALUES (?, ?, ?)",
+            (receipt_id, processed_at, payload)
+        )
+        return cursor.lastrowid
+    
+    def increment_stats(self, conn: sqlite3.Connection, counters: Dict[str, float],
+                        latency_bucket: Optional[str] = None):
+        """トランザクション内で統計カウンタとレイテンシヒストグラムを加算"""
+        conn.executemany(
+            "INSERT INTO stats_counters (name, value) VALUES (?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET value = value + excluded.value",
+            list(counters.items())
+        )
+        if latency_bucket is not None:
+            conn.execute(
+                "INSERT INTO latency_histogram (bucket, count) VALUES (?, 1) "
+                "ON CONFLICT(bucket) DO UPDATE SET count = count + 1",
+                (latency_bucket,)
+            )
+    
+    def get_stats(self) -> Dict[str, Any]:
+        """統計カウンタとレイテンシヒストグラムを取得"""
+        conn = self._connect()
+        counters = dict(conn.execute("SELECT name, value FROM stats_counters").fetchall())
+        histogram = dict(conn.execute("SELECT bucket, count FROM latency_histogram").fetchall())
+        return {"counters": counters, "latency_histogram": histogram}
+    
+    def replace_stats(self, counters: Dict[str, float], histogram: Dict[str, int]):
+        """統計を置き換える（再構築用）"""
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM stats_counters")
+            conn.execute("DELETE FROM latency_histogram")
+            conn.executemany("INSERT INTO stats_counters (name, value) VALUES (?, ?)", list(counters.items()))
+            conn.executemany("INSERT INTO latency_histogram (bucket, count) VALUES (?, ?)", list(histogram.items()))
+    
+    def update_receipt_aggregates(self, conn: sqlite3.Connection, index_row: Dict[str, Any],
+                                  contributions: List[Tuple[str, str, float, float]]):
+        """トランザクション内でレシートの集計への寄与を差し替える
+        
+        contributions は (集計軸, キー, 円換算額, 元通貨額) の一覧。同じレシートの
+        以前の寄与を差し引いてから新しい寄与を加算するため、再処理しても二重計上しない。
+        """
+        receipt_id = index_row["receipt_id"]
+        
+        previous = conn.execute(
+            "SELECT dimension, key, total_jpy, original_amount FROM receipt_contributions WHERE receipt_id = ?",
+            (receipt_id,)
+        ).fetchall()
+        conn.executemany(
+            "UPDATE expense_totals SET total_jpy = total_jpy - ?, original_amount = original_amount - ?, "
+            "receipt_count = receipt_count - 1 WHERE dimension = ? AND key = ?",
+            [(total_jpy, original_amount, dimension, key) for dimension, key, total_jpy, original_amount in previous]
+        )
+        conn.execute("DELETE FROM expense_totals WHERE receipt_count <= 0")
+        conn.execute("DELETE FROM receipt_contributions WHERE receipt_id = ?", (receipt_id,))
+        
+        conn.executemany(
+            "INSERT INTO receipt_contributions (receipt_id, dimension, key, total_jpy, original_amount) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(receipt_id, *contribution) for contribution in contributions]
+        )
+        conn.executemany(
+            "INSERT INTO expense_totals (dimension, key, total_jpy, original_amount, receipt_count) "
+            "VALUES (?, ?, ?, ?, 1) ON CONFLICT(dimension, key) DO UPDATE SET "
+            "total_jpy = total_jpy + excluded.total_jpy, original_amount = original_amount + excluded.original_amount, "
+            "receipt_count = receipt_count + 1",
+            contributions
+        )
+        
+        conn.execute(
+            "INSERT OR REPLACE INTO receipt_index "
+            "(receipt_id, processed_at, receipt_date, trip_id, merchant, currency, status, total_jpy) "
+            "VALUES (:receipt_id, :processed_at, :receipt_date, :trip_id, :merchant, :currency, :status, :total_jpy)",
+            index_row
+        )
+    
+    def clear_receipt_aggregates(self, conn: sqlite3.Connection):
+        """トランザクション内で集計インデックスを空にする（再構築用）"""
+        conn.execute("DELETE FROM receipt_index")
+        conn.execute("DELETE FROM receipt_contributions")
+        conn.execute("DELETE FROM expense_totals")
+    
+    # レシート一覧で絞り込みに使える列
+    RECEIPT_FILTER_COLUMNS = ("receipt_date", "trip_id", "currency", "status")
+    
+    def list_receipts(self, filters: Dict[str, Any], limit: int, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+        """レシート一覧を処理日時の新しい順に取得し、(行一覧, 該当件数) を返す
+        
+        filters のキーは RECEIPT_FILTER_COLUMNS のいずれかと、期間指定の
+        date_from / date_to（receipt_date の範囲）。
+        """
+        conditions = []
+        params: List[Any] = []
+        for column in self.RECEIPT_FILTER_COLUMNS:
+            if filters.get(column):
+                conditions.append(f"{column} = ?")
+                params.append(filters[column])
+        if filters.get("date_from"):
+            conditions.append("receipt_date >= ?")
+            params.append(filters["date_from"])
+        if filters.get("date_to"):
+            conditions.append("receipt_date <= ?")
+            params.append(filters["date_to"])
+        
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        conn = self._connect()
+        
+        total = conn.execute(f"SELECT COUNT(*) FROM receipt_index {where}", params).fetchone()[0]
+        cursor = conn.execute(
+            "SELECT receipt_id, processed_at, receipt_date, trip_id, merchant, currency, status, total_jpy "
+            f"FROM receipt_index {where} ORDER BY processed_at DESC, receipt_id LIMIT ? OFFSET ?",
+            [*params, limit, offset]
+        )
+        columns = [description[0] for description in cursor.description]
+        
+        return [dict(zip(columns, row)) for row in cursor.fetchall()], total
+    
+    def get_receipt(self, receipt_id: str) -> Optional[Dict[str, Any]]:
+        """レシート一覧の1行を取得"""
+        cursor = self._connect().execute(
+            "SELECT receipt_id, processed_at, receipt_date, trip_id, merchant, currency, status, total_jpy "
+            "FROM receipt_index WHERE receipt_id = ?",
+            (receipt_id,)
+        )
+        row = cursor.fetchone()
+        if row is None:
+            return None
+        return dict(zip([description[0] for description in cursor.description], row))
+    
+    def get_expense_totals(self) -> Dict[str, Dict[str, Dict[str, Any]]]:
+        """集計軸ごとの合計を取得"""
+        totals: Dict[str, Dict[str, Dict[str, Any]]] = {}
+        rows = self._connect().execute(
+            "SELECT dimension, key, total_jpy, original_amount, receipt_count FROM expense_totals "
+            "ORDER BY dimension, key"
+        ).fetchall()
+        
+        for dimension, key, total_jpy, original_amount, receipt_count in rows:
+            entry = {"total_jpy": round(total_jpy, 2), "receipt_count": receipt_count}
+            if dimension == "currency":
+                entry["original_amount"] = round(original_amount, 2)
+            totals.setdefault(dimension, {})[key] = entry
+        
+        return totals
+    
+    def iter_results_by_time(self) -> Iterator[Dict[str, Any]]:
+        """保存されているすべての処理結果を処理日時の古い順に返す"""
+        cursor = self._connect().execute("SELECT payload FROM results ORDER BY processed_at")
+        for (payload,) in cursor:
+            yield json.loads(payload)
+    
+    def iter_results_since(self, last_id: int) -> Iterator[Tuple[int, Dict[str, Any]]]:
+        """行IDが last_id より大きい処理結果を (行ID, 結果) で順に返す"""
+        cursor = self._connect().execute(
+            "SELECT id, payload FROM results WHERE id > ? ORDER BY id", (last_id,)
+        )
+        for result_id, payload in cursor:
+            yield result_id, json.loads(payload)
+    
+    def iter_results(self) -> Iterator[Dict[str, Any]]:
+        """保存されているすべての処理結果を順に返す"""
+        cursor = self._connect().execute("SELECT payload FROM results ORDER BY id")
+        for (payload,) in cursor:
+            yield json.loads(payload)
+    
+    def load_latest(self, receipt_id: str) -> Optional[Dict[str, Any]]:
+        """最新の処理結果を取得（存在しない場合はNone）"""
+        row = self._connect().execute(
+            "SELECT payload FROM results WHERE receipt_id = ? ORDER BY processed_at DESC LIMIT 1",
+            (receipt_id,)
+        ).fetchone()
+        
+        return json.loads(row[0]) if row else None
+    
+    def load_run(self, receipt_id: str, processed_at: str) -> Optional[Dict[str, Any]]:
+        """指定した処理日時の結果を取得（存在しない場合はNone）"""
+        row = self._connect().execute(
+            "SELECT payload FROM results WHERE receipt_id = ? AND processed_at = ?",
+            (receipt_id, processed_at)
+        ).fetchone()
+        
+        return json.loads(row[0]) if row else None
+    
+    def receipts_exceeding(self, keep_latest: int) -> List[str]:
+        """保存件数が keep_latest を超えているレシートIDの一覧"""
+        rows = self._connect().execute(
+            "SELECT receipt_id FROM results GROUP BY receipt_id HAVING COUNT(*) > ?",
+            (keep_latest,)
+        ).fetchall()
+        
+        return [row[0] for row in rows]
+    
+    def superseded_runs(self, receipt_id: str, keep_latest: int) -> List[Tuple[str, Dict[str, Any]]]:
+        """最新 keep_latest 件より古い処理結果を (処理日時, 結果) の一覧で取得"""
+        rows = self._connect().execute(
+            "SELECT processed_at, payload FROM results WHERE receipt_id = ? "
+            "ORDER BY processed_at DESC LIMIT -1 OFFSET ?",
+            (receipt_id, keep_latest)
+        ).fetchall()
+        
+        return [(processed_at, json.loads(payload)) for processed_at, payload in rows]
+    
+    def delete_runs(self, receipt_id: str, processed_at_list: List[str]) -> int:
+        """指定した処理日時の結果を削除"""
+        with self.transaction() as conn:
+            cursor = conn.executemany(
+                "DELETE FROM results WHERE receipt_id = ? AND processed_at = ?",
+                [(receipt_id, processed_at) for processed_at in processed_at_list]
+            )
+            return cursor.rowcount
+    
+    def list_runs(self, receipt_id: str) -> List[str]:
+        """レシートの処理日時一覧を新しい順に取得"""
+        rows = self._connect().execute(
+            "SELECT processed_at FROM results WHERE receipt_id = ? ORDER BY processed_at DESC",
+            (receipt_id,)
+        ).fetchall()
+        
+        return [row[0] for row in rows]
+    
+    def count(self) -> int:
+        """保存されている結果の件数"""
+        return self._connect().execute("SELECT COUNT(*) FROM results").fetchone()[0]
+    
+    def import_json_dir(self, directory: str) -> int:
+        """既存の結果JSONファイル（*_summary.json を除く）を取り込み、追加件数を返す"""
+        imported = 0
+        
+        with self.transaction() as conn:
+            for file_path in sorted(Path(directory).glob("*.json")):
+                if file_path.name.endswith("_summary.json"):
+                    continue
+                
+                try:
+                    with open(file_path, 'r', encoding='utf-8') as f:
+                        results = json.load(f)
+                except (OSError, ValueError) as e:
+                    self.logger.warning(f"結果ファイルを読み込めないためスキップします: {file_path} ({str(e)})")
+                    continue
+                
+                if not isinstance(results, dict) or "phases" not in results:
+                    continue
+                
+                metadata = results.get("metadata", {})
+                receipt_id = metadata.get("receipt_id") or results.get("receipt_id")
+                if not receipt_id:
+                    self.logger.warning(f"receipt_idが不明なためスキップします: {file_path}")
+                    continue
+                
+                processed_at = metadata.get("processed_at") or \
+                    datetime.fromtimestamp(file_path.stat().st_mtime).isoformat()
+                
+                cursor = conn.execute(
+                    "INSERT OR IGNORE INTO results (receipt_id, processed_at, payload) VALUES (?, ?, ?)",
+                    (receipt_id, processed_at, json.dumps(results, ensure_ascii=False, separators=(",", ":")))
+                )
+                imported += cursor.rowcount
+        
+        self.logger.info(f"結果ファイルを取り込みました: {imported}件")
+        return imported
+    
+    def append_progress_events(self, events: List[Tuple[str, str, Dict[str, Any], bool]]) -> List[int]:
+        """進捗イベント（receipt_id, イベント名, データ, reset）を順に1トランザクションで追加し、イベントIDを返す
+        
+        reset が True のイベントは、追加する前にそのレシートの過去のイベントを削除する。
+        """
+        event_ids = []
+        with self.transaction() as conn:
+            for receipt_id, event, data, reset in events:
+                if reset:
+                    conn.execute("DELETE FROM progress_events WHERE receipt_id = ?", (receipt_id,))
+                cursor = conn.execute(
+                    "INSERT INTO progress_events (receipt_id, event, payload) VALUES (?, ?, ?)",
+                    (receipt_id, event, json.dumps(data, ensure_ascii=False, separators=(",", ":")))
+                )
+                event_ids.append(cursor.lastrowid)
+        return event_ids
+    
+    def prune_progress_events(self, terminal_events: Tuple[str, ...], before: str) -> int:
+        """終了イベントの日時（payload の timestamp）が before より前のレシートの進捗イベントを削除"""
+        placeholders = ",".join("?" * len(terminal_events))
+        with self.transaction() as conn:
+            cursor = conn.execute(
+                "DELETE FROM progress_events WHERE receipt_id IN ("
+                f"SELECT receipt_id FROM progress_events WHERE event IN ({placeholders}) "
+                "AND json_extract(payload, '$.timestamp') < ?)",
+                (*terminal_events, before)
+            )
+            return cursor.rowcount
+    
+    def progress_events_since(self, receipt_id: str, last_id: int) -> List[Tuple[int, str, Dict[str, Any]]]:
+        """指定したイベントIDより後の進捗イベントを (ID, イベント名, データ) の一覧で取得"""
+        rows = self._connect().execute(
+            "SELECT id, event, payload FROM progress_events WHERE receipt_id = ? AND id > ? ORDER BY id",
+            (receipt_id, last_id)
+        ).fetchall()
+        return [(event_id, event, json.loads(payload)) for event_id, event, payload in rows]
+    
+    def load_checkpoint(self, content_hash: str, step: str, step_hash: str) -> Optional[Dict[str, Any]]:
+        """ステップのチェックポイントを取得（未保存・設定が異なる場合は None）"""
+        row = self._connect().execute(
+            "SELECT payload FROM step_checkpoints WHERE content_hash = ? AND step = ? AND step_hash = ?",
+            (content_hash, step, step_hash)
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+    
+    def save_checkpoint(self, content_hash: str, step: str, step_hash: str, receipt_id: str,
+                        checkpoint: Dict[str, Any]):
+        """ステップのチェックポイントを保存（同じ画像・ステップの既存のものは置き換える）"""
+        payload = json.dumps(checkpoint, ensure_ascii=False, separators=(",", ":"))
+        with self.transaction() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO step_checkpoints "
+                "(content_hash, step, step_hash, receipt_id, payload, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (content_hash, step, step_hash, receipt_id, payload, datetime.now().isoformat())
+            )
+    
+    def delete_checkpoints(self, steps: List[str]) -> int:
+        """指定したステップのチェックポイントを全レシート分削除し、削除件数を返す"""
+        if not steps:
+            return 0
+        placeholders = ",".join("?" * len(steps))
+        with self.transaction() as conn:
+            cursor = conn.execute(f"DELETE FROM step_checkpoints WHERE step IN ({placeholders})", steps)
+            return cursor.rowcount
+    
+    def close(self):
+        """現在のスレッドの接続を閉じる"""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,111 @@
+"""
+結果書き込みモジュール（アトミック書き込み・非同期ライター）
+"""
+
+import os
+import json
+import queue
+import atexit
+import logging
+import tempfile
+import threading
+from pathlib import Path
+from typing import Any, Callable, Optional
+
+def atomic_write_json(path: Path, data: Any, indent: Optional[int] = 2):
+    """一時ファイルに書き込んでから rename し、途中で中断されても壊れたJSONを残さない"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            json.dump(data, f, ensure_ascii=False, indent=indent)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except Exception:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+class AsyncResultWriter:
+    """バックグラウンドスレッドで書き込みを行うライタークラス
+    
+    書き込み処理は有界キューに積まれ、ライタースレッドがまとめて取り出して実行する。
+    同じ key を持つ処理（サマリーファイルなど）はバッチ内で最後のものだけを実行する。
+    キューが満杯の場合のみ submit が待機する（バックプレッシャー）。
+    """
+    
+    _STOP = object()
+    
+    def __init__(self, max_queue_size: int = 256, batch_size: int = 32):
+        self.logger = logging.getLogger(__name__)
+        self.batch_size = batch_size
+        self._queue = queue.Queue(maxsize=max_queue_size)
+        self._closed = False
+        self._lock = threading.Lock()
+        
+        self._thread = threading.Thread(target=self._run, name="result-writer", daemon=True)
+        self._thread.start()
+        
+        # 終了時に未書き込みの処理をフラッシュ
+        atexit.register(self.close)
+    
+    def submit(self, func: Callable[..., Any], *args: Any, key: Optional[str] = None):
+        """書き込み処理を登録（停止後はその場で実行する）
+        
+        停止の判定と登録はロック内で行い、close() が積む停止の印より後に登録されて失われないようにする。
+        """
+        with self._lock:
+            if not self._closed:
+                self._queue.put((key, func, args))
+                return
+        
+        func(*args)
+    
+    def flush(self):
+        """登録済みの書き込みがすべて完了するまで待機"""
+        if not self._closed:
+            self._queue.join()
+    
+    def close(self):
+        """未書き込みの処理をフラッシュしてライタースレッドを停止"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        
+        self._queue.put(self._STOP)
+        self._thread.join()
+    
+    def _run(self):
+        """ライタースレッド本体"""
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            
+            stop = any(item is self._STOP for item in batch)
+            self._process_batch([item for item in batch if item is not self._STOP])
+            
+            for _ in batch:
+                self._queue.task_done()
+            
+            if stop:
+                return
+    
+    def _process_batch(self, batch):
+        """バッチ内の書き込みを順に実行（同じ key は最後のもののみ）"""
+        last_index = {key: i for i, (key, _, _) in enumerate(batch) if key is not None}
+        
+        for i, (key, func, args) in enumerate(batch):
+            if key is not None and last_index[key] != i:
+                continue
+            
+            try:
+                func(*args)
+            except Exception as e:
+                self.logger.error(f"非同期書き込みに失敗しました: {str(e)}")
@@ -0,0 +1,121 @@
+"""
+処理ステップのチェックポイントモジュール（失敗・中断した処理を完了済みのステップから再開）
+"""
+
+import json
+import hashlib
+import logging
+from typing import Dict, Any, List, Optional
+
+from src.result_store import ResultStore
+
+# ステップ間で受け渡すデータのうち、チェックポイントに含めないもの
+EXCLUDED_CONTEXT_KEYS = ("receipt_id", "image_bytes")
+
+class ReceiptCheckpoints:
+    """レシート1件分のチェックポイント（先頭から連続して完了済みのステップのみ復元する）"""
+    
+    def __init__(self, store: ResultStore, receipt_id: str, content_hash: str, step_hashes: Dict[str, str]):
+        self.store = store
+        self.receipt_id = receipt_id
+        self.content_hash = content_hash
+        self.step_hashes = step_hashes
+        self.logger = logging.getLogger(__name__)
+        self.restored: List[str] = []
+        self.saved: List[str] = []
+        self._resuming = True
+        self._fallback_seen = False
+    
+    def restore(self, step_name: str) -> Optional[Dict[str, Any]]:
+        """完了済みのステップの出力（data・context）を取得
+        
+        一度でも実行したステップがあれば、それ以降は前回の出力を使わない
+        （前のステップの出力が変わっている可能性があるため）。
+        """
+        if not self._resuming or step_name not in self.step_hashes:
+            self._resuming = False
+            return None
+        
+        try:
+            checkpoint = self.store.load_checkpoint(self.content_hash, step_name, self.step_hashes[step_name])
+        except Exception as e:
+            self.logger.error(f"チェックポイントの読み込みエラー: {step_name}: {str(e)}")
+            checkpoint = None
+        
+        if checkpoint is None:
+            self._resuming = False
+            return None
+        self.restored.append(step_name)
+        return checkpoint
+    
+    def save(self, step_name: str, data: Any, context_updates: Dict[str, Any]):
+        """ステップの出力を保存
+        
+        ダミーデータ（is_dummy）や代替処理の結果（fallback: フォールバックレート、Gemini 失敗時の OCR 等）を
+        返したステップと、それ以降のステップの出力は保存しない（再実行時に外部APIを呼び直すため）。
+        """
+        if isinstance(data, dict) and (data.get("is_dummy") or data.get("fallback")):
+            self._fallback_seen = True
+        if self._fallback_seen or step_name not in self.step_hashes:
+            return
+        
+        context = {key: value for key, value in context_updates.items() if key not in EXCLUDED_CONTEXT_KEYS}
+        try:
+            self.store.save_checkpoint(self.content_hash, step_name, self.step_hashes[step_name],
+                                       self.receipt_id, {"data": data, "context": context})
+            self.saved.append(step_name)
+        except Exception as e:
+            self.logger.error(f"チェックポイントの保存エラー: {step_name}: {str(e)}")
+    
+    def summary(self) -> Dict[str, Any]:
+        """結果に記録する要約"""
+        return {
+            "content_hash": self.content_hash,
+            "restored_steps": self.restored,
+            "saved_steps": self.saved
+        }
+
+class StepCheckpoints:
+    """処理ステップの出力を結果ストアに保存し、再実行時に完了済みのステップを省略するクラス
+    
+    チェックポイントは画像内容のハッシュとステップ名で保存し、ステップ設定のハッシュが
+    一致する場合のみ使う。ステップ設定のハッシュは前のステップのハッシュを含めて連鎖させるため、
+    あるステップの設定を変えるとそれ以降のステップもすべて再実行される。
+    processing_flow 以外の設定（翻訳先言語・為替レート等）を変えた場合は invalidate_from で破棄する。
+    """
+    
+    def __init__(self, store: ResultStore):
+        self.store = store
+        self.logger = logging.getLogger(__name__)
+    
+    @staticmethod
+    def step_names(config: Dict[str, Any]) -> List[str]:
+        """処理フローのステップ名（実行順）"""
+        return [step["step"] for phase in config["processing_flow"] for step in phase["steps"]]
+    
+    @staticmethod
+    def step_hashes(config: Dict[str, Any]) -> Dict[str, str]:
+        """ステップ名 → 設定のハッシュ（前のステップのハッシュと処理モードを含む）"""
+        hashes = {}
+        previous = config.get("processing", {}).get("mode", "pipeline")
+        for phase in config["processing_flow"]:
+            for step in phase["steps"]:
+                settings = json.dumps({"phase": phase["phase"], "step": step}, sort_keys=True, ensure_ascii=False,
+                                      default=dict)
+                previous = hashlib.sha256(f"{previous}\n{settings}".encode('utf-8')).hexdigest()
+                hashes[step["step"]] = previous
+        return hashes
+    
+    def begin(self, receipt_id: str, content_hash: str, config: Dict[str, Any]) -> ReceiptCheckpoints:
+        """レシートのチェックポイントを開始"""
+        return ReceiptCheckpoints(self.store, receipt_id, content_hash, self.step_hashes(config))
+    
+    def invalidate_from(self, config: Dict[str, Any], step_name: str) -> int:
+        """指定したステップ以降のチェックポイントを全レシート分破棄し、件数を返す"""
+        names = self.step_names(config)
+        if step_name not in names:
+            raise ValueError(f"処理フローに存在しないステップです: {step_name}（{', '.join(names)}）")
+        
+        deleted = self.store.delete_checkpoints(names[names.index(step_name):])
+        self.logger.info(f"チェックポイントを破棄しました: {step_name} 以降 {deleted}件")
+        return deleted
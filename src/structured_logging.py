@@ -0,0 +1,116 @@
+"""
+ログ出力モジュール（キュー経由の非同期出力・JSON Lines 形式）
+"""
+
+import sys
+import copy
+import json
+import queue
+import atexit
+import logging
+import logging.handlers
+from datetime import datetime
+from typing import Any, Dict, Optional
+
+import colorlog
+
+# LogRecord の標準属性（これ以外は extra で渡された構造化フィールドとして出力する）
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord("", 0, "", 0, "", (), None))) | {"message", "asctime"}
+
+# --log-format に指定できる形式
+LOG_FORMATS = ("color", "json")
+
+COLOR_FORMAT = '%(log_color)s%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+LOG_COLORS = {
+    'DEBUG': 'cyan',
+    'INFO': 'green',
+    'WARNING': 'yellow',
+    'ERROR': 'red',
+    'CRITICAL': 'red,bg_white',
+}
+
+class JsonLinesFormatter(logging.Formatter):
+    """1レコードを1行のJSONに整形するフォーマッター（extra の項目もそのまま出力）"""
+    
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "time": datetime.fromtimestamp(record.created).astimezone().isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            "thread": record.threadName
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRIBUTES and not key.startswith("_"):
+                entry[key] = value
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry["stack"] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+class DeferredQueueHandler(logging.handlers.QueueHandler):
+    """レコードを整形せずにキューへ渡す QueueHandler
+    
+    標準の QueueHandler は呼び出し元スレッドでメッセージを整形するため、
+    %s の展開・例外の整形もリスナースレッド側で行うようにレコードの複製だけを渡す。
+    """
+    
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        return copy.copy(record)
+
+# 出力スレッド（configure_logging で use_queue が有効な場合）
+_listener: Optional[logging.handlers.QueueListener] = None
+
+def _build_handler(log_format: str, log_file: Optional[str]) -> logging.Handler:
+    """出力先のハンドラー（json は JSON Lines、それ以外は色付きのテキスト）"""
+    if log_file:
+        handler = logging.FileHandler(log_file, encoding='utf-8')
+    elif log_format == "json":
+        handler = logging.StreamHandler(sys.stderr)
+    else:
+        handler = colorlog.StreamHandler()
+    
+    if log_format == "json":
+        handler.setFormatter(JsonLinesFormatter())
+    elif log_file:
+        handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    else:
+        handler.setFormatter(colorlog.ColoredFormatter(COLOR_FORMAT, log_colors=LOG_COLORS))
+    return handler
+
+def configure_logging(level: str = "DEBUG", log_format: str = "color", log_file: Optional[str] = None,
+                      use_queue: bool = True) -> logging.Logger:
+    """ルートロガーを設定
+    
+    use_queue が有効な場合、各スレッドは上限のないキューにレコードを入れるだけで戻り、
+    整形と出力は QueueListener のスレッドが行う（処理スレッドが標準出力で待たされない）。
+    リスナーは終了時に停止し、残っているレコードを書き出す。
+    """
+    global _listener
+    stop_logging()
+    
+    root = logging.getLogger()
+    for existing in list(root.handlers):
+        root.removeHandler(existing)
+    root.setLevel(level.upper())
+    
+    handler = _build_handler(log_format, log_file)
+    if not use_queue:
+        root.addHandler(handler)
+        return root
+    
+    log_queue = queue.SimpleQueue()
+    _listener = logging.handlers.QueueListener(log_queue, handler, respect_handler_level=True)
+    _listener.start()
+    root.addHandler(DeferredQueueHandler(log_queue))
+    return root
+
+def stop_logging():
+    """リスナーを停止し、キューに残っているレコードを書き出す"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+atexit.register(stop_logging)
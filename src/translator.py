@@ -7,6 +7,11 @@ import logging
 from typing import Dict, Any, Optional
 import re
 
+from src.resilience import get_breaker, guarded_call, skip_reason, CircuitOpenError, DeadlineExceeded
+from src.metrics import FALLBACKS
+from src.rate_limiter import service_rate_limit, RateLimitExceeded
+from src.fake_services import FakeServiceBehavior, FakeTranslateClient, fake_settings
+
 # Google Cloud Translate API
 try:
     from google.cloud import translate
@@ -21,8 +26,22 @@ class Translator:
         self.config = config
         self.logger = logging.getLogger(__name__)
         
-        # Google Cloud Translate APIの初期化
-        if translate:
+        # 呼び出しタイムアウトとサーキットブレーカー（言語検出・翻訳で共有）
+        resilience_config = config.get("resilience", {})
+        self.translate_timeout = resilience_config.get("timeouts", {}).get("translate", 5)
+        self.translate_breaker = get_breaker("translate", resilience_config.get("breaker"))
+        self.translate_rate_limit = service_rate_limit(
+            config, "translate", config["google_apis"].get("translation", {}).get("rate_limit")
+        )
+        
+        # Google Cloud Translate APIの初期化（fakes.enabled の場合は負荷試験用の代替クライアント）
+        fake_translate = fake_settings(config, "translate")
+        if fake_translate is not None:
+            self.translate_client = FakeTranslateClient(
+                FakeServiceBehavior("translate", fake_translate), self._dummy_detect_language
+            )
+            self.logger.info("Translate APIの代替クライアントを使用します")
+        elif translate:
             try:
                 # 認証情報が設定されているかチェック
                 import os
@@ -40,68 +59,108 @@ class Translator:
     
     def detect_language(self, text: str) -> str:
         """テキストの言語を検出"""
+        return self.detect_language_result(text)["detected_language"]
+    
+    def detect_language_result(self, text: str) -> Dict[str, Any]:
+        """テキストの言語を検出（ダミー言語検出を使った場合は is_dummy が True）"""
         try:
             if not self.translate_client:
                 # ダミー言語検出（テスト用）
                 self.logger.warning("Google Cloud Translate APIが利用できないため、ダミー言語検出を使用します")
-                return self._dummy_detect_language(text)
+                FALLBACKS.inc(service="language_detection", reason="unavailable")
+                return self._dummy_language_result(text)
             
             # Google Cloud Translate APIで言語検出
             project_id = os.getenv("GOOGLE_CLOUD_PROJECT_ID", "your-project-id")
             location = "global"
             parent = f"projects/{project_id}/locations/{location}"
             
-            response = self.translate_client.detect_language(
-                request={
-                    "parent": parent,
-                    "content": text,
-                    "mime_type": "text/plain",
-                }
+            response = guarded_call(
+                self.translate_breaker,
+                lambda timeout: self.translate_client.detect_language(
+                    request={
+                        "parent": parent,
+                        "content": text,
+                        "mime_type": "text/plain",
+                    },
+                    timeout=timeout
+                ),
+                self.translate_timeout,
+                rate_limit=self.translate_rate_limit
             )
             
             detected_language = response.languages[0].language_code
             confidence = response.languages[0].confidence
             
-            self.logger.info(f"言語検出成功: {detected_language} (信頼度: {confidence:.2f})")
+            self.logger.info("言語検出成功: %s (信頼度: %.2f)", detected_language, confidence)
             
-            return detected_language
+            return {"detected_language": detected_language, "is_dummy": False}
             
+        except (CircuitOpenError, DeadlineExceeded, RateLimitExceeded) as e:
+            self.logger.warning("Translate APIを呼び出さずにダミー言語検出を使用します: %s", e)
+            FALLBACKS.inc(service="language_detection", reason=skip_reason(e))
+            return self._dummy_language_result(text)
         except Exception as e:
             self.logger.error(f"言語検出に失敗しました: {str(e)}")
-            return self._dummy_detect_language(text)
+            FALLBACKS.inc(service="language_detection", reason="error")
+            return self._dummy_language_result(text)
     
     def translate_text(self, text: str, target_language: str = "ja") -> str:
         """テキストを翻訳"""
+        return self.translate_text_result(text, target_language)["translated_text"]
+    
+    def translate_text_result(self, text: str, target_language: str = "ja") -> Dict[str, Any]:
+        """テキストを翻訳（ダミー翻訳を使った場合は is_dummy が True）"""
         try:
             if not self.translate_client:
                 # ダミー翻訳（テスト用）
                 self.logger.warning("Google Cloud Translate APIが利用できないため、ダミー翻訳を使用します")
-                return self._dummy_translate(text)
+                FALLBACKS.inc(service="translation", reason="unavailable")
+                return self._dummy_translation_result(text)
             
             # Google Cloud Translate APIで翻訳
             project_id = os.getenv("GOOGLE_CLOUD_PROJECT_ID", "your-project-id")
             location = "global"
             parent = f"projects/{project_id}/locations/{location}"
             
-            response = self.translate_client.translate_text(
-                request={
-                    "parent": parent,
-                    "contents": [text],
-                    "mime_type": "text/plain",
-                    "source_language_code": "auto",
-                    "target_language_code": target_language,
-                }
+            response = guarded_call(
+                self.translate_breaker,
+                lambda timeout: self.translate_client.translate_text(
+                    request={
+                        "parent": parent,
+                        "contents": [text],
+                        "mime_type": "text/plain",
+                        "source_language_code": "auto",
+                        "target_language_code": target_language,
+                    },
+                    timeout=timeout
+                ),
+                self.translate_timeout,
+                rate_limit=self.translate_rate_limit
             )
             
             translated_text = response.translations[0].translated_text
             
-            self.logger.info(f"翻訳成功: {len(text)}文字 → {len(translated_text)}文字")
+            self.logger.info("翻訳成功: %d文字 → %d文字", len(text), len(translated_text))
             
-            return translated_text
+            return {"translated_text": translated_text, "is_dummy": False}
             
+        except (CircuitOpenError, DeadlineExceeded, RateLimitExceeded) as e:
+            self.logger.warning("Translate APIを呼び出さずにダミー翻訳を使用します: %s", e)
+            FALLBACKS.inc(service="translation", reason=skip_reason(e))
+            return self._dummy_translation_result(text)
         except Exception as e:
             self.logger.error(f"翻訳に失敗しました: {str(e)}")
-            return self._dummy_translate(text)
+            FALLBACKS.inc(service="translation", reason="error")
+            return self._dummy_translation_result(text)
+    
+    def _dummy_language_result(self, text: str) -> Dict[str, Any]:
+        """ダミー言語検出の結果"""
+        return {"detected_language": self._dummy_detect_language(text), "is_dummy": True}
+    
+    def _dummy_translation_result(self, text: str) -> Dict[str, Any]:
+        """ダミー翻訳の結果"""
+        return {"translated_text": self._dummy_translate(text), "is_dummy": True}
     
     def _dummy_detect_language(self, text: str) -> str:
         """ダミー言語検出（テスト用）"""
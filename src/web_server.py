@@ -0,0 +1,501 @@
+"""
+Web UI サーバーモジュール（静的ファイル配信・JSON API・メトリクス）
+"""
+
+import io
+import os
+import re
+import gzip
+import json
+import shutil
+import logging
+import threading
+import http.server
+from collections import OrderedDict
+from email.utils import formatdate
+from urllib.parse import urlsplit, parse_qs, unquote
+from typing import Any, Dict, Optional, Tuple
+
+from src.receipt_upload import UploadError
+from src.metrics import REGISTRY, CONTENT_TYPE, CACHE_REQUESTS, JOBS, CIRCUIT_BREAKER_OPEN
+from src.resilience import breaker_states
+
+# JSON API のパス接頭辞
+API_PREFIX = "/api/"
+
+# Prometheus 形式のメトリクスのパス
+METRICS_PATH = "/metrics"
+
+# 満たせないRange（416 を返す）を表す値
+RANGE_NOT_SATISFIABLE = (-1, -1)
+
+class ReceiptRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """ETag・gzip・Cache-Control・Range に対応した静的ファイルハンドラ（/api/ 以下はJSON API）"""
+    
+    # 接続を再利用してページ読み込み時のリクエストをまとめる
+    protocol_version = "HTTP/1.1"
+    
+    # gzip圧縮するContent-Type（画像はすでに圧縮済みのため対象外）
+    GZIP_TYPES = {"application/json", "text/javascript", "application/javascript", "text/css", "text/html"}
+    GZIP_MIN_SIZE = 1024
+    
+    # ファイル名に内容ハッシュを含むアセット（例: app.3f2a1b9c.js）は長期キャッシュ
+    HASHED_ASSET_PATTERN = re.compile(r"\.[0-9a-f]{8,}\.[A-Za-z0-9]+$")
+    IMMUTABLE_CACHE_CONTROL = "public, max-age=31536000, immutable"
+    REVALIDATE_CACHE_CONTROL = "no-cache"
+    
+    # 静的ファイルとして配信するディレクトリと results/ 内のファイル（結果ストア等のDBは配信しない）
+    STATIC_DIRS = ("web_ui", "receipts")
+    RESULT_FILE_PATTERN = re.compile(r"^(?:.+_summary|expense_index)\.json$")
+    DEFAULT_PAGE = "/web_ui/"
+    
+    # gzip済みの内容をETagごとに保持（スレッド間で共有）
+    GZIP_CACHE_SIZE = 64
+    _gzip_cache: "OrderedDict[Tuple[str, str], bytes]" = OrderedDict()
+    _gzip_cache_lock = threading.Lock()
+    
+    def do_GET(self):
+        """GETリクエストを処理"""
+        path = urlsplit(self.path).path
+        if path.startswith(API_PREFIX):
+            self._handle_api()
+        elif path == METRICS_PATH:
+            self._send_metrics()
+        else:
+            super().do_GET()
+    
+    def do_POST(self):
+        """POSTリクエストを処理（画像アップロード）"""
+        if urlsplit(self.path).path.rstrip("/") == "/api/upload":
+            self._handle_upload()
+        else:
+            self.close_connection = True
+            self._send_json(http.HTTPStatus.NOT_FOUND, {"error": f"APIが見つかりません: {self.path}"})
+    
+    def _handle_upload(self):
+        """multipart で送られた画像を保存して処理ジョブを登録し、すぐに 202 を返す"""
+        uploader = getattr(self.server, "uploader", None)
+        job_queue = getattr(self.server, "job_queue", None)
+        if uploader is None or job_queue is None:
+            self.close_connection = True
+            self._send_json(http.HTTPStatus.SERVICE_UNAVAILABLE, {"error": "アップロードが利用できません"})
+            return
+        
+        content_length = self.headers.get("Content-Length")
+        if content_length is None or not content_length.isdigit():
+            self.close_connection = True
+            self._send_json(http.HTTPStatus.LENGTH_REQUIRED, {"error": "Content-Length を指定してください"})
+            return
+        
+        try:
+            uploads = uploader.receive(self.rfile, self.headers.get("Content-Type", ""), int(content_length))
+        except UploadError as e:
+            # 本文を読み切っていない可能性があるため接続は再利用しない
+            self.close_connection = True
+            self._send_json(e.status, {"error": str(e)})
+            return
+        except Exception as e:
+            logging.getLogger(__name__).error(f"アップロードの受信に失敗しました: {str(e)}")
+            self.close_connection = True
+            self._send_json(http.HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "サーバーエラーが発生しました"})
+            return
+        
+        if not uploads:
+            self._send_json(http.HTTPStatus.BAD_REQUEST, {"error": "画像ファイルが含まれていません"})
+            return
+        
+        # 同じ内容の画像は処理を完了していればジョブを登録しない（処理前に中断した・失敗した画像は登録し直す）
+        result_manager = getattr(self.server, "result_manager", None)
+        for upload in uploads:
+            processed = upload["duplicate"] and result_manager is not None and result_manager.has_receipt(upload["receipt_id"])
+            upload["job_id"] = None if processed else job_queue.enqueue(upload["receipt_id"], priority="interactive")
+        
+        self._send_json(http.HTTPStatus.ACCEPTED, {"uploads": uploads})
+    
+    def _handle_api(self):
+        """JSON API（結果管理モジュールのインデックスから応答する）"""
+        parsed = urlsplit(self.path)
+        route = parsed.path.rstrip("/")
+        query = {key: values[-1] for key, values in parse_qs(parsed.query).items()}
+        
+        result_manager = getattr(self.server, "result_manager", None)
+        if result_manager is None:
+            self._send_json(http.HTTPStatus.SERVICE_UNAVAILABLE, {"error": "結果ストアが利用できません"})
+            return
+        
+        if route == "/api/events":
+            self._stream_progress(result_manager, query, self.headers.get("Last-Event-ID"))
+            return
+        
+        try:
+            if route == "/api/receipts":
+                filters = {
+                    "receipt_date": query.get("date"),
+                    "date_from": query.get("date_from"),
+                    "date_to": query.get("date_to"),
+                    "currency": query.get("currency", "").upper() or None,
+                    "status": query.get("status"),
+                    "trip_id": query.get("trip")
+                }
+                listing = result_manager.list_receipts(
+                    page=int(query.get("page", 1)),
+                    per_page=int(query.get("per_page", 20)),
+                    **filters
+                )
+                self._send_json(http.HTTPStatus.OK, listing)
+            
+            elif route.startswith("/api/receipts/"):
+                receipt_id = unquote(route[len("/api/receipts/"):])
+                receipt = result_manager.get_receipt(receipt_id)
+                if receipt is None:
+                    self._send_json(http.HTTPStatus.NOT_FOUND, {"error": f"レシートが見つかりません: {receipt_id}"})
+                else:
+                    self._send_json(http.HTTPStatus.OK, receipt)
+            
+            elif route == "/api/jobs":
+                job_queue = getattr(self.server, "job_queue", None)
+                if job_queue is None:
+                    self._send_json(http.HTTPStatus.SERVICE_UNAVAILABLE, {"error": "ジョブキューが利用できません"})
+                else:
+                    self._send_json(http.HTTPStatus.OK, {
+                        "counts": job_queue.count_by_status(),
+                        "jobs": job_queue.list_jobs(status=query.get("status"), limit=int(query.get("limit", 50)))
+                    })
+            
+            elif route.startswith("/api/jobs/"):
+                job_queue = getattr(self.server, "job_queue", None)
+                job_id = route[len("/api/jobs/"):]
+                job = job_queue.get_job(job_id) if job_queue else None
+                if job is None:
+                    self._send_json(http.HTTPStatus.NOT_FOUND, {"error": f"ジョブが見つかりません: {job_id}"})
+                else:
+                    self._send_json(http.HTTPStatus.OK, job)
+            
+            elif route == "/api/stats":
+                self._send_json(http.HTTPStatus.OK, result_manager.get_processing_stats())
+            
+            else:
+                self._send_json(http.HTTPStatus.NOT_FOUND, {"error": f"APIが見つかりません: {parsed.path}"})
+        
+        except ValueError as e:
+            self._send_json(http.HTTPStatus.BAD_REQUEST, {"error": f"パラメータが不正です: {str(e)}"})
+        except Exception as e:
+            logging.getLogger(__name__).error(f"APIの処理に失敗しました: {str(e)}")
+            self._send_json(http.HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "サーバーエラーが発生しました"})
+    
+    def _send_metrics(self):
+        """メトリクスを Prometheus テキスト形式で送信（ジョブ数・ブレーカーの状態は取得時点の値）"""
+        try:
+            job_queue = getattr(self.server, "job_queue", None)
+            if job_queue is not None:
+                counts = job_queue.count_by_status()
+                for status in (*job_queue.ACTIVE_STATUSES, "completed", "failed", *counts):
+                    JOBS.set(counts.get(status, 0), status=status)
+            for service, breaker in breaker_states().items():
+                CIRCUIT_BREAKER_OPEN.set(0 if breaker["state"] == "closed" else 1, service=service)
+            body = REGISTRY.render().encode('utf-8')
+        except Exception as e:
+            logging.getLogger(__name__).error(f"メトリクスの出力に失敗しました: {str(e)}")
+            self._send_json(http.HTTPStatus.INTERNAL_SERVER_ERROR, {"error": "サーバーエラーが発生しました"})
+            return
+        
+        self.send_response(http.HTTPStatus.OK)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def _stream_progress(self, result_manager, query: Dict[str, str], last_event_id: Optional[str]):
+        """処理進捗を Server-Sent Events で配信（処理完了まで接続を保持する）"""
+        receipt_id = query.get("receipt_id")
+        if not receipt_id:
+            self._send_json(http.HTTPStatus.BAD_REQUEST, {"error": "receipt_id を指定してください"})
+            return
+        
+        # 再接続時は EventSource が送る Last-Event-ID の続きから配信する
+        try:
+            last_id = int(last_event_id or query.get("last_event_id", 0))
+        except ValueError:
+            last_id = 0
+        
+        # 本文の長さが決まらないため、配信後は接続を閉じる
+        self.close_connection = True
+        self.send_response(http.HTTPStatus.OK)
+        self.send_header("Content-Type", "text/event-stream; charset=utf-8")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        self.send_header("X-Accel-Buffering", "no")
+        self.end_headers()
+        
+        broker = result_manager.progress
+        keepalive = result_manager.progress_keepalive
+        try:
+            self.wfile.write(b"retry: 3000\n\n")
+            self.wfile.flush()
+            while True:
+                events = broker.wait_for_events(receipt_id, last_id, timeout=keepalive)
+                if not events:
+                    # プロキシ等に切断されないようコメント行を送る（切断もここで検出される）
+                    self.wfile.write(b": keepalive\n\n")
+                    self.wfile.flush()
+                    continue
+                
+                finished = False
+                for event_id, event, data in events:
+                    message = json.dumps(data, ensure_ascii=False, separators=(",", ":"))
+                    self.wfile.write(f"id: {event_id}\nevent: {event}\ndata: {message}\n\n".encode('utf-8'))
+                    last_id = event_id
+                    finished = finished or event in broker.TERMINAL_EVENTS
+                self.wfile.flush()
+                
+                if finished:
+                    return
+        except (BrokenPipeError, ConnectionResetError):
+            # ブラウザ側でページが閉じられた
+            return
+    
+    def _send_json(self, status: int, data: Dict[str, Any]):
+        """JSONレスポンスを送信（クライアントが対応していればgzip圧縮）"""
+        body = json.dumps(data, ensure_ascii=False).encode('utf-8')
+        content_type = "application/json"
+        use_gzip = self._accepts_gzip(content_type, len(body))
+        if use_gzip:
+            body = gzip.compress(body, compresslevel=6)
+        
+        self.send_response(status)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("Cache-Control", self.REVALIDATE_CACHE_CONTROL)
+        if use_gzip:
+            self.send_header("Content-Encoding", "gzip")
+            self.send_header("Vary", "Accept-Encoding")
+        self.end_headers()
+        self.wfile.write(body)
+    
+    def send_head(self):
+        """レスポンスヘッダーを送信し、本文を読み出すファイルオブジェクトを返す"""
+        self._send_length = None
+        path = self.translate_path(self.path)
+        
+        if urlsplit(self.path).path == "/":
+            self.send_response(http.HTTPStatus.FOUND)
+            self.send_header("Location", self.DEFAULT_PAGE)
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        
+        if not self._is_public(path):
+            self.send_error(http.HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        
+        # ディレクトリ（index.html・一覧表示）は標準の処理に任せる
+        if os.path.isdir(path):
+            return super().send_head()
+        
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            self.send_error(http.HTTPStatus.NOT_FOUND, "File not found")
+            return None
+        
+        try:
+            stat = os.fstat(f.fileno())
+            content_type = self.guess_type(path)
+            etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+            use_gzip = self._accepts_gzip(content_type, stat.st_size)
+            if use_gzip:
+                etag = etag[:-1] + '-gz"'
+            
+            # 条件付きGET（If-None-Match）
+            if self._etag_matches(etag):
+                f.close()
+                self.send_response(http.HTTPStatus.NOT_MODIFIED)
+                self._send_cache_headers(path, etag)
+                self.end_headers()
+                return None
+            
+            # 画像の部分取得（Range、If-Range が一致しない・解釈できない場合は全体を返す）
+            range_header = self.headers.get("Range")
+            if range_header and content_type.startswith("image/") and self._if_range_matches(etag, stat):
+                byte_range = self._parse_range(range_header, stat.st_size)
+                if byte_range is not None:
+                    return self._send_range(f, byte_range, content_type, stat, path, etag)
+            
+            if use_gzip:
+                body = self._gzip_body(path, etag, f)
+                f.close()
+                self.send_response(http.HTTPStatus.OK)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Encoding", "gzip")
+                self.send_header("Content-Length", str(len(body)))
+                self.send_header("Vary", "Accept-Encoding")
+                self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+                self._send_cache_headers(path, etag)
+                self.end_headers()
+                return io.BytesIO(body)
+            
+            self.send_response(http.HTTPStatus.OK)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(stat.st_size))
+            self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+            if content_type.startswith("image/"):
+                self.send_header("Accept-Ranges", "bytes")
+            self._send_cache_headers(path, etag)
+            self.end_headers()
+            return f
+        
+        except Exception:
+            f.close()
+            raise
+    
+    def _is_public(self, path: str) -> bool:
+        """配信してよいパスかどうか（web_ui/・receipts/ 以下と results/ のサマリー・支出集計のみ）
+        
+        プロジェクトルートには結果ストア・ジョブキュー等の SQLite ファイル（*.db・-wal・-shm）や
+        設定ファイルがあるため、それ以外は存在しても 404 を返す。
+        """
+        relative = os.path.relpath(path, self.directory)
+        parts = relative.replace(os.sep, "/").split("/")
+        if parts[0] == ".." or any(".db" in part for part in parts):
+            return False
+        if parts[0] == "web_ui":
+            return True
+        if parts[0] in self.STATIC_DIRS:
+            # 画像ディレクトリの一覧は返さない
+            return len(parts) > 1 and not os.path.isdir(path)
+        return len(parts) == 2 and parts[0] == "results" and bool(self.RESULT_FILE_PATTERN.match(parts[1]))
+    
+    def copyfile(self, source, outputfile):
+        """本文を送信（Range指定時は指定バイト数のみ）"""
+        if self._send_length is None:
+            shutil.copyfileobj(source, outputfile)
+            return
+        
+        remaining = self._send_length
+        while remaining > 0:
+            chunk = source.read(min(64 * 1024, remaining))
+            if not chunk:
+                break
+            outputfile.write(chunk)
+            remaining -= len(chunk)
+    
+    def _accepts_gzip(self, content_type: str, size: int) -> bool:
+        """gzip圧縮して返すかどうか"""
+        if content_type.split(";")[0] not in self.GZIP_TYPES or size < self.GZIP_MIN_SIZE:
+            return False
+        accept_encoding = self.headers.get("Accept-Encoding", "")
+        return any(encoding.split(";")[0].strip() == "gzip" for encoding in accept_encoding.split(","))
+    
+    def _etag_matches(self, etag: str) -> bool:
+        """If-None-Match がETagと一致するかどうか（弱いETagも同一とみなす）"""
+        if_none_match = self.headers.get("If-None-Match")
+        if not if_none_match:
+            return False
+        if if_none_match.strip() == "*":
+            return True
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        return any(tag == etag or tag == f"W/{etag}" for tag in candidates)
+    
+    def _send_cache_headers(self, path: str, etag: str):
+        """ETag・Cache-Control ヘッダーを送信"""
+        self.send_header("ETag", etag)
+        if self.HASHED_ASSET_PATTERN.search(os.path.basename(path)):
+            self.send_header("Cache-Control", self.IMMUTABLE_CACHE_CONTROL)
+        else:
+            self.send_header("Cache-Control", self.REVALIDATE_CACHE_CONTROL)
+    
+    def _gzip_body(self, path: str, etag: str, f) -> bytes:
+        """gzip圧縮した本文を取得（同じETagの内容は再圧縮しない）"""
+        key = (path, etag)
+        with self._gzip_cache_lock:
+            body = self._gzip_cache.get(key)
+            if body is not None:
+                self._gzip_cache.move_to_end(key)
+                CACHE_REQUESTS.inc(cache="gzip", result="hit")
+                return body
+        CACHE_REQUESTS.inc(cache="gzip", result="miss")
+        
+        body = gzip.compress(f.read(), compresslevel=6)
+        
+        with self._gzip_cache_lock:
+            self._gzip_cache[key] = body
+            while len(self._gzip_cache) > self.GZIP_CACHE_SIZE:
+                self._gzip_cache.popitem(last=False)
+        return body
+    
+    def _if_range_matches(self, etag: str, stat) -> bool:
+        """If-Range がないか、現在のETag・Last-Modified と一致するかどうか"""
+        if_range = self.headers.get("If-Range")
+        if not if_range:
+            return True
+        if_range = if_range.strip()
+        if if_range.startswith('"') or if_range.startswith("W/"):
+            # 弱いETagでは部分取得しない
+            return if_range == etag
+        return if_range == formatdate(stat.st_mtime, usegmt=True)
+    
+    def _send_range(self, f, byte_range: Tuple[int, int], content_type: str, stat, path: str, etag: str):
+        """単一のバイト範囲（bytes=start-end）を 206 で返す（満たせない場合は 416）"""
+        if byte_range == RANGE_NOT_SATISFIABLE:
+            f.close()
+            self.send_response(http.HTTPStatus.REQUESTED_RANGE_NOT_SATISFIABLE)
+            self.send_header("Content-Range", f"bytes */{stat.st_size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return None
+        
+        start, end = byte_range
+        f.seek(start)
+        self._send_length = end - start + 1
+        
+        self.send_response(http.HTTPStatus.PARTIAL_CONTENT)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Range", f"bytes {start}-{end}/{stat.st_size}")
+        self.send_header("Content-Length", str(self._send_length))
+        self.send_header("Accept-Ranges", "bytes")
+        self.send_header("Last-Modified", formatdate(stat.st_mtime, usegmt=True))
+        self._send_cache_headers(path, etag)
+        self.end_headers()
+        return f
+    
+    @staticmethod
+    def _parse_range(range_header: str, size: int) -> Optional[Tuple[int, int]]:
+        """Rangeヘッダーを解析（単一範囲のみ対応）
+        
+        複数範囲・不正な形式は None（Rangeを無視して全体を返す）、
+        ファイルサイズを超える範囲は RANGE_NOT_SATISFIABLE を返す。
+        """
+        match = re.fullmatch(r"\s*bytes=(\d*)-(\d*)\s*", range_header)
+        if not match:
+            return None
+        
+        start_text, end_text = match.groups()
+        if start_text:
+            start = int(start_text)
+            if end_text and int(end_text) < start:
+                return None
+            if start >= size:
+                return RANGE_NOT_SATISFIABLE
+            end = min(int(end_text), size - 1) if end_text else size - 1
+        elif end_text:
+            # 末尾から指定バイト数（bytes=-500）
+            if int(end_text) == 0 or size == 0:
+                return RANGE_NOT_SATISFIABLE
+            start = max(size - int(end_text), 0)
+            end = size - 1
+        else:
+            return None
+        return start, end
+
+class ReceiptWebServer(http.server.ThreadingHTTPServer):
+    """リクエストごとにスレッドで処理するWebサーバー"""
+    
+    daemon_threads = True
+    allow_reuse_address = True
+    
+    def __init__(self, server_address, handler_class, result_manager=None, uploader=None, job_queue=None):
+        super().__init__(server_address, handler_class)
+        self.result_manager = result_manager
+        self.uploader = uploader
+        self.job_queue = job_queue
@@ -4,15 +4,22 @@ Web UI サーバー起動スクリプト
 海外支出ガイド MVP の結果をWebブラウザで表示するためのローカルサーバー
 """
 
-import http.server
-import socketserver
 import webbrowser
 import os
 import sys
+import logging
 from pathlib import Path
 
-def start_web_server(port=8000):
-    """Webサーバーを起動"""
+from src.config_manager import ConfigManager
+from src.result_manager import ResultManager
+from src.receipt_upload import ReceiptUploader
+from src.job_queue import JobQueue, WorkerPool
+from src.web_server import ReceiptRequestHandler, ReceiptWebServer
+from src.structured_logging import configure_logging
+from main import create_receipt_processor
+
+def start_web_server(port=8000, host="127.0.0.1"):
+    """Webサーバーを起動（既定ではこのマシンからの接続のみ受け付ける）"""
     
     # プロジェクトルートディレクトリを取得
     project_root = Path(__file__).parent.absolute()
@@ -35,22 +42,43 @@ def start_web_server(port=8000):
     os.chdir(project_root)
     print(f"🔍 作業ディレクトリを変更: {os.getcwd()}")
     
-    # HTTPサーバーを設定
-    handler = http.server.SimpleHTTPRequestHandler
+    # HTTPサーバーを設定（リクエストごとにスレッドで処理、ETag・gzip・Range対応）
+    handler = ReceiptRequestHandler
+    
+    # JSON API（/api/receipts, /api/receipts/<id>, /api/stats）用の結果管理モジュール
+    config_manager = ConfigManager("config.yaml")
+    config = config_manager.get_config()
+    result_manager = ResultManager(config)
+    
+    # 画像アップロード（/api/upload）と処理ジョブキュー（/api/jobs）
+    # server_workers を 0 にすると、処理は別プロセスの python main.py --worker に任せる
+    uploader = ReceiptUploader(config)
+    job_queue = JobQueue(config)
+    pool = WorkerPool(
+        job_queue,
+        create_receipt_processor(config_manager, result_manager, logging.getLogger("receipt_worker")),
+        workers=config.get("jobs", {}).get("server_workers", 1),
+        poll_interval=config.get("jobs", {}).get("poll_interval", 1.0)
+    )
     
     try:
-        with socketserver.TCPServer(("", port), handler) as httpd:
+        # 起動に失敗した場合（ポート使用中など）・停止した場合もワーカーを止めてから終了する
+        pool.start()
+        with ReceiptWebServer((host, port), handler, result_manager=result_manager,
+                              uploader=uploader, job_queue=job_queue) as httpd:
             print("🌍 海外支出ガイド MVP Web UI サーバー")
             print("=" * 50)
-            print(f"📡 サーバー起動: http://localhost:{port}")
+            print(f"📡 サーバー起動: http://localhost:{port}（待ち受け: {host or '全インターフェース'}）")
             print(f"📁 ディレクトリ: {web_ui_dir}")
+            print(f"🔌 API: http://localhost:{port}/api/receipts")
+            print(f"📤 アップロード: POST http://localhost:{port}/api/upload")
             print("=" * 50)
             print("🚀 ブラウザで自動的に開きます...")
             print("⏹️  停止するには Ctrl+C を押してください")
             print()
             
             # ブラウザで自動的に開く
-            webbrowser.open(f"http://localhost:{port}")
+            webbrowser.open(f"http://localhost:{port}/web_ui/")
             
             # サーバーを開始
             httpd.serve_forever()
@@ -65,23 +93,31 @@ def start_web_server(port=8000):
     except KeyboardInterrupt:
         print("\n⏹️  サーバーを停止しました")
         return True
+    finally:
+        pool.stop()
 
 def main():
     """メイン関数"""
     port = 8000
+    host = "127.0.0.1"
     
-    # コマンドライン引数でポートを指定可能
+    # コマンドライン引数でポートと待ち受けアドレスを指定可能（他の端末から使う場合は 0.0.0.0）
+    if len(sys.argv) > 2:
+        host = sys.argv[2]
     if len(sys.argv) > 1:
         try:
             port = int(sys.argv[1])
         except ValueError:
             print("❌ ポート番号は数値で指定してください")
-            print("   例: python start_web_server.py 8080")
+            print("   例: python start_web_server.py 8080 [0.0.0.0]")
             return
     
     print("🌍 海外支出ガイド MVP Web UI")
     print("=" * 30)
     
+    # サーバー内ワーカーの警告・エラーは別スレッドから出力する（リクエスト処理を待たせない）
+    configure_logging(level="WARNING")
+    
     # 必要なファイルの存在確認
     required_files = [
         "web_ui/index.html",
@@ -118,7 +154,7 @@ def main():
     print()
     
     # サーバーを起動
-    start_web_server(port)
+    start_web_server(port, host)
 
 if __name__ == "__main__":
     main()
@@ -6,27 +6,88 @@
 import os
 import sys
 import json
+import time
+import shutil
+import hashlib
+import logging
+import gzip
+import zipfile
+import argparse
+import tempfile
+import threading
 from pathlib import Path
+from datetime import datetime
+from typing import Dict, Any, Optional
 
 # プロジェクトのルートディレクトリをパスに追加
 sys.path.append(str(Path(__file__).parent))
 
-from src.config_manager import ConfigManager
+from src.config_manager import ConfigManager, thaw_config
 from src.image_processor import ImageProcessor
 from src.translator import Translator
 from src.currency_converter import CurrencyConverter
 from src.result_manager import ResultManager
+from src.gemini_extractor import create_gemini_extractor
+from src.fake_services import SAMPLE_RECEIPT_TEXTS, FakeServiceBehavior, FakeRatesServer
+from src.receipt_corpus import ReceiptCorpusGenerator
+from src.rate_limiter import RateLimiter, ServiceRateLimit, RateLimitExceeded, read_rate_limit_stats
+from src.resilience import CircuitBreaker, CircuitOpenError, deadline_budget, guarded_call
+from src.job_queue import JobQueue, WorkerPool
+from src.result_store import ResultStore
+from src.progress_broker import ProgressBroker
+from src.receipt_upload import ReceiptUploader, UploadError
+from src.profiler import StepProfiler
+from src.structured_logging import JsonLinesFormatter, configure_logging, stop_logging
+from src.web_server import ReceiptRequestHandler, ReceiptWebServer
+from main import process_receipt, import_archive
+
+def _isolated_config(work_dir: Path, fakes: Optional[Dict[str, Dict[str, Any]]] = None) -> Dict[str, Any]:
+    """出力先をすべて work_dir に向けた変更可能な設定（fakes を渡すと代替サービスを有効化）
+    
+    fakes はサービス名 → 上書きする代替設定（error_rate 等）。代替サービスのレイテンシは1ミリ秒程度にし、
+    外部APIのレート制限は外す。
+    """
+    config = thaw_config(ConfigManager("config.yaml").get_config())
+    # 為替レートAPIは接続できないURLにしてフォールバックレートを使う（必要なテストは代替サーバーを起動する）
+    config["currency"]["api_url"] = "http://127.0.0.1:9/"
+    output = config["output"]
+    output["output_dir"] = str(work_dir)
+    output["store_path"] = str(work_dir / "results.db")
+    output["progress"]["db_path"] = str(work_dir / "progress.db")
+    output["expense_index_file"] = str(work_dir / "expense_index.json")
+    output["retention"]["archive_dir"] = str(work_dir / "archive")
+    output["export"]["conversions_dir"] = str(work_dir / "analytics" / "conversions")
+    output["async_writes"] = False
+    config["resilience"]["rate_limit_db"] = str(work_dir / "rate_limits.db")
+    config["resilience"]["breaker"]["failure_threshold"] = 1000
+    config["jobs"]["db_path"] = str(work_dir / "jobs.db")
+    config["image_index"]["path"] = str(work_dir / "image_index.json")
+    config["profiling"]["output_dir"] = str(work_dir / "profiles")
+    
+    if fakes is not None:
+        config["fakes"]["enabled"] = True
+        for service in ("vision", "translate", "gemini", "rates"):
+            settings = config["fakes"][service]
+            settings.update({"latency": {"median_ms": 1, "p99_ms": 2}, "error_rate": 0.0})
+            settings.update(fakes.get(service, {}))
+        for api_config in config["google_apis"].values():
+            api_config.pop("rate_limit", None)
+        config["currency"].pop("rate_limit", None)
+    return config
 
 def test_system():
     """システム全体の動作確認"""
     print("🧪 海外支出ガイド MVP システムテスト")
     print("=" * 50)
     
+    # 結果・支出集計の出力先は一時ディレクトリにする（リポジトリの results/ を書き換えない）
+    work_dir = Path(tempfile.mkdtemp(prefix="system_test_"))
     try:
         # 1. 設定ファイルの読み込みテスト
         print("1. 設定ファイルの読み込み...")
         config_manager = ConfigManager("config.yaml")
-        config = config_manager.load_config()
+        config_manager.get_config()
+        config = _isolated_config(work_dir)
         print("   ✅ 設定ファイル読み込み成功")
         
         # 2. 各モジュールの初期化テスト
@@ -115,6 +176,7 @@ def test_system():
         
         # 結果を保存
         result_manager.save_results(test_results, receipt_id)
+        result_manager.close()
         print("   ✅ 結果保存成功")
         
         # 5. 結果表示
@@ -136,6 +198,8 @@ def test_system():
         import traceback
         traceback.print_exc()
         return False
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
     
     return True
 
@@ -144,9 +208,9 @@ def test_individual_modules():
     print("\n🔧 個別モジュールテスト")
     print("=" * 30)
     
+    work_dir = Path(tempfile.mkdtemp(prefix="modules_test_"))
     try:
-        config_manager = ConfigManager("config.yaml")
-        config = config_manager.load_config()
+        config = _isolated_config(work_dir)
         
         # 翻訳モジュールのテスト
         print("翻訳モジュールテスト...")
@@ -181,6 +245,1140 @@ def test_individual_modules():
         
     except Exception as e:
         print(f"❌ 個別モジュールテストエラー: {str(e)}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+def test_currency_bulk():
+    """一括換算（1件ずつの換算と同じ結果・表示通貨の列）"""
+    print("\n💱 一括換算テスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="currency_test_"))
+    try:
+        config = _isolated_config(work_dir)
+        currency_converter = CurrencyConverter(config)
+        rates = dict(config["currency"]["fallback_rates"])
+        
+        text = "McDonald's Big Mac $8.50, Tax $0.85, Total $9.35"
+        amounts = currency_converter.extract_amounts(text)
+        conversions = currency_converter.convert_currencies(amounts, currency_converter.detect_currencies(text))
+        bulk = currency_converter.convert_currencies_bulk(
+            [a["amount"] for a in amounts], [a["currency"] for a in amounts]
+        )
+        assert list(bulk["jpy_amount"]) == [c["jpy_amount"] for c in conversions]
+        
+        # 表示通貨の列は円換算額を表示通貨の円建てレートで割った額
+        bulk = currency_converter.convert_currencies_bulk([100.0, 1000.0], ["USD", "THB"], exchange_rates=rates,
+                                                          target_currencies=["USD"])
+        assert list(bulk["jpy_amount"]) == [round(100.0 * rates["USD"], 2), round(1000.0 * rates["THB"], 2)]
+        assert list(bulk["amount_USD"]) == [100.0, round(1000.0 * rates["THB"] / rates["USD"], 2)]
+        assert "conversion_date" in bulk.attrs
+        
+        try:
+            currency_converter.convert_currencies_bulk([1.0, 2.0], ["USD"])
+            assert False, "件数の不一致を受け付けました"
+        except ValueError:
+            pass
+        print(f"  ✅ 一括換算: {len(bulk)}件 {list(bulk.columns)}")
+        
+        # レートが不明な通貨は1倍で換算せず、換算額なしとして示す
+        bulk = currency_converter.convert_currencies_bulk([5.0, 5.0], ["UNKNOWN", "JPY"], exchange_rates=rates,
+                                                          target_currencies=["USD"])
+        assert list(bulk["rate_missing"]) == [True, False]
+        assert bulk["jpy_amount"].isna().tolist() == [True, False] and bulk["amount_USD"].isna().tolist() == [True, False]
+        unknown = currency_converter.convert_currencies([{"amount": 5.0, "currency": "UNKNOWN"}], [])[0]
+        assert unknown["rate_missing"] and unknown["jpy_amount"] is None and unknown["exchange_rate"] is None
+        assert all(value is None for value in unknown["converted_amounts"].values())
+        print(f"  ✅ レート不明: {unknown['original_currency']} → {unknown['jpy_amount']}")
+        
+        # クロスレート行列（行: 換算元, 列: 換算先）
+        matrix = currency_converter.get_cross_rate_matrix(["USD", "THB"], rates, ["JPY", "USD"])
+        assert matrix.loc["USD", "JPY"] == rates["USD"] and matrix.loc["USD", "USD"] == 1.0
+        assert matrix.loc["THB", "USD"] == rates["THB"] / rates["USD"]
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ 一括換算テスト完了")
+
+def test_exchange_rate_cache():
+    """為替レートのキャッシュ（取得中は他のスレッドを待たせず、期限切れのキャッシュを使う）"""
+    print("\n🔁 為替レートキャッシュテスト")
+    print("=" * 30)
+    
+    import threading
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="exchange_rate_test_"))
+    config = _isolated_config(work_dir, fakes={"rates": {"latency": {"median_ms": 300, "p99_ms": 301}}})
+    rates_server = FakeRatesServer(FakeServiceBehavior("rates", config["fakes"]["rates"]),
+                                   config["currency"]["fallback_rates"]).start()
+    try:
+        config["currency"]["api_url"] = rates_server.api_url
+        currency_converter = CurrencyConverter(config)
+        rates, source = currency_converter._current_exchange_rates()
+        assert source == "api"
+        
+        # キャッシュを期限切れにし、1つ目のスレッドが取得している間に2つ目のスレッドが参照する
+        currency_converter._rates_fetched_at = 0.0
+        fetching = threading.Thread(target=currency_converter._current_exchange_rates)
+        fetching.start()
+        deadline = time.monotonic() + 5
+        while not currency_converter._rates_fetching and time.monotonic() < deadline:
+            time.sleep(0.001)
+        started = time.monotonic()
+        stale, stale_source = currency_converter._current_exchange_rates()
+        waited = time.monotonic() - started
+        fetching.join()
+        assert (stale, stale_source) == (rates, "api")
+        assert waited < 0.1
+        assert currency_converter._rates_fetched_at > 0
+        print(f"  ✅ 取得中の参照: {waited * 1000:.1f}ms で期限切れのキャッシュを使用")
+        
+        # キャッシュがない状態で同時に参照しても取得は1回のみ（他のスレッドは取得の完了を待つ）
+        cold_converter = CurrencyConverter(config)
+        fetch = cold_converter._fetch_exchange_rates
+        fetch_count = []
+        def counted_fetch():
+            fetch_count.append(1)
+            return fetch()
+        cold_converter._fetch_exchange_rates = counted_fetch
+        sources = []
+        threads = [threading.Thread(target=lambda: sources.append(cold_converter._current_exchange_rates()[1]))
+                   for _ in range(5)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert (len(fetch_count), sources) == (1, ["api"] * 5)
+        print(f"  ✅ 同時の初回取得: {len(sources)}スレッドで{len(fetch_count)}回")
+        
+        # 取得に失敗した後は fallback_cache_seconds の間APIを呼び直さない
+        rates_server.stop()
+        cold_converter._rates_fetched_at = 0.0
+        del fetch_count[:]
+        assert cold_converter._current_exchange_rates()[1] == "fallback"
+        assert cold_converter._current_exchange_rates()[1] == "fallback"
+        assert len(fetch_count) == 1
+        print("  ✅ 取得失敗後はフォールバックレートを再利用")
+        
+        # jpy_amount は基準通貨建てのため、円以外の基準通貨は受け付けない
+        try:
+            CurrencyConverter(dict(config, currency=dict(config["currency"], base_currency="USD")))
+            raise AssertionError("円以外の基準通貨を受け付けました")
+        except ValueError:
+            pass
+    finally:
+        rates_server.stop()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ 為替レートキャッシュテスト完了")
+
+def test_fake_vision_without_library():
+    """Vision API のライブラリがなくても代替クライアントでOCRできる"""
+    print("\n👁️  代替Visionクライアントテスト")
+    print("=" * 30)
+    
+    import src.image_processor as image_processor_module
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="fake_vision_test_"))
+    original = (image_processor_module.vision, getattr(image_processor_module, "types", None))
+    try:
+        image_processor_module.vision = image_processor_module.types = None
+        image_processor = ImageProcessor(_isolated_config(work_dir, fakes={}))
+        text_data = image_processor.extract_text("fake_vision_receipt", image_bytes=b"fake vision image")
+        assert not text_data["is_dummy"]
+        assert text_data["extracted_text"] in SAMPLE_RECEIPT_TEXTS
+        assert text_data == image_processor.extract_text("fake_vision_receipt", image_bytes=b"fake vision image")
+        print(f"  ✅ 抽出: {text_data['text_length']}文字")
+    finally:
+        image_processor_module.vision, image_processor_module.types = original
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ 代替Visionクライアントテスト完了")
+
+def test_gemini_extraction():
+    """gemini モードの構造化抽出（代替モデル）"""
+    print("\n✨ 構造化抽出テスト（代替Geminiモデル）")
+    print("=" * 30)
+    
+    config = thaw_config(ConfigManager("config.yaml").get_config())
+    config["processing"]["mode"] = "gemini"
+    config["fakes"]["enabled"] = True
+    config["fakes"]["gemini"] = {"error_rate": 0.0}
+    config["google_apis"]["gemini"].pop("rate_limit", None)
+    
+    extractor = create_gemini_extractor(config)
+    assert extractor is not None
+    
+    # 代替モデルは画像の内容ハッシュでサンプルレシートを選ぶため、同じ画像には同じ結果を返す
+    extraction = extractor.extract("gemini_test_receipt", image_bytes=b"test image")
+    assert extraction == extractor.extract("gemini_test_receipt", image_bytes=b"test image")
+    assert extraction["raw_text"] in SAMPLE_RECEIPT_TEXTS
+    assert extraction["merchant"] == extraction["raw_text"].splitlines()[0]
+    assert extraction["currency"] in config["currency"]["target_currencies"]
+    assert extraction["total"] is not None and extraction["items"]
+    print(f"  {extraction['merchant']}: {extraction['total']} {extraction['currency']} "
+          f"(明細{len(extraction['items'])}件, {extraction['date']}, {extraction['language']})")
+    
+    amounts = extractor.amounts(extraction)
+    assert [amount["amount"] for amount in amounts] == [extraction["total"]]
+    print(f"  換算対象: {amounts}")
+    
+    # MIME タイプはファイル名ではなく画像の内容から判定する（.jpg のパターンでも PNG は image/png）
+    import io
+    from PIL import Image
+    
+    mime_types = []
+    generate_content = extractor.model.generate_content
+    
+    def recording_generate_content(contents, **kwargs):
+        mime_types.append(contents[1]["mime_type"])
+        return generate_content(contents, **kwargs)
+    
+    extractor.model.generate_content = recording_generate_content
+    png = io.BytesIO()
+    Image.new("RGB", (8, 8), "white").save(png, format="PNG")
+    extractor.extract("gemini_png_receipt", image_bytes=png.getvalue())
+    extractor.extract("gemini_unknown_receipt", image_bytes=b"not an image")
+    assert mime_types == ["image/png", "image/jpeg"]
+    print(f"  MIME タイプ: {mime_types}")
+    
+    # pipeline モードでは作成しない
+    config["processing"]["mode"] = "pipeline"
+    assert create_gemini_extractor(config) is None
+    
+    print("\n✅ 構造化抽出テスト完了")
+
+def test_receipt_corpus():
+    """合成レシートコーパス（再現性・通貨記号の網羅・金額抽出）"""
+    print("\n🧾 合成レシートコーパステスト")
+    print("=" * 30)
+    
+    generator = ReceiptCorpusGenerator(seed=42)
+    receipts = list(generator.iter_receipts(300))
+    
+    # 同じシード・番号のレシートは、件数や開始位置によらず同じ
+    assert receipts[123] == ReceiptCorpusGenerator(seed=42).generate(123)
+    assert receipts[200:210] == list(generator.iter_receipts(10, start=200))
+    assert receipts[0]["text"] != ReceiptCorpusGenerator(seed=43).generate(0)["text"]
+    
+    # CurrencyConverter が認識するすべての通貨記号が出現する
+    work_dir = Path(tempfile.mkdtemp(prefix="corpus_test_"))
+    try:
+        currency_converter = CurrencyConverter(_isolated_config(work_dir))
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    symbols = {receipt["symbol"] for receipt in receipts}
+    assert set(currency_converter.currency_symbols) <= symbols
+    
+    # 記号が先頭・桁区切りのない金額（1000ドル未満の米ドル）は合計金額を抽出できる
+    usd = [receipt for receipt in receipts if receipt["locale"] == "en_US" and receipt["size"] != "pathological"]
+    assert usd
+    for receipt in usd:
+        amounts = currency_converter.extract_amounts(receipt["text"])
+        if receipt["total"] < 1000:
+            assert any(abs(amount["amount"] - receipt["total"]) < 0.005 for amount in amounts)
+    print(f"  {len(receipts)}件 / 記号: {sorted(symbols)} / 米ドル: {len(usd)}件")
+    
+    print("\n✅ 合成レシートコーパステスト完了")
+
+def test_config_cache():
+    """検証済み設定のキャッシュ（変更不可・複製・ファイル削除時の前回設定）"""
+    print("\n📋 設定キャッシュテスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="config_cache_test_"))
+    try:
+        config_path = work_dir / "config.yaml"
+        shutil.copy("config.yaml", config_path)
+        config_manager = ConfigManager(str(config_path))
+        
+        config = config_manager.get_config()
+        assert config_manager.get_config() is config
+        try:
+            config["currency"]["base_currency"] = "USD"
+            raise AssertionError("変更不可の設定を書き換えられました")
+        except TypeError:
+            pass
+        
+        # 複製は変更可能で、元の設定には影響しない
+        copied = thaw_config(config)
+        copied["currency"]["target_currencies"].append("GBP")
+        assert "GBP" not in config["currency"]["target_currencies"]
+        assert copied["processing_flow"][0]["steps"][0] == dict(config["processing_flow"][0]["steps"][0])
+        
+        # 置き換え中などでファイルが読めない間は前回の設定を使う
+        config_path.unlink()
+        assert config_manager.get_config() is config
+        print("  ✅ 変更不可・複製・ファイル削除時の前回設定")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ 設定キャッシュテスト完了")
+
+def test_step_checkpoints():
+    """処理ステップのチェックポイント（代替処理の結果は保存せず、再実行時に呼び直す）"""
+    print("\n⏩ チェックポイントテスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="checkpoint_test_"))
+    logger = logging.getLogger("test_system")
+    try:
+        config = _isolated_config(work_dir, fakes={"translate": {"error_rate": 1.0}})
+        rates_server = FakeRatesServer(FakeServiceBehavior("rates", config["fakes"]["rates"]),
+                                       config["currency"]["fallback_rates"]).start()
+        config["currency"]["api_url"] = rates_server.api_url
+        result_manager = ResultManager(config)
+        image_processor = ImageProcessor(config)
+        currency_converter = CurrencyConverter(config)
+        
+        def run(translator: Translator) -> Dict[str, Any]:
+            return process_receipt(config, image_processor, translator, currency_converter, result_manager, logger,
+                                   receipt_id="checkpoint_test", image_bytes=b"checkpoint test image")
+        
+        # 翻訳APIが失敗し続ける間は、ダミーの言語検出・翻訳とそれ以降のステップを保存しない
+        failing_translator = Translator(config)
+        first = run(failing_translator)
+        assert first["phases"]["translation"]["steps"]["translate_text"]["data"]["is_dummy"]
+        assert first["checkpoint"]["saved_steps"] == ["load_receipt_image", "extract_text"]
+        second = run(failing_translator)
+        assert second["checkpoint"]["restored_steps"] == ["load_receipt_image", "extract_text"]
+        assert "translate_text" not in second["checkpoint"]["restored_steps"]
+        
+        # 翻訳APIが回復したら残りのステップを実行して保存し、次回はすべて復元する
+        config["fakes"]["translate"]["error_rate"] = 0.0
+        working_translator = Translator(config)
+        third = run(working_translator)
+        assert not third["phases"]["translation"]["steps"]["translate_text"]["data"]["is_dummy"]
+        assert not third["phases"]["currency_conversion"]["steps"]["convert_currency"]["data"]["fallback"]
+        assert third["checkpoint"]["restored_steps"] == ["load_receipt_image", "extract_text"]
+        fourth = run(working_translator)
+        assert fourth["checkpoint"]["restored_steps"] == third["checkpoint"]["restored_steps"] + third["checkpoint"]["saved_steps"]
+        assert len(fourth["checkpoint"]["restored_steps"]) == 7
+        print(f"  ✅ 翻訳失敗時の保存: {first['checkpoint']['saved_steps']} / 回復後の復元: {len(fourth['checkpoint']['restored_steps'])}ステップ")
+        
+        # 為替レートAPIが失敗した場合（フォールバックレート）の換算も保存しない
+        rates_server.stop()
+        config["currency"]["rate_cache_seconds"] = 0
+        fallback = process_receipt(config, image_processor, working_translator, CurrencyConverter(config),
+                                   result_manager, logger, receipt_id="checkpoint_fallback_rates",
+                                   image_bytes=b"checkpoint fallback rates image")
+        assert fallback["phases"]["currency_conversion"]["steps"]["convert_currency"]["data"]["fallback"]
+        assert "convert_currency" not in fallback["checkpoint"]["saved_steps"]
+        print("  ✅ フォールバックレートの換算は保存しない")
+        
+        # Gemini の構造化抽出に失敗して従来のOCRを使った場合も保存しない
+        config["processing"]["mode"] = "gemini"
+        config["fakes"]["gemini"]["error_rate"] = 1.0
+        gemini = process_receipt(config, image_processor, working_translator, currency_converter, result_manager,
+                                 logger, receipt_id="checkpoint_gemini", image_bytes=b"checkpoint gemini image",
+                                 gemini_extractor=create_gemini_extractor(config))
+        assert gemini["phases"]["image_processing"]["steps"]["extract_text"]["data"]["fallback"]
+        assert gemini["checkpoint"]["saved_steps"] == ["load_receipt_image"]
+        print("  ✅ Gemini 失敗時のOCRは保存しない")
+        result_manager.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ チェックポイントテスト完了")
+
+def test_rate_limiter():
+    """共有トークンバケット（確保できなかった件数の記録・設定の検証・期限バジェットとの区別）"""
+    print("\n🪣 レート制限テスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="rate_limiter_test_"))
+    try:
+        db_path = str(work_dir / "rate_limits.db")
+        limiter = RateLimiter(db_path)
+        assert limiter.acquire("test", requests_per_minute=60, burst=2) == 0
+        assert limiter.acquire("test", requests_per_minute=60, burst=2) == 0
+        try:
+            limiter.acquire("test", requests_per_minute=60, burst=2, max_wait=0.1)
+            raise AssertionError("待ち時間が上限を超えても確保できました")
+        except RateLimitExceeded:
+            pass
+        
+        # 確保できなかった件数はコミットされ、別の接続（別プロセス）からも見える
+        stats = RateLimiter(db_path).get_stats()["test"]
+        assert (stats["acquired"], stats["rejected"]) == (2, 1)
+        assert read_rate_limit_stats(db_path)["test"] == stats
+        assert read_rate_limit_stats(str(work_dir / "missing.db")) == {}
+        assert not (work_dir / "missing.db").exists()
+        print(f"  ✅ 確保{stats['acquired']}件・確保できず{stats['rejected']}件")
+        
+        # 0以下のレートではトークンが補充されないため、設定の時点で拒否する
+        for requests_per_minute in (0, -5):
+            try:
+                ServiceRateLimit(limiter, "invalid", {"requests_per_minute": requests_per_minute})
+                raise AssertionError(f"不正なレートを受け付けました: {requests_per_minute}")
+            except ValueError:
+                pass
+        
+        # 待ち時間が残り時間を超える場合は rate_limited として記録し、期限超過にはしない
+        breaker = CircuitBreaker("rate_limit_test")
+        rate_limit = ServiceRateLimit(limiter, "guarded", {"requests_per_minute": 1, "burst": 1})
+        with deadline_budget(5) as budget:
+            assert guarded_call(breaker, lambda timeout: "ok", 1, rate_limit=rate_limit) == "ok"
+            try:
+                guarded_call(breaker, lambda timeout: "ok", 1, rate_limit=rate_limit)
+                raise AssertionError("レート制限を超えて呼び出しました")
+            except RateLimitExceeded:
+                pass
+        assert budget.calls["rate_limit_test"] == {"success": 1, "rate_limited": 1}
+        assert not budget.exceeded
+        assert breaker.state == "closed"
+        print(f"  ✅ 期限バジェット: {budget.calls['rate_limit_test']}")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ レート制限テスト完了")
+
+def test_circuit_breaker():
+    """サーキットブレーカーの状態遷移（closed → open → half_open → closed、試行の失敗で open に戻る）"""
+    print("\n🔌 サーキットブレーカーテスト")
+    print("=" * 30)
+    
+    breaker = CircuitBreaker("transition_test", failure_threshold=2, reset_seconds=0.1)
+    calls = []
+    def failing(timeout: float):
+        calls.append(timeout)
+        raise RuntimeError("外部APIエラー")
+    
+    # failure_threshold 回連続で失敗すると open になり、呼び出さずに失敗させる
+    for _ in range(2):
+        try:
+            guarded_call(breaker, failing, 1)
+            raise AssertionError("失敗した呼び出しが成功扱いになりました")
+        except RuntimeError:
+            pass
+    assert breaker.state == "open" and len(calls) == 2
+    try:
+        guarded_call(breaker, failing, 1)
+        raise AssertionError("開いたブレーカーで呼び出しました")
+    except CircuitOpenError:
+        pass
+    assert len(calls) == 2
+    print(f"  ✅ open: {breaker.snapshot()}")
+    
+    # reset_seconds 後は half_open になり、同時に1件だけ試行する（失敗すれば再び open）
+    time.sleep(0.15)
+    assert breaker.state == "half_open"
+    assert breaker.allow_request() and not breaker.allow_request()
+    breaker.record_failure()
+    assert breaker.state == "open"
+    
+    # 試行が成功すれば closed に戻り、連続失敗の回数もリセットする
+    time.sleep(0.15)
+    assert guarded_call(breaker, lambda timeout: "ok", 1) == "ok"
+    snapshot = breaker.snapshot()
+    assert (snapshot["state"], snapshot["consecutive_failures"], snapshot["open_count"]) == ("closed", 0, 2)
+    print(f"  ✅ half_open → closed: {snapshot}")
+    
+    print("\n✅ サーキットブレーカーテスト完了")
+
+def test_json_logging():
+    """JSON Lines 形式のログ（1行1レコード・extra の項目・例外、出力スレッド経由でも欠けない）"""
+    print("\n🧾 JSON Lines ログテスト")
+    print("=" * 30)
+    
+    record = logging.LogRecord("receipt", logging.WARNING, __file__, 1, "処理が遅延しました: %s", ("vision",), None)
+    record.receipt_id = "log_receipt"
+    record.duration = 1.5
+    entry = json.loads(JsonLinesFormatter().format(record))
+    assert (entry["level"], entry["logger"], entry["message"]) == ("WARNING", "receipt", "処理が遅延しました: vision")
+    assert (entry["receipt_id"], entry["duration"]) == ("log_receipt", 1.5)
+    assert "args" not in entry and "msg" not in entry
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="json_logging_test_"))
+    root = logging.getLogger()
+    handlers, level = list(root.handlers), root.level
+    try:
+        log_file = work_dir / "system.jsonl"
+        configure_logging("INFO", log_format="json", log_file=str(log_file))
+        logger = logging.getLogger("json_logging_test")
+        logger.info("レシート %s を処理しました\n2行目", "r1", extra={"receipt_id": "r1", "path": Path("receipts")})
+        try:
+            raise ValueError("換算できません")
+        except ValueError:
+            logger.exception("換算に失敗しました")
+        logger.debug("出力しないレベル")
+        stop_logging()
+        
+        lines = log_file.read_text(encoding='utf-8').splitlines()
+        entries = [json.loads(line) for line in lines]
+        assert len(entries) == 2
+        assert entries[0]["message"] == "レシート r1 を処理しました\n2行目"
+        assert (entries[0]["receipt_id"], entries[0]["path"]) == ("r1", "receipts")
+        assert "ValueError: 換算できません" in entries[1]["exception"]
+        print(f"  ✅ {len(lines)}行: {sorted(entries[0])}")
+    finally:
+        stop_logging()
+        for handler in list(root.handlers):
+            root.removeHandler(handler)
+            handler.close()
+        for handler in handlers:
+            root.addHandler(handler)
+        root.setLevel(level)
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ JSON Lines ログテスト完了")
+
+def _conversion_results(receipt_id: str, conversions, detected_language: Optional[str] = None) -> Dict[str, Any]:
+    """換算結果のみを含む処理結果（保存・集計・エクスポートのテスト用）"""
+    return {
+        "receipt_id": receipt_id,
+        "phases": {
+            "translation": {
+                "name": "翻訳フェーズ",
+                "status": "completed",
+                "steps": {"detect_language": {"status": "success", "data": {"detected_language": detected_language}}}
+            },
+            "currency_conversion": {
+                "name": "通貨換算フェーズ",
+                "status": "completed",
+                "steps": {"convert_currency": {"status": "success", "data": {"conversions": conversions}}}
+            }
+        },
+        "processing_time": 0.1
+    }
+
+def test_export_conversions():
+    """換算結果の Parquet エクスポート（すべて None の列も型を固定する）"""
+    print("\n📤 エクスポートテスト")
+    print("=" * 30)
+    
+    import pyarrow.dataset as ds
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="export_test_"))
+    try:
+        config = _isolated_config(work_dir)
+        result_manager = ResultManager(config)
+        conversion = {"original_amount": 10.0, "original_currency": "USD", "jpy_amount": 1500.0,
+                      "exchange_rate": 150.0, "converted_amounts": {}, "conversion_date": None}
+        
+        # 1回目: 言語・表示通貨の換算額・換算日時がすべて None
+        result_manager.save_results(_conversion_results("export_none", [conversion]), "export_none")
+        first = result_manager.export_conversions()
+        assert first["rows"] == 1
+        
+        # 2回目: 値がある（1回目とスキーマが同じでないと読み込めない）
+        filled = dict(conversion, converted_amounts={currency: 1.0 for currency in result_manager.display_currencies},
+                      conversion_date="2024-01-15T12:00:00")
+        filled_results = _conversion_results("export_filled", [filled], "en")
+        filled_results["phases"]["image_processing"] = {
+            "name": "画像処理フェーズ",
+            "status": "completed",
+            "steps": {"extract_text": {"status": "success", "data": {"receipt_date": "2024/01/10"}}}
+        }
+        result_manager.save_results(filled_results, "export_filled")
+        assert result_manager.export_conversions()["rows"] == 1
+        
+        table = ds.dataset(result_manager.export_dir, format="parquet", partitioning="hive").to_table()
+        schema = table.schema
+        assert schema.field("detected_language").type == "string"
+        assert schema.field("conversion_date").type == "string"
+        for currency in result_manager.display_currencies:
+            assert schema.field(f"amount_{currency}").type == "double"
+        assert table.sort_by("result_id").column("detected_language").to_pylist() == [None, "en"]
+        
+        # 利用日（不明なら処理日）でパーティション分割し、処理日は列として残す
+        today = datetime.now().strftime("%Y-%m-%d")
+        assert table.sort_by("result_id").column("receipt_date").to_pylist() == [today, "2024-01-10"]
+        assert table.column("processed_date").to_pylist() == [today, today]
+        assert (result_manager.export_dir / "receipt_date=2024-01-10" / "original_currency=USD").is_dir()
+        print(f"  ✅ {table.num_rows}行: {[f'{field.name}:{field.type}' for field in schema][:6]}...")
+        result_manager.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ エクスポートテスト完了")
+
+def test_stats_and_expenses():
+    """処理統計・支出集計（保存時の加算と再構築の結果が一致・同じレシートは最新の結果のみ集計）"""
+    print("\n📊 統計・支出集計テスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="stats_test_"))
+    try:
+        config = _isolated_config(work_dir)
+        result_manager = ResultManager(config)
+        
+        def conversion(amount: float, currency: str, jpy_amount: float) -> Dict[str, Any]:
+            return {"original_amount": amount, "original_currency": currency, "jpy_amount": jpy_amount,
+                    "exchange_rate": jpy_amount / amount, "converted_amounts": {}, "conversion_date": None}
+        
+        # 同じレシートを2回処理した場合は最新の結果のみ支出に数える（処理統計は2件）
+        result_manager.save_results(_conversion_results("stats_usd", [conversion(10.0, "USD", 1500.0)]),
+                                    "stats_usd", trip_id="stats_trip")
+        time.sleep(0.001)
+        result_manager.save_results(_conversion_results("stats_usd", [conversion(20.0, "USD", 3000.0)]),
+                                    "stats_usd", trip_id="stats_trip")
+        failed = _conversion_results("stats_thb", [conversion(100.0, "THB", 420.0), conversion(100.0, "THB", 420.0)])
+        failed["phases"]["translation"]["status"] = "error"
+        failed["processing_time"] = 3.0
+        failed["resilience"] = {"calls": {"vision": {"success": 1, "error": 2}}}
+        result_manager.save_results(failed, "stats_thb")
+        
+        stats = result_manager.get_processing_stats()
+        assert (stats["total_files"], stats["successful_files"], stats["failed_files"]) == (3, 2, 1)
+        # 統計の取得ではレート制限のDBを作成しない
+        assert stats["rate_limits"] == {} and not (work_dir / "rate_limits.db").exists()
+        assert stats["average_processing_time"] == round((0.1 + 0.1 + 3.0) / 3, 3)
+        assert stats["latency_histogram"]["0.5"] == 2 and stats["latency_histogram"]["5"] == 1
+        assert (stats["external_apis"]["vision_success"], stats["external_apis"]["vision_error"]) == (1, 2)
+        assert result_manager.rebuild_processing_stats() == stats
+        print(f"  ✅ 処理統計: {stats['total_files']}件（失敗{stats['failed_files']}件）")
+        
+        # 支出集計（同じ金額・通貨の重複は1件として数える）
+        with open(result_manager.expense_index_path, 'r', encoding='utf-8') as f:
+            expense_index = json.load(f)
+        assert (expense_index["total_jpy"], expense_index["receipt_count"]) == (3420.0, 2)
+        assert expense_index["by_currency"]["USD"] == {"total_jpy": 3000.0, "receipt_count": 1, "original_amount": 20.0}
+        assert expense_index["by_currency"]["THB"]["total_jpy"] == 420.0
+        assert expense_index["by_trip"]["stats_trip"]["total_jpy"] == 3000.0
+        
+        listing = result_manager.list_receipts(currency="USD")
+        assert [item["receipt_id"] for item in listing["items"]] == ["stats_usd"]
+        assert result_manager.list_receipts(status="error")["total"] == 1
+        assert result_manager.rebuild_expense_index() == {"total_jpy": 3420.0, "receipt_count": 2}
+        print(f"  ✅ 支出集計: {expense_index['total_jpy']}円 / {expense_index['receipt_count']}件")
+        result_manager.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ 統計・支出集計テスト完了")
+
+def test_result_compaction():
+    """コンパクション（アーカイブへの追記は重複しない・統計の再構築でアーカイブ分も数える）"""
+    print("\n🗜️  コンパクションテスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="compaction_test_"))
+    try:
+        config = _isolated_config(work_dir)
+        result_manager = ResultManager(config)
+        for _ in range(4):
+            result_manager.save_results(_conversion_results("compaction_receipt", []), "compaction_receipt")
+            time.sleep(0.001)
+        assert result_manager.get_processing_stats()["total_files"] == 4
+        
+        # 削除前に中断した場合と同じく、アーカイブ済みの結果を再度渡しても追記しない
+        superseded = [results for _, results in result_manager.store.superseded_runs("compaction_receipt", 1)]
+        assert result_manager.archive.append("compaction_receipt", superseded) == 3
+        compacted = result_manager.compact_results(keep_latest=1)
+        assert compacted["store_runs"] == 3
+        assert len(result_manager.archive.list_runs("compaction_receipt")) == 3
+        assert len(list(result_manager.archive.iter_runs("compaction_receipt"))) == 3
+        print(f"  ✅ コンパクション: {compacted}（アーカイブ3件）")
+        
+        # 追記の途中で中断したアーカイブ（末尾のgzipメンバーが切れている）も読めた分までは読む
+        archive_path = result_manager.archive._archive_path("compaction_receipt")
+        with open(archive_path, 'ab') as f:
+            f.write(gzip.compress(b'{"metadata":{"processed_at":"truncated"}}\n' * 50)[:30])
+        assert len(result_manager.archive.list_runs("compaction_receipt")) == 3
+        
+        # 統計を再構築してもコンパクションで移動した結果の件数は減らない
+        stats = result_manager.rebuild_processing_stats()
+        assert (stats["total_files"], stats["successful_files"], stats["average_processing_time"]) == (4, 4, 0.1)
+        assert result_manager.migrate_json_results() == 0
+        assert result_manager.get_processing_stats()["total_files"] == 4
+        print(f"  ✅ 再構築後の統計: {stats['total_files']}件")
+        result_manager.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ コンパクションテスト完了")
+
+def test_archive_import():
+    """旅行アーカイブの取り込み（メンバー名の記録・重複のスキップ・失敗したレシートの再処理）"""
+    print("\n🗂️  アーカイブ取り込みテスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="archive_import_test_"))
+    logger = logging.getLogger("test_system")
+    try:
+        config = _isolated_config(work_dir, fakes={})
+        for phase in config["processing_flow"]:
+            for step in phase["steps"]:
+                if step["action"] == "load_image":
+                    step["target_file_pattern"] = str(work_dir / "receipts" / "{{receipt_id}}.jpg")
+        archive_path = work_dir / "bangkok.zip"
+        with zipfile.ZipFile(archive_path, "w") as archive:
+            archive.writestr("day1/lunch.jpg", b"archive image 1")
+            archive.writestr("day1/dinner.jpg", b"archive image 2")
+            archive.writestr("day2/lunch_copy.jpg", b"archive image 1")
+            archive.writestr("notes.txt", b"not an image")
+        
+        result_manager = ResultManager(config)
+        processors = (ImageProcessor(config), Translator(config), CurrencyConverter(config), result_manager)
+        args = argparse.Namespace(import_archive=str(archive_path), trip_id=None)
+        
+        summary = import_archive(config, *processors, args, logger)
+        assert summary == {"processed": 2, "duplicates": 1, "failed": 0}
+        
+        # 結果のメタデータにはアーカイブ内のファイル名と旅行ID（アーカイブ名）を記録する
+        lunch = result_manager.load_results(hashlib.sha256(b"archive image 1").hexdigest()[:16])
+        assert lunch["metadata"]["source_name"] == "day1/lunch.jpg"
+        assert lunch["metadata"]["trip_id"] == "bangkok"
+        
+        # 取り込んだ画像は画像ファイルとして保存し、アーカイブなしで再処理できる
+        lunch_id = lunch["receipt_id"]
+        assert (work_dir / "receipts" / f"{lunch_id}.jpg").read_bytes() == b"archive image 1"
+        assert ImageProcessor(config).load_image(lunch_id)["image_size"] == len(b"archive image 1")
+        assert len(list((work_dir / "receipts").iterdir())) == 2
+        
+        # 最新の処理が失敗したレシートは処理済みとみなさず、再取り込みで処理し直す
+        dinner_id = hashlib.sha256(b"archive image 2").hexdigest()[:16]
+        assert result_manager.has_receipt(dinner_id)
+        failed = _conversion_results(dinner_id, [])
+        failed["phases"]["currency_conversion"]["status"] = "error"
+        result_manager.save_results(failed, dinner_id)
+        assert not result_manager.has_receipt(dinner_id)
+        
+        summary = import_archive(config, *processors, args, logger)
+        assert summary == {"processed": 1, "duplicates": 2, "failed": 0}
+        assert result_manager.has_receipt(dinner_id)
+        assert result_manager.load_results(dinner_id)["metadata"]["source_name"] == "day1/dinner.jpg"
+        print(f"  ✅ 再取り込み: {summary}")
+        result_manager.close()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ アーカイブ取り込みテスト完了")
+
+def test_job_queue():
+    """処理ジョブキュー（処理中のリース延長・リース切れジョブの再試行上限）"""
+    print("\n📋 ジョブキューテスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="job_queue_test_"))
+    try:
+        config = _isolated_config(work_dir)
+        config["jobs"].update({"lease_seconds": 0.3, "max_attempts": 2, "backoff_seconds": 0})
+        job_queue = JobQueue(config)
+        
+        # リース期間より長くかかる処理でも、ハートビートで延長されるため他のワーカーは再取得しない
+        other = JobQueue(config)
+        reclaimed = []
+        
+        def slow_processor(receipt_id: str):
+            deadline = time.monotonic() + 1.0
+            while time.monotonic() < deadline:
+                job = other.claim("other-worker")
+                if job is not None:
+                    reclaimed.append(job)
+                time.sleep(0.1)
+        
+        job_id = job_queue.enqueue("slow_receipt")
+        pool = WorkerPool(job_queue, slow_processor, workers=1, poll_interval=0.05)
+        pool.start()
+        try:
+            pool.wait_until_idle()
+        finally:
+            pool.stop()
+        assert not reclaimed
+        job = job_queue.get_job(job_id)
+        assert (job["status"], job["attempts"]) == ("completed", 1)
+        print(f"  ✅ 処理中のリース延長: {job['status']} ({job['attempts']}回目)")
+        
+        # 停止したワーカーは再び起動できる
+        job_id = job_queue.enqueue("restarted_receipt")
+        pool.start()
+        try:
+            pool.wait_until_idle()
+        finally:
+            pool.stop()
+        assert job_queue.get_job(job_id)["status"] == "completed"
+        
+        # ワーカーが異常終了してリースが切れたジョブは再取得し、上限に達したら失敗にする
+        job_id = job_queue.enqueue("crashed_receipt")
+        for attempt in range(1, 3):
+            time.sleep(0.35)
+            job = job_queue.claim(f"crashed-worker-{attempt}")
+            assert job is not None and job["job_id"] == job_id and job["attempts"] == attempt
+        
+        # リースが切れた後のワーカーは再取得したワーカーの状態を上書きしない
+        assert not job_queue.complete(job_id, "crashed-worker-1")
+        assert job_queue.fail(job_id, "crashed-worker-1", "late failure") is None
+        assert job_queue.get_job(job_id)["worker"] == "crashed-worker-2"
+        time.sleep(0.35)
+        assert job_queue.claim("next-worker") is None
+        job = job_queue.get_job(job_id)
+        assert job["status"] == "failed" and job["attempts"] == 2
+        print(f"  ✅ リース切れ: {job['status']} ({job['error']})")
+        
+        # 一覧の件数は上限までに抑える
+        assert len(job_queue.list_jobs(limit=10 ** 9)) == 3
+        assert len(job_queue.list_jobs(limit=0)) == 1
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ ジョブキューテスト完了")
+
+def _multipart(boundary: str, parts) -> bytes:
+    """(ファイル名, Content-Type, 内容) の一覧から multipart/form-data の本文を作成"""
+    body = b""
+    for filename, content_type, content in parts:
+        body += (f"--{boundary}\r\nContent-Disposition: form-data; name=\"receipt\"; filename=\"{filename}\"\r\n"
+                 f"Content-Type: {content_type}\r\n\r\n").encode('utf-8') + content + b"\r\n"
+    return body + f"--{boundary}--\r\n".encode('utf-8')
+
+def test_receipt_upload():
+    """画像アップロード（形式ごとの拡張子・重複の検出・エラー時に保存済みの画像を削除）"""
+    print("\n📷 アップロードテスト")
+    print("=" * 30)
+    
+    import io
+    from PIL import Image
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="upload_test_"))
+    try:
+        config = _isolated_config(work_dir)
+        for phase in config["processing_flow"]:
+            for step in phase["steps"]:
+                if step["action"] == "load_image":
+                    step["target_file_pattern"] = str(work_dir / "receipts" / "{{receipt_id}}.jpg")
+        uploader = ReceiptUploader(config)
+        
+        png = io.BytesIO()
+        Image.new("RGB", (8, 8), "white").save(png, format="PNG")
+        
+        def upload(parts):
+            body = _multipart("test-boundary", parts)
+            return uploader.receive(io.BytesIO(body), "multipart/form-data; boundary=test-boundary", len(body))
+        
+        # PNG は .png で保存し、画像処理・一覧からも見つかる
+        first = upload([("receipt.png", "image/png", png.getvalue())])[0]
+        saved = work_dir / "receipts" / f"{first['receipt_id']}.png"
+        assert saved.exists() and not first["duplicate"]
+        image_processor = ImageProcessor(config)
+        assert image_processor.list_receipt_ids() == [first["receipt_id"]]
+        assert image_processor.load_image(first["receipt_id"])["image_path"] == str(saved)
+        assert image_processor.refresh_metadata_index()["total"] == 1
+        assert upload([("again.png", "image/png", png.getvalue())])[0]["duplicate"]
+        print(f"  ✅ 保存: {saved.name}（2回目は重複）")
+        
+        # ハードリンクを作れないファイルシステムでは置き換えで保存する
+        link = os.link
+        def unsupported_link(source, target):
+            raise PermissionError("hard links are not supported")
+        os.link = unsupported_link
+        try:
+            linked = upload([("nolink.jpg", "image/jpeg", b"no hard link image")])[0]
+            assert not linked["duplicate"]
+            assert upload([("nolink_again.jpg", "image/jpeg", b"no hard link image")])[0]["duplicate"]
+        finally:
+            os.link = link
+        (work_dir / "receipts" / f"{linked['receipt_id']}.jpg").unlink()
+        assert sorted(path.name for path in (work_dir / "receipts").iterdir()) == [saved.name]
+        
+        # 後続のパートが対応していない形式なら、先に保存した画像も削除する
+        try:
+            upload([("new.jpg", "image/jpeg", b"new jpeg image"), ("photo.heic", "image/heic", b"heic image")])
+            assert False, "HEIC を受け付けました"
+        except UploadError as e:
+            assert e.status == 415
+        assert sorted(path.name for path in (work_dir / "receipts").iterdir()) == [saved.name]
+        print("  ✅ 415 で中断したリクエストの画像は残さない")
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ アップロードテスト完了")
+
+def _exif_jpeg(captured_at: Optional[str] = None, offset: Optional[str] = None) -> bytes:
+    """撮影日時（DateTimeOriginal・OffsetTimeOriginal）付きの JPEG 画像"""
+    import io
+    from PIL import Image
+    
+    exif = Image.Exif()
+    if captured_at:
+        exif.get_ifd(0x8769)[0x9003] = captured_at
+    if offset:
+        exif.get_ifd(0x8769)[0x9011] = offset
+    image = io.BytesIO()
+    Image.new("RGB", (8, 8), "white").save(image, format="JPEG", exif=exif)
+    return image.getvalue()
+
+def test_image_index():
+    """画像メタデータ索引（変更・削除・読み込めない画像の扱い、タイムゾーンをそろえた撮影日時順）"""
+    print("\n🗂️  画像メタデータ索引テスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="image_index_test_"))
+    original_tz = os.environ.get("TZ")
+    try:
+        # タイムゾーンなしの撮影日時は現地時刻とみなすため、テスト中は UTC にそろえる
+        os.environ["TZ"] = "UTC"
+        time.tzset()
+        
+        config = _isolated_config(work_dir)
+        receipts_dir = work_dir / "receipts"
+        for phase in config["processing_flow"]:
+            for step in phase["steps"]:
+                if step["action"] == "load_image":
+                    step["target_file_pattern"] = str(receipts_dir / "{{receipt_id}}.jpg")
+        receipts_dir.mkdir()
+        image_processor = ImageProcessor(config)
+        
+        # 12:00+09:00（03:00 UTC）は 10:00（現地時刻）より前。文字列の比較では逆順になる
+        (receipts_dir / "tokyo.jpg").write_bytes(_exif_jpeg("2024:01:01 12:00:00", "+09:00"))
+        (receipts_dir / "local.jpg").write_bytes(_exif_jpeg("2024:01:01 10:00:00"))
+        (receipts_dir / "removed.jpg").write_bytes(_exif_jpeg("2024:01:01 08:00:00"))
+        first = image_processor.refresh_metadata_index()
+        assert (first["total"], first["updated"]) == (3, 3)
+        assert image_processor.list_receipt_ids_by_capture_time() == ["tokyo", "removed", "local"]
+        
+        # 変更がなければ読み直さない
+        unchanged = image_processor.refresh_metadata_index()
+        assert (unchanged["updated"], unchanged["removed"]) == (0, 0)
+        
+        # 変更・削除・読み込めない画像（撮影日時なしは更新日時で並べる）
+        (receipts_dir / "local.jpg").write_bytes(_exif_jpeg())
+        os.utime(receipts_dir / "local.jpg", (0, 0))
+        (receipts_dir / "removed.jpg").unlink()
+        (receipts_dir / "broken.jpg").write_bytes(b"not an image")
+        second = image_processor.refresh_metadata_index()
+        assert (second["total"], second["removed"]) == (2, 1)
+        assert sorted(second["changed"]) == ["broken", "local"]
+        index = image_processor.load_metadata_index()
+        assert "broken" not in index and index["local"]["captured_at"] is None
+        assert image_processor.list_receipt_ids_by_capture_time() == ["local", "tokyo"]
+        print(f"  ✅ 索引: {second['total']}件（更新{second['updated']}件・削除{second['removed']}件）")
+        
+        # 読み込めない画像は索引に載らないため、次回も読み直す
+        assert image_processor.refresh_metadata_index()["changed"] == ["broken"]
+    finally:
+        if original_tz is None:
+            os.environ.pop("TZ", None)
+        else:
+            os.environ["TZ"] = original_tz
+        time.tzset()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ 画像メタデータ索引テスト完了")
+
+def test_profiler():
+    """プロファイラー（並列実行中のステップはメモリを計測しない）"""
+    print("\n⏱️  プロファイラーテスト")
+    print("=" * 30)
+    
+    import threading
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="profiler_test_"))
+    try:
+        profiler = StepProfiler(_isolated_config(work_dir))
+        profiler.start()
+        try:
+            first_started = threading.Event()
+            second_done = threading.Event()
+            profiles = [profiler.begin("profiler_first"), profiler.begin("profiler_second")]
+            
+            def first():
+                with profiles[0].step("extract_text"):
+                    first_started.set()
+                    second_done.wait(5)
+                    _ = [bytes(1024) for _ in range(100)]
+            
+            thread = threading.Thread(target=first)
+            thread.start()
+            first_started.wait(5)
+            with profiles[1].step("extract_text"):
+                _ = [bytes(1024) for _ in range(100)]
+            second_done.set()
+            thread.join()
+            
+            measured, skipped = profiles[0].steps["extract_text"], profiles[1].steps["extract_text"]
+            assert measured["cprofile"] and measured["memory_peak_kb"] is not None
+            assert not skipped["cprofile"]
+            assert (skipped["memory_delta_kb"], skipped["memory_peak_kb"]) == (None, None)
+            assert skipped["wall_seconds"] >= 0
+            print(f"  ✅ 計測: peak {measured['memory_peak_kb']}KB / 並列実行: {skipped['memory_peak_kb']}")
+            for profile in profiles:
+                profile.finish()
+        finally:
+            profiler.stop()
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ プロファイラーテスト完了")
+
+def test_progress_broker():
+    """進捗イベント（処理スレッドで書き込まない・終了した処理の削除）"""
+    print("\n📡 進捗イベントテスト")
+    print("=" * 30)
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="progress_test_"))
+    try:
+        store = ResultStore(str(work_dir / "results.db"))
+        broker = ProgressBroker(store, poll_interval=0.05, retention_seconds=0.5)
+        
+        # 別の接続が書き込みロックを持っていても、発行はストアを待たずに戻る
+        with ResultStore(str(work_dir / "results.db")).transaction():
+            started = time.monotonic()
+            broker.publish("progress_receipt", "run_started", phases=[])
+            broker.publish("progress_receipt", "phase_started", phase="image_processing")
+            publish_seconds = time.monotonic() - started
+            assert publish_seconds < 0.1
+        broker.flush()
+        events = broker.wait_for_events("progress_receipt", 0, timeout=1)
+        assert [event for _, event, _ in events] == ["run_started", "phase_started"]
+        print(f"  ✅ 発行: {publish_seconds * 1000:.1f}ms（書き込みロック中）")
+        
+        # このプロセスで発行したイベントはストアを読まずに返し、別プロセスの購読側はストアから読む
+        progress_events_since = store.progress_events_since
+        store_reads = []
+        def counted_events_since(receipt_id, last_id):
+            store_reads.append(receipt_id)
+            return progress_events_since(receipt_id, last_id)
+        store.progress_events_since = counted_events_since
+        assert broker.wait_for_events("progress_receipt", events[0][0], timeout=1) == events[1:]
+        assert broker.wait_for_events("progress_receipt", events[-1][0], timeout=0.1) == []
+        assert store_reads == []
+        store.progress_events_since = progress_events_since
+        other_process = ProgressBroker(ResultStore(str(work_dir / "results.db")), poll_interval=0.05)
+        assert other_process.wait_for_events("progress_receipt", 0, timeout=1) == events
+        other_process.close()
+        
+        # 新しい処理の開始で前回のイベントを破棄する
+        broker.publish("progress_receipt", "run_completed", status="completed")
+        broker.publish("progress_receipt", "run_started", phases=[])
+        broker.flush()
+        assert [event for _, event, _ in store.progress_events_since("progress_receipt", 0)] == ["run_started"]
+        
+        # 終了から retention_seconds を過ぎた処理のイベントのみ削除する
+        broker.publish("progress_receipt", "run_completed", status="completed")
+        broker.publish("running_receipt", "run_started", phases=[])
+        broker.flush()
+        time.sleep(0.6)
+        assert store.prune_progress_events(ProgressBroker.TERMINAL_EVENTS, datetime.now().isoformat()) == 2
+        assert store.progress_events_since("progress_receipt", 0) == []
+        assert len(store.progress_events_since("running_receipt", 0)) == 1
+        print("  ✅ 終了した処理のイベントを削除")
+        
+        # 停止時に未記録のイベントを書き込む
+        broker.publish("running_receipt", "run_completed", status="completed")
+        broker.close()
+        assert len(store.progress_events_since("running_receipt", 0)) == 2
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ 進捗イベントテスト完了")
+
+def test_web_server():
+    """Webサーバー（配信するファイルの制限・ETag/304・gzip・Range・API のページング・メトリクス）"""
+    print("\n🌐 Webサーバーテスト")
+    print("=" * 30)
+    
+    import functools
+    import http.client
+    
+    work_dir = Path(tempfile.mkdtemp(prefix="web_server_test_"))
+    server = None
+    try:
+        config = _isolated_config(work_dir)
+        for phase in config["processing_flow"]:
+            for step in phase["steps"]:
+                if step["action"] == "load_image":
+                    step["target_file_pattern"] = str(work_dir / "receipts" / "{{receipt_id}}.jpg")
+        (work_dir / "web_ui").mkdir()
+        (work_dir / "web_ui" / "script.js").write_text("console.log('receipt');\n" * 200, encoding='utf-8')
+        (work_dir / "receipts").mkdir()
+        image_bytes = bytes(range(10))
+        (work_dir / "receipts" / "web_receipt.png").write_bytes(image_bytes)
+        (work_dir / "results").mkdir()
+        (work_dir / "results" / "web_receipt_summary.json").write_text("{}", encoding='utf-8')
+        (work_dir / "config.yaml").write_text("google_apis: {}", encoding='utf-8')
+        
+        result_manager = ResultManager(config)
+        for index, currency in enumerate(["USD", "USD", "EUR"]):
+            conversion = {"original_amount": 10.0, "original_currency": currency, "jpy_amount": 1500.0,
+                          "exchange_rate": 150.0, "converted_amounts": {}, "conversion_date": None}
+            result_manager.save_results(_conversion_results(f"web_{index}", [conversion]), f"web_{index}")
+        
+        handler = functools.partial(ReceiptRequestHandler, directory=str(work_dir))
+        job_queue = JobQueue(config)
+        server = ReceiptWebServer(("127.0.0.1", 0), handler, result_manager=result_manager,
+                                  uploader=ReceiptUploader(config), job_queue=job_queue)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        
+        def request(path: str, headers: Optional[Dict[str, str]] = None, body: Optional[bytes] = None):
+            connection = http.client.HTTPConnection("127.0.0.1", server.server_address[1], timeout=10)
+            try:
+                connection.request("GET" if body is None else "POST", path, body=body, headers=headers or {})
+                response = connection.getresponse()
+                return response.status, dict(response.getheaders()), response.read()
+            finally:
+                connection.close()
+        
+        # web_ui/・receipts/・results/ のサマリー以外（結果ストア・設定ファイル）は配信しない
+        assert request("/")[0] == 302
+        assert request("/web_ui/script.js")[0] == 200
+        assert request("/results/web_receipt_summary.json")[0] == 200
+        for path in ("/results.db", "/results.db-wal", "/jobs.db", "/config.yaml", "/receipts/", "/results/../config.yaml"):
+            assert request(path)[0] == 404, path
+        print("  ✅ 配信の制限: *.db・設定ファイルは 404")
+        
+        # ETag・304、gzip
+        status, headers, body = request("/web_ui/script.js", {"Accept-Encoding": "gzip"})
+        assert headers["Content-Encoding"] == "gzip"
+        assert gzip.decompress(body) == (work_dir / "web_ui" / "script.js").read_bytes()
+        assert request("/web_ui/script.js", {"Accept-Encoding": "gzip", "If-None-Match": headers["ETag"]})[0] == 304
+        assert "Content-Encoding" not in request("/web_ui/script.js")[1]
+        print(f"  ✅ gzip: {len(body)}バイト、ETag一致で 304")
+        
+        # Range（複数範囲・If-Range の不一致は全体を返す、満たせない範囲は 416）
+        image_path = "/receipts/web_receipt.png"
+        status, headers, body = request(image_path, {"Range": "bytes=2-4"})
+        assert (status, body, headers["Content-Range"]) == (206, image_bytes[2:5], "bytes 2-4/10")
+        assert request(image_path, {"Range": "bytes=-3"})[2] == image_bytes[-3:]
+        assert request(image_path, {"Range": "bytes=0-1,4-5"})[:3:2] == (200, image_bytes)
+        assert request(image_path, {"Range": "bytes=20-"})[0] == 416
+        etag = headers["ETag"]
+        assert request(image_path, {"Range": "bytes=2-4", "If-Range": etag})[0] == 206
+        assert request(image_path, {"Range": "bytes=2-4", "If-Range": '"stale"'})[:3:2] == (200, image_bytes)
+        print("  ✅ Range: 206・複数範囲は 200・範囲外は 416")
+        
+        # API（ページング・絞り込み）
+        status, _, body = request("/api/receipts?per_page=2&page=2")
+        listing = json.loads(body)
+        assert (status, listing["total"], listing["pages"], len(listing["items"])) == (200, 3, 2, 1)
+        assert json.loads(request("/api/receipts?currency=eur")[2])["total"] == 1
+        assert request("/api/receipts?page=x")[0] == 400
+        assert request("/api/receipts/web_0")[0] == 200 and request("/api/receipts/missing")[0] == 404
+        print(f"  ✅ API: {listing['total']}件 / {listing['pages']}ページ")
+        
+        # 同じ画像のアップロードは、処理を完了するまではジョブを登録し直す（未完了のジョブがあればそのID）
+        def upload_job() -> Optional[str]:
+            body = _multipart("web-boundary", [("receipt.jpg", "image/jpeg", b"web upload image")])
+            status, _, response = request("/api/upload", {"Content-Type": "multipart/form-data; boundary=web-boundary"}, body)
+            assert status == 202
+            return json.loads(response)["uploads"][0]["job_id"]
+        
+        job_id = upload_job()
+        assert job_id is not None and upload_job() == job_id
+        job = job_queue.claim("web-worker")
+        job_queue.complete(job["job_id"], "web-worker")
+        retry_job_id = upload_job()
+        assert retry_job_id not in (None, job_id)
+        result_manager.save_results(_conversion_results(job["receipt_id"], []), job["receipt_id"])
+        assert upload_job() is None
+        print("  ✅ 重複したアップロード: 処理を完了した画像のみジョブを登録しない")
+        
+        # メトリクス（Prometheus テキスト形式）
+        status, headers, body = request("/metrics")
+        lines = body.decode('utf-8').splitlines()
+        assert status == 200 and headers["Content-Type"].startswith("text/plain; version=0.0.4")
+        assert any(line.startswith("# TYPE ") and line.endswith(" counter") for line in lines)
+        assert all(line.startswith("#") or len(line.rsplit(" ", 1)) == 2 for line in lines if line)
+        print(f"  ✅ メトリクス: {len(lines)}行")
+        result_manager.close()
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(work_dir, ignore_errors=True)
+    
+    print("\n✅ Webサーバーテスト完了")
 
 if __name__ == "__main__":
     # メインシステムテスト
@@ -189,6 +1387,26 @@ if __name__ == "__main__":
     if success:
         # 個別モジュールテスト
         test_individual_modules()
+        test_currency_bulk()
+        test_exchange_rate_cache()
+        test_fake_vision_without_library()
+        test_gemini_extraction()
+        test_receipt_corpus()
+        test_config_cache()
+        test_step_checkpoints()
+        test_rate_limiter()
+        test_circuit_breaker()
+        test_json_logging()
+        test_export_conversions()
+        test_result_compaction()
+        test_stats_and_expenses()
+        test_archive_import()
+        test_job_queue()
+        test_progress_broker()
+        test_receipt_upload()
+        test_profiler()
+        test_image_index()
+        test_web_server()
         
         print("\n📝 次のステップ:")
         print("1. APIキーを設定して本格的なテストを実行")
@@ -17,13 +17,30 @@ class ReceiptResultViewer {
 
     async loadData() {
         // 最新のサマリーファイルを読み込み
-        const response = await fetch('/results/test_receipt_001_summary.json');
+        const receiptId = await this.findLatestReceiptId();
+        const response = await fetch(`/results/${encodeURIComponent(receiptId)}_summary.json`);
         if (!response.ok) {
             throw new Error(`HTTP error! status: ${response.status}`);
         }
         this.data = await response.json();
     }
 
+    async findLatestReceiptId() {
+        // レシート一覧APIから最新のレシートを取得（APIがない場合は従来のテスト用レシート）
+        try {
+            const response = await fetch('/api/receipts?per_page=1');
+            if (response.ok) {
+                const listing = await response.json();
+                if (listing.items && listing.items.length > 0) {
+                    return listing.items[0].receipt_id;
+                }
+            }
+        } catch (error) {
+            console.warn('レシート一覧APIを利用できません:', error);
+        }
+        return 'test_receipt_001';
+    }
+
     displayData() {
         this.hideLoading();
         this.displayReceiptInfo();